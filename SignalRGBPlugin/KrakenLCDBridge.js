@@ -2,7 +2,7 @@ export function Name() {
   return 'Kraken LCD Bridge';
 }
 export function Version() {
-  return '0.0.2';
+  return '0.0.4';
 }
 export function Type() {
   return 'network';
@@ -79,7 +79,7 @@ const parameters = {
     group: '',
     label: 'Format',
     type: 'combobox',
-    values: ['PNG', 'JPEG'],
+    values: ['PNG', 'JPEG', 'RAW'],
     default: 'PNG',
   },
   colorPalette: {
@@ -231,7 +231,18 @@ discovery: readonly
 */
 
 const BRIDGE_ADDRESS = 'http://127.0.0.1:30003';
+// overlay settings are re-sent periodically so a restarted bridge picks them up
+const OVERLAY_CONFIG_REFRESH_MS = 5000;
+// /stream record types, see STREAM_RECORD in signalrgb.py
+const STREAM_CONFIG = 1;
+const STREAM_FRAME = 2;
+const STREAM_RETRY_MS = 5000;
 let nextCall = 0;
+let stream = null;
+let streamConfig = {};
+let nextStreamAttempt = 0;
+let lastOverlayConfig = '';
+let nextOverlayConfig = 0;
 let lastGifPath = '';
 let lastGifRotation = '0';
 let lastGifFps = '';
@@ -424,24 +435,8 @@ export function Initialize() {
   }
 }
 
-export function Render() {
-  if (!controller.online || Date.now() < nextCall) {
-    return false;
-  }
-
-  const sz = device.getProperty('screenSize')?.value ?? 40;
-  const fmt = device.getProperty('imageFormat')?.value ?? 'PNG';
-
-  const RGBData = device.getImageBuffer(0, 0, sz, sz, {
-    flipH: false,
-    outputWidth: sz,
-    outputHeight: sz,
-    format: fmt,
-  });
-
-  const data = {
-    raw: XmlHttp.Bytes2Base64(RGBData),
-    rotation: device.rotation,
+function _buildOverlayConfig() {
+  return {
     colorPalette: device.getProperty('colorPalette')?.value ?? saved.colorPalette,
     composition: device.getProperty('composition')?.value ?? saved.composition,
     overlayTransparency: device.getProperty('overlayTransparency')?.value ?? saved.overlayTransparency,
@@ -453,6 +448,108 @@ export function Render() {
     sensorLabelFontSize: device.getProperty('sensorLabelFontSize')?.value ?? saved.sensorLabelFontSize,
     sensorSource: device.getProperty('sensorSource')?.value ?? saved.sensorSource,
   };
+}
+
+function _sendOverlayConfig(config) {
+  const serialized = JSON.stringify(config);
+  if (serialized === lastOverlayConfig && Date.now() < nextOverlayConfig) {
+    return;
+  }
+  lastOverlayConfig = serialized;
+  nextOverlayConfig = Date.now() + OVERLAY_CONFIG_REFRESH_MS;
+  XmlHttp.Post(BRIDGE_ADDRESS + '/overlay/config', () => {}, config, false);
+}
+
+function _openStream() {
+  if (
+    stream ||
+    !controller.stream ||
+    typeof WebSocket === 'undefined' ||
+    Date.now() < nextStreamAttempt
+  ) {
+    return;
+  }
+  nextStreamAttempt = Date.now() + STREAM_RETRY_MS;
+  try {
+    const socket = new WebSocket(BRIDGE_ADDRESS.replace('http', 'ws') + controller.stream);
+    socket.binaryType = 'arraybuffer';
+    socket.onopen = () => {
+      // a new connection starts from the bridge defaults, send everything
+      streamConfig = {};
+    };
+    socket.onclose = () => {
+      if (stream === socket) {
+        stream = null;
+      }
+    };
+    stream = socket;
+  } catch (error) {
+    stream = null;
+    device.log('WebSocket unavailable, streaming over HTTP');
+  }
+}
+
+function _configDelta(config, previous) {
+  const delta = {};
+  let changed = false;
+  for (const key in config) {
+    if (config[key] !== previous[key]) {
+      delta[key] = config[key];
+      changed = true;
+    }
+  }
+  return changed ? delta : null;
+}
+
+function _utf8(text) {
+  const encoded = unescape(encodeURIComponent(text));
+  const bytes = new Uint8Array(encoded.length);
+  for (let i = 0; i < encoded.length; i++) {
+    bytes[i] = encoded.charCodeAt(i);
+  }
+  return bytes;
+}
+
+function _streamMessage(delta, width, height, rotation, pixels) {
+  const config = delta ? _utf8(JSON.stringify(delta)) : null;
+  const configSize = config ? 5 + config.length : 0;
+  const message = new Uint8Array(configSize + 11 + pixels.length);
+  const view = new DataView(message.buffer);
+  if (config) {
+    view.setUint8(0, STREAM_CONFIG);
+    view.setUint32(1, config.length, true);
+    message.set(config, 5);
+  }
+  view.setUint8(configSize, STREAM_FRAME);
+  view.setUint32(configSize + 1, 6 + pixels.length, true);
+  view.setUint16(configSize + 5, width, true);
+  view.setUint16(configSize + 7, height, true);
+  view.setInt16(configSize + 9, rotation, true);
+  message.set(pixels, configSize + 11);
+  return message.buffer;
+}
+
+export function Render() {
+  if (!controller.online || Date.now() < nextCall) {
+    return false;
+  }
+
+  const sz = device.getProperty('screenSize')?.value ?? 40;
+  let fmt = device.getProperty('imageFormat')?.value ?? 'PNG';
+  if (fmt === 'RAW' && !controller.rawFrames) {
+    // older bridges only understand base64 encoded images
+    fmt = 'PNG';
+  }
+
+  const options = {
+    flipH: false,
+    outputWidth: sz,
+    outputHeight: sz,
+  };
+  if (fmt !== 'RAW') {
+    options.format = fmt;
+  }
+  const RGBData = device.getImageBuffer(0, 0, sz, sz, options);
 
   const fpsConfig = device.getProperty('fps')?.value;
   if (Number(fpsConfig)) {
@@ -460,6 +557,29 @@ export function Render() {
   }
 
   const async = fpsConfig === 'MAXIMUM';
+  if (controller.rawFrames) {
+    _openStream();
+    if (stream && stream.readyState === 1) {
+      const config = _buildOverlayConfig();
+      const delta = _configDelta(config, streamConfig);
+      streamConfig = config;
+      const side = fmt === 'RAW' ? sz : 0;
+      stream.send(_streamMessage(delta, side, side, device.rotation, RGBData));
+      return;
+    }
+
+    _sendOverlayConfig(_buildOverlayConfig());
+    let query = `rotation=${device.rotation}`;
+    if (fmt === 'RAW') {
+      query += `&width=${sz}&height=${sz}`;
+    }
+    XmlHttp.PostBytes(`${BRIDGE_ADDRESS}/frame/raw?${query}`, () => {}, RGBData, async);
+    return;
+  }
+
+  const data = _buildOverlayConfig();
+  data.raw = XmlHttp.Bytes2Base64(RGBData);
+  data.rotation = device.rotation;
   XmlHttp.Post(BRIDGE_ADDRESS + '/frame', () => {}, data, async);
 }
 
@@ -514,6 +634,8 @@ class KrakenLCDBridgeController {
     this.resolution = info.resolution;
     this.renderingMode = info.renderingMode;
     this.image = info.image;
+    this.rawFrames = info.rawFrames === true;
+    this.stream = info.stream ?? '';
     this.online = true;
     this.lastUpdate = Date.now();
     this.announcedController = false;
@@ -598,4 +720,13 @@ class XmlHttp {
     xhr.onreadystatechange = callback.bind(null, xhr);
     xhr.send(JSON.stringify(data));
   }
+
+  static PostBytes(url, callback, bytes, async = true) {
+    const xhr = new XMLHttpRequest();
+    xhr.timeout = 1000;
+    xhr.open('POST', url, async);
+    xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+    xhr.onreadystatechange = callback.bind(null, xhr);
+    xhr.send(new Uint8Array(bytes).buffer);
+  }
 }
@@ -0,0 +1,798 @@
+import base64
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageFont, ImageSequence
+
+import driver
+import q565
+from framebuffer import CircleMask, packRGBX
+from gifprep import GifPreparer, fitFrame, loadFrames, meanSquaredError
+from overlay import OVERLAY_DEFAULTS, OverlayRenderer
+from pipeline import ParallelDecoder, decodeFrame
+from spinner import SpinnerRenderer
+from textsprites import TextSprites
+from transport import SimulatedTransport
+from utils import argValue
+
+
+def measure(func, *args, repeat=20):
+    # warm up once so lazy PIL initialisation does not skew the first sample
+    result = func(*args)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return result, (time.perf_counter() - start) * 1000 / repeat
+
+
+def testImage(size) -> Image.Image:
+    return Image.effect_noise(size, 64).convert("RGBA")
+
+
+def legacyPackRGBX(img: Image.Image) -> bytes:
+    raw = list(img.convert("RGB").getdata())
+    output = []
+    for i in range(img.size[0] * img.size[1]):
+        output.append(raw[i][0])
+        output.append(raw[i][1])
+        output.append(raw[i][2])
+        output.append(0)
+    return bytes(output)
+
+
+def benchRGBA():
+    img = testImage((320, 320))
+    expected, legacyTime = measure(legacyPackRGBX, img, repeat=5)
+    # the driver hands the same buffer back every frame
+    output, packTime = measure(packRGBX, img, bytearray(320 * 320 * 4))
+    if output != expected:
+        raise Exception("packRGBX output differs from the legacy loop")
+    print(
+        "RGBA 320x320: legacy {:8.2f}ms, packRGBX {:6.2f}ms ({:.0f}x)".format(
+            legacyTime, packTime, legacyTime / packTime
+        )
+    )
+
+
+def legacyMaskRGB(img: Image.Image, black: Image.Image, mask: Image.Image) -> bytes:
+    return Image.composite(img, black, mask).convert("RGB").tobytes()
+
+
+def circleMaskRGB(img: Image.Image, mask: CircleMask) -> bytearray:
+    return mask.apply(bytearray(img.convert("RGB").tobytes()), 3)
+
+
+def benchMask():
+    for size in [(320, 320), (640, 640)]:
+        img = testImage(size)
+        black = Image.new("RGBA", size, (0, 0, 0, 0))
+        mask = Image.new("RGBA", size, (0, 0, 0, 0))
+        ImageDraw.Draw(mask).ellipse([(0, 0), size], fill=(255, 255, 255, 255))
+        circleMask = CircleMask(size)
+
+        expected, legacyTime = measure(legacyMaskRGB, img, black, mask)
+        output, maskTime = measure(circleMaskRGB, img, circleMask)
+        if output != expected:
+            raise Exception("CircleMask output differs from Image.composite")
+        print(
+            "Mask {}x{}: composite {:6.2f}ms, CircleMask {:6.2f}ms ({} runs)".format(
+                *size, legacyTime, maskTime, len(circleMask.outsideRuns(3))
+            )
+        )
+
+
+def benchQ565Encoder():
+    try:
+        import q565_rust
+    except ImportError:
+        print("Q565 encoder: q565_rust is not installed, skipping")
+        return
+
+    for size in [(320, 320), (640, 640)]:
+        rgb = testImage(size).convert("RGB").tobytes()
+        encoder = q565_rust.Q565Encoder(*size)
+        output = bytearray(encoder.capacity)
+
+        expected, encodeTime = measure(q565_rust.py_encode, *size, rgb)
+        written, encodeIntoTime = measure(encoder.encode_into, rgb, output)
+        if output[:written] != expected:
+            raise Exception("Q565Encoder output differs from py_encode")
+        print(
+            "Q565 {}x{}: py_encode {:6.2f}ms, encode_into {:6.2f}ms "
+            "(reported {:6.2f}ms, {} bytes)".format(
+                *size,
+                encodeTime,
+                encodeIntoTime,
+                encoder.last_encode_time * 1000,
+                encoder.last_bytes_written,
+            )
+        )
+
+
+def benchRGB565():
+    try:
+        import q565_rust
+    except ImportError:
+        print("RGB565: q565_rust is not installed, skipping")
+        return
+
+    for side in [320, 640, 1280]:
+        img = testImage((side, side))
+        inputs = {
+            "RGB": img.convert("RGB").tobytes(),
+            "RGBA": img.tobytes(),
+            "BGRA": img.tobytes("raw", "BGRA"),
+        }
+        reference = q565_rust.py_to_rgb565(inputs["RGB"], "RGB", False)
+        for pixelFormat, data in inputs.items():
+            serial, serialTime = measure(
+                q565_rust.py_to_rgb565, data, pixelFormat, False
+            )
+            threaded, threadedTime = measure(
+                q565_rust.py_to_rgb565, data, pixelFormat, True
+            )
+            if serial != reference or threaded != reference:
+                raise Exception(f"{pixelFormat} RGB565 conversion mismatch")
+            print(
+                "RGB565 {0}x{0} {1:4}: serial {2:6.2f}ms, rayon {3:6.2f}ms".format(
+                    side, pixelFormat, serialTime, threadedTime
+                )
+            )
+
+
+def benchPythonQ565():
+    try:
+        import q565_rust
+    except ImportError:
+        q565_rust = None
+
+    numpy = q565.numpy
+    for size in [(320, 320), (640, 640)]:
+        rgb = testImage(size).convert("RGB").tobytes()
+        output, numpyTime = measure(q565.encode, rgb, *size, repeat=3)
+        q565.numpy = None
+        try:
+            pureOutput, pureTime = measure(q565.encode, rgb, *size, repeat=3)
+        finally:
+            q565.numpy = numpy
+        if pureOutput != output:
+            raise Exception("numpy and pure python Q565 output differ")
+
+        line = "Python Q565 {}x{}: numpy {:7.2f}ms, pure {:7.2f}ms".format(
+            *size, numpyTime, pureTime
+        )
+        if q565_rust is not None:
+            if q565_rust.py_encode(*size, rgb) != output:
+                raise Exception("python Q565 output differs from q565_rust")
+            line += ", identical to q565_rust"
+        print(line)
+
+
+def gradientCanvas(size, seed: int) -> Image.Image:
+    # SignalRGB sends a small (40x40 by default) capture of its effect canvas
+    rng = random.Random(seed)
+    canvas = Image.new("RGB", (40, 40))
+    draw = ImageDraw.Draw(canvas)
+    start = [rng.randrange(256) for _ in range(3)]
+    end = [rng.randrange(256) for _ in range(3)]
+    for x in range(40):
+        color = tuple(s + (e - s) * x // 39 for s, e in zip(start, end))
+        draw.line([(x, 0), (x, 39)], fill=color)
+    canvas = canvas.rotate(rng.randrange(360)).filter(ImageFilter.GaussianBlur(2))
+    return canvas.resize(size, Image.Resampling.LANCZOS)
+
+
+def screenshots(size):
+    directory = argValue("screenshots")
+    if directory:
+        for name in sorted(os.listdir(directory)):
+            try:
+                img = Image.open(os.path.join(directory, name)).convert("RGB")
+            except Exception:
+                continue
+            yield name, img.resize(size, Image.Resampling.LANCZOS)
+        return
+    try:
+        from mss import mss
+
+        with mss() as sct:
+            for index, monitor in enumerate(sct.monitors[1:]):
+                shot = sct.grab(monitor)
+                img = Image.frombytes("RGB", shot.size, shot.rgb)
+                yield f"monitor {index + 1}", img.resize(size, Image.Resampling.LANCZOS)
+    except Exception as exc:
+        print(f"no screenshots available ({exc}), pass --screenshots=<dir>")
+
+
+def benchQ565Ratio():
+    try:
+        from q565_rust import Q565Encoder
+    except ImportError:
+        Q565Encoder = q565.Q565Encoder
+
+    size = (640, 640)
+    mask = CircleMask(size)
+    plain = Q565Encoder(*size)
+    indexed = Q565Encoder(*size, diff_indexed=True)
+    corpora = {
+        "gradients": ((f"gradient {i}", gradientCanvas(size, i)) for i in range(20)),
+        "screenshots": screenshots(size),
+    }
+    for corpus, images in corpora.items():
+        raw = plainSize = indexedSize = count = 0
+        for name, img in images:
+            rgb = mask.apply(bytearray(img.convert("RGB").tobytes()), 3)
+            raw += len(rgb)
+            plainSize += len(plain.encode(rgb))
+            indexedSize += len(indexed.encode(rgb))
+            count += 1
+        if not count:
+            continue
+        print(
+            "Q565 {:11} ({:2} frames): {:8} bytes/frame, with DIFF_INDEXED "
+            "{:8} bytes/frame ({:+.1f}%), ratio {:.1f}:1".format(
+                corpus,
+                count,
+                plainSize // count,
+                indexedSize // count,
+                (indexedSize - plainSize) * 100 / plainSize,
+                raw / indexedSize,
+            )
+        )
+
+
+def signalrgbPayloads(count: int, side=40):
+    # /frame bodies as the plugin posts them with its default settings
+    payloads = []
+    for seed in range(count):
+        png = BytesIO()
+        gradientCanvas((side, side), seed).save(png, "PNG")
+        body = {"raw": base64.b64encode(png.getvalue()).decode("ascii"), "rotation": 0}
+        payloads.append(json.dumps(body).encode("utf-8"))
+    return payloads
+
+
+def benchPipeline():
+    resolution = (640, 640)
+    payloads = signalrgbPayloads(120)
+
+    start = time.perf_counter()
+    for payload in payloads:
+        decodeFrame(payload, resolution)[1].tobytes()
+    inlineFPS = len(payloads) / (time.perf_counter() - start)
+    print("Decode 40x40 -> 640x640: inline {:6.1f} FPS".format(inlineFPS))
+
+    for processes in (False, True):
+        for workers in (1, 2, 4, 8):
+            decoder = ParallelDecoder(resolution, workers, processes)
+            # first frame starts the workers, keep that out of the measurement
+            decoder.submit(payloads[0])
+            decoder.next()
+
+            start = time.perf_counter()
+            for payload in payloads:
+                if decoder.busy():
+                    decoder.next()[2].tobytes()
+                decoder.submit(payload)
+            while not decoder.idle():
+                decoder.next()[2].tobytes()
+            fps = len(payloads) / (time.perf_counter() - start)
+            decoder.close()
+            print(
+                "Decode 40x40 -> 640x640: {} {} workers {:6.1f} FPS ({:.2f}x)".format(
+                    workers,
+                    "process" if processes else "thread ",
+                    fps,
+                    fps / inlineFPS,
+                )
+            )
+
+
+class LegacySpinner:
+    def __init__(self, size):
+        self.size = size
+        self.circleImg = Image.new("RGBA", size, (0, 0, 0, 0))
+        self.lastAngle = 0
+
+    def render(self, angle, alpha, rotation):
+        bands = list(self.circleImg.split())
+        bands[3] = bands[3].point(lambda x: round(x / 1.1) if x > 10 else 0)
+        self.circleImg = Image.merge(self.circleImg.mode, bands)
+        circleCanvas = ImageDraw.Draw(self.circleImg)
+        newAngle = self.lastAngle + angle
+        for start, end, fill in [
+            (self.lastAngle, self.lastAngle + angle / 2, round(alpha / 1.05)),
+            (self.lastAngle + angle / 2, newAngle, alpha),
+        ]:
+            circleCanvas.arc(
+                [(0, 0), self.size],
+                fill=(255, 255, 255, fill),
+                width=self.size[0] // 20,
+                start=start,
+                end=end,
+            )
+        self.lastAngle = newAngle
+        overlay = Image.new("RGBA", self.size, (0, 0, 0, 0))
+        overlay.paste(self.circleImg)
+        return overlay.rotate(rotation)
+
+
+def benchSpinner():
+    for size in [(320, 320), (640, 640)]:
+        legacy = LegacySpinner(size)
+        start = time.perf_counter()
+        renderer = SpinnerRenderer(size)
+        setupTime = (time.perf_counter() - start) * 1000
+        _, legacyTime = measure(legacy.render, 11, 255, 90, repeat=50)
+        _, spinnerTime = measure(renderer.render, 11, 255, 90, repeat=50)
+        print(
+            "Spinner {}x{}: legacy {:6.2f}ms, polar sprite {:6.2f}ms "
+            "(one-off setup {:.0f}ms)".format(
+                *size, legacyTime, spinnerTime, setupTime
+            )
+        )
+
+
+FONT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts/Rubik-Bold.ttf")
+# (text, size, anchor, position as a fraction of the LCD size) for the default overlay
+OVERLAY_TEXT = [
+    ("SignalRGB", 40, "mm", (1 / 2, 1 / 5)),
+    ("31", 160, "mm", (1 / 2, 1 / 2)),
+    ("°", 53, "lt", (0.62, 0.38)),
+    ("Liquid", 40, "mm", (1 / 2, 4 / 5)),
+]
+
+
+def drawTextLegacy(size, fonts):
+    layer = Image.new("RGBA", size, (0, 0, 0, 0))
+    canvas = ImageDraw.Draw(layer)
+    for text, fontSize, anchor, (x, y) in OVERLAY_TEXT:
+        canvas.text(
+            (int(size[0] * x), int(size[1] * y)),
+            text=text,
+            anchor=anchor,
+            font=fonts[fontSize],
+            fill=(255, 255, 255, 255),
+        )
+    return layer
+
+
+def drawTextSprites(size, sprites: TextSprites):
+    layer = Image.new("RGBA", size, (0, 0, 0, 0))
+    for text, fontSize, anchor, (x, y) in OVERLAY_TEXT:
+        sprites.draw(
+            layer,
+            (int(size[0] * x), int(size[1] * y)),
+            text,
+            fontSize,
+            (255, 255, 255, 255),
+            anchor,
+        )
+    return layer
+
+
+def benchText():
+    size = (640, 640)
+
+    def loadFonts():
+        return {
+            fontSize: ImageFont.truetype(FONT_FILE, fontSize)
+            for _, fontSize, _, _ in OVERLAY_TEXT
+        }
+
+    fonts, loadTime = measure(loadFonts)
+    sprites = TextSprites(FONT_FILE)
+    expected, legacyTime = measure(drawTextLegacy, size, fonts)
+    output, spriteTime = measure(drawTextSprites, size, sprites)
+    _, emptyTime = measure(Image.new, "RGBA", size, (0, 0, 0, 0))
+    if ImageChops.difference(expected, output).getbbox() is not None:
+        raise Exception("TextSprites output differs from ImageDraw.text")
+    print(
+        "Text 640x640 (4 strings): ImageDraw.text {:6.2f}ms (+{:.2f}ms loading "
+        "fonts), sprites {:6.2f}ms, of which {:.2f}ms is the blank layer".format(
+            legacyTime, loadTime, spriteTime, emptyTime
+        )
+    )
+
+
+# (rendering mode, device) pairs replayed by the e2e benchmark. FAST_GIF has
+# no write path in the driver, GIF frames go through the Z3's bucket upload
+E2E_TARGETS = [
+    (driver.RENDERING_MODE.RGBA, 0x3008),
+    (driver.RENDERING_MODE.GIF, 0x3008),
+    (driver.RENDERING_MODE.Q565, 0x300C),
+]
+E2E_STAGES = ["decode", "overlay", "encode", "write"]
+E2E_STATS = {"cpu": 35, "pump": 60, "liquid": 31.4, "cpu_temp": 55, "gpu_temp": None}
+
+
+def percentile(samples, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def replayPayloads(count: int):
+    # bodies saved by `signalrgb.py --record=DIR`, or generated ones
+    directory = argValue("replay")
+    if not directory:
+        return signalrgbPayloads(count)
+    payloads = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "rb") as file:
+            payloads.append(file.read())
+    return payloads
+
+
+def simulatedLcd(mode, pid) -> driver.KrakenLCD:
+    dev = next(dev for dev in driver.SUPPORTED_DEVICES if dev["pid"] == pid)
+    lcd = driver.KrakenLCD(
+        SimulatedTransport(dev["pid"], dev["resolution"], dev["totalBuckets"])
+    )
+    lcd.renderingMode = mode
+    lcd.setupStream()
+    return lcd
+
+
+def replayFrame(renderer: OverlayRenderer, settings, payload, times=None):
+    """Push one /frame body through every stage, recording stage times in ms."""
+    stamps = [time.perf_counter()]
+    frameSettings, img = renderer.parseFrame(payload)
+    stamps.append(time.perf_counter())
+    data = {**settings, **frameSettings}
+    img = renderer.composeFrame(data, img)
+    stamps.append(time.perf_counter())
+    frame = renderer.encodeFrame(img, adaptive=data["colorPalette"] == "ADAPTIVE")
+    stamps.append(time.perf_counter())
+    if not renderer.lcd.writeFrame(frame):
+        raise Exception("simulated device rejected the frame")
+    stamps.append(time.perf_counter())
+    if times is not None:
+        for stage, start, end in zip(E2E_STAGES, stamps, stamps[1:]):
+            times[stage].append((end - start) * 1000)
+    return frame
+
+
+def benchEndToEnd():
+    """
+    Replay /frame bodies through decode, overlay, encode and a simulated
+    device write for every rendering mode and composition. Latencies are in
+    ms; allocKiB is the tracemalloc peak per frame, which covers python
+    objects such as the encoded frames but not Pillow's own image buffers.
+    --json=FILE saves the results for comparison between releases.
+    """
+    payloads = replayPayloads(int(argValue("frames", 60)))
+    allocFrames = min(len(payloads), 10)
+    results = []
+    for mode, pid in E2E_TARGETS:
+        for composition in ("OFF", "OVERLAY", "MIX"):
+            lcd = simulatedLcd(mode, pid)
+            renderer = OverlayRenderer(lcd, FONT_FILE, E2E_STATS)
+            settings = {**OVERLAY_DEFAULTS, "composition": composition, "spinner": "CPU"}
+            # first frame fills the overlay caches and starts the encoder
+            replayFrame(renderer, settings, payloads[0])
+
+            times = {stage: [] for stage in E2E_STAGES}
+            frameSize = 0
+            start = time.perf_counter()
+            for payload in payloads:
+                frameSize += len(replayFrame(renderer, settings, payload, times))
+            elapsed = time.perf_counter() - start
+
+            tracemalloc.start()
+            peak = 0
+            for payload in payloads[:allocFrames]:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                replayFrame(renderer, settings, payload)
+                peak += tracemalloc.get_traced_memory()[1] - base
+            tracemalloc.stop()
+
+            result = {
+                "mode": mode.value,
+                "device": lcd.name,
+                "composition": composition,
+                "frames": len(payloads),
+                "fps": len(payloads) / elapsed,
+                "frameBytes": frameSize // len(payloads),
+                "allocKiB": peak / allocFrames / 1024,
+                "stages": {
+                    stage: {
+                        "p50": percentile(samples, 0.50),
+                        "p95": percentile(samples, 0.95),
+                        "p99": percentile(samples, 0.99),
+                    }
+                    for stage, samples in times.items()
+                },
+            }
+            results.append(result)
+            print(
+                "E2E {:4} {:7} {:6.1f} FPS, {:7} bytes/frame, {:7.0f} KiB/frame | {}".format(
+                    result["mode"],
+                    composition,
+                    result["fps"],
+                    result["frameBytes"],
+                    result["allocKiB"],
+                    " ".join(
+                        "{} {:.1f}/{:.1f}/{:.1f}".format(
+                            stage, value["p50"], value["p95"], value["p99"]
+                        )
+                        for stage, value in result["stages"].items()
+                    ),
+                )
+            )
+
+    path = argValue("json")
+    if path:
+        report = {
+            "python": sys.version.split()[0],
+            "q565Encoder": driver.Q565Encoder.__module__,
+            "bandwidth": lcd.transport.bandwidth,
+            "latency": lcd.transport.latency,
+            "results": results,
+        }
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        print("E2E results written to {}".format(path))
+
+
+def animatedGif(path: str, frames: int, size=(480, 270)):
+    # a moving gradient under a bouncing disc, about as hard to quantize as
+    # the GIFs people pick for their pumps
+    images = []
+    for index in range(frames):
+        img = gradientCanvas(size, index // 10)
+        x = (index * 7) % size[0]
+        ImageDraw.Draw(img).ellipse(
+            [(x - 40, size[1] // 2 - 40), (x + 40, size[1] // 2 + 40)],
+            fill=(255, 220, 40),
+        )
+        images.append(img.quantize(128))
+    images[0].save(path, "GIF", save_all=True, append_images=images[1:], duration=40, loop=0)
+
+
+def legacyGifPass(path: str, resolution, colors: int) -> bytes:
+    # what every binary search pass of GifPlayer._prepare_gif used to redo
+    img = Image.open(path)
+    newFrames = []
+    for frame in ImageSequence.Iterator(img):
+        frame = frame.convert("RGB").rotate(0)
+        frame = fitFrame(frame, resolution)
+        pal = frame.quantize(colors)
+        newFrames.append(frame.quantize(colors, palette=pal, dither=Image.FLOYDSTEINBERG))
+    om = newFrames[0]
+    om.info = img.info
+    byteio = BytesIO()
+    om.save(byteio, "GIF", interlace=False, optimize=True, save_all=True, append_images=newFrames[1:])
+    return byteio.getvalue()
+
+
+def gifPixels(data: bytes):
+    """RGB pixels of every frame of a GIF as displayed."""
+    with Image.open(BytesIO(data)) as img:
+        return [frame.convert("RGB").tobytes() for frame in ImageSequence.Iterator(img)]
+
+
+def benchGif():
+    frameCount = int(argValue("gif-frames", 300))
+    resolution = (640, 640)
+    path = os.path.join(tempfile.gettempdir(), "kraken-benchmark-{}.gif".format(frameCount))
+    if not os.path.exists(path):
+        animatedGif(path, frameCount)
+
+    start = time.perf_counter()
+    expected = legacyGifPass(path, resolution, 136)
+    legacyPass = time.perf_counter() - start
+
+    start = time.perf_counter()
+    frames, info = loadFrames(path, resolution)
+    loadTime = time.perf_counter() - start
+    maxSize = 20 * 1024 * 1024
+    exactPasses = []
+    passes = []
+    preparer = GifPreparer(frames, info, workers=1)
+    try:
+        if gifPixels(preparer.encode(136)) != gifPixels(expected):
+            raise Exception("GifPreparer frames differ from the legacy pass")
+
+        def exact(colors):
+            size = len(preparer.encode(colors))
+            exactPasses.append((colors, size))
+            return size
+
+        start = time.perf_counter()
+        exactColors = preparer.search(maxSize, exact)
+        exactTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        gifData = preparer.fit(maxSize, log=lambda *run: passes.append(run))
+        fitTime = time.perf_counter() - start
+
+        # how far off the estimates of the exactly searched palettes are
+        errors = [
+            abs(preparer.estimate(colors) - size) / size for colors, size in exactPasses
+        ]
+    finally:
+        preparer.close()
+    fullPasses = [run for run in passes if run[3] is not None]
+    print(
+        "GIF {} frames -> 640x640: legacy {:6.2f}s/pass, {} passes {:7.2f}s | "
+        "decode once {:5.2f}s + {:6.2f}s/pass, {:7.2f}s ({:.1f}x)".format(
+            frameCount,
+            legacyPass,
+            len(exactPasses),
+            legacyPass * len(exactPasses),
+            loadTime,
+            exactTime / len(exactPasses),
+            loadTime + exactTime,
+            legacyPass * len(exactPasses) / (loadTime + exactTime),
+        )
+    )
+    print(
+        "GIF {} frames -> 640x640: exact search {} colors {:7.2f}s | estimated {} colors "
+        "{:7.2f}s, {} estimates + {} full ({:.1f}x), estimate error mean {:.1%} max {:.1%}, "
+        "{:.1f} KB".format(
+            frameCount,
+            exactColors,
+            exactTime,
+            passes[-1][1],
+            fitTime,
+            len(passes) - len(fullPasses),
+            len(fullPasses),
+            exactTime / fitTime,
+            sum(errors) / len(errors),
+            max(errors),
+            len(gifData) / 1024,
+        )
+    )
+
+    for processes in (False, True):
+        for workers in (2, 4):
+            preparer = GifPreparer(frames, info, workers, processes)
+            try:
+                preparer.quantize(16)  # starts the workers
+                start = time.perf_counter()
+                preparer.encode(136)
+                passTime = time.perf_counter() - start
+            finally:
+                preparer.close()
+            print(
+                "GIF {} frames -> 640x640: {} {} workers {:6.2f}s/pass".format(
+                    frameCount, workers, "process" if processes else "thread ", passTime
+                )
+            )
+
+
+def corpusGifs(frameCount: int, size=(480, 270)):
+    """Generated animations from mostly static to changing everywhere, in the temp dir."""
+    paths = []
+    background = gradientCanvas(size, 7)
+    for kind in ("spinner", "disc", "scroll"):
+        path = os.path.join(
+            tempfile.gettempdir(), "kraken-corpus-{}-{}.gif".format(kind, frameCount)
+        )
+        paths.append(path)
+        if kind == "disc":
+            if not os.path.exists(path):
+                animatedGif(path, frameCount, size)
+            continue
+        if os.path.exists(path):
+            continue
+        images = []
+        for index in range(frameCount):
+            if kind == "spinner":
+                # a still picture with a small busy spot
+                img = background.copy()
+                angle = math.radians(index * 12)
+                center = (size[0] // 2 + 60, size[1] // 2)
+                ImageDraw.Draw(img).line(
+                    [center, (center[0] + 30 * math.cos(angle), center[1] + 30 * math.sin(angle))],
+                    fill=(255, 255, 255),
+                    width=4,
+                )
+            else:
+                # every pixel changes every frame
+                img = gradientCanvas(size, index)
+            images.append(img.quantize(128))
+        images[0].save(path, "GIF", save_all=True, append_images=images[1:], duration=40, loop=0)
+    return paths
+
+
+def gifPsnr(frames, gifData: bytes):
+    """PSNR in dB of the decoded GIF against the frames it was prepared from."""
+    output = Image.open(BytesIO(gifData))
+    if output.n_frames != len(frames):
+        # repeated frames were merged, they no longer line up
+        return None
+    mse = meanSquaredError(frames, ImageSequence.Iterator(output))
+    return 10 * math.log10(255 * 255 / mse) if mse else math.inf
+
+
+def benchGifPalette():
+    frameCount = int(argValue("gif-frames", 300))
+    corpus = argValue("gif-corpus")
+    if corpus:
+        paths = sorted(
+            os.path.join(corpus, name) for name in os.listdir(corpus) if name.lower().endswith(".gif")
+        )
+    else:
+        paths = corpusGifs(frameCount)
+    pid = 0x300C
+    dev = next(dev for dev in driver.SUPPORTED_DEVICES if dev["pid"] == pid)
+    resolution = dev["resolution"]
+    # --gif-bucket=MB emulates a tighter bucket to see the palette sizes each fits
+    maxSize = int(float(argValue("gif-bucket", dev["maxBucketSize"] / 1024 / 1024)) * 1024 * 1024)
+
+    for path in paths:
+        frames, info = loadFrames(path, resolution)
+        for globalPalette in (False, True):
+            passes = []
+            preparer = GifPreparer(frames, info, globalPalette=globalPalette)
+            try:
+                start = time.perf_counter()
+                gifData = preparer.fit(maxSize, log=lambda *run: passes.append(run))
+                prepareTime = time.perf_counter() - start
+            finally:
+                preparer.close()
+            if not globalPalette:
+                palettes = "frame palettes"
+            elif preparer.shared:
+                palettes = "global palette"
+            else:
+                # rejected on the sampled frames
+                palettes = "global->frame"
+
+            lcd = simulatedLcd(driver.RENDERING_MODE.GIF, pid)
+            start = time.perf_counter()
+            if not lcd.createBucket(0, size=len(gifData)) or not lcd.writeGIF(gifData, 0):
+                raise Exception("simulated device rejected the GIF")
+            uploadTime = time.perf_counter() - start
+
+            psnr = gifPsnr(frames, gifData)
+            print(
+                "GIF {:28} {:14}: {:3} colors {:9.1f} KB {:5.1f}% of bucket, "
+                "prepare {:6.2f}s, upload {:5.2f}s, PSNR {}".format(
+                    os.path.basename(path)[:28],
+                    palettes,
+                    passes[-1][1],
+                    len(gifData) / 1024,
+                    len(gifData) * 100 / maxSize,
+                    prepareTime,
+                    uploadTime,
+                    "-" if psnr is None else "{:.2f} dB".format(psnr),
+                )
+            )
+
+
+BENCHMARKS = {
+    "rgba": benchRGBA,
+    "mask": benchMask,
+    "q565": benchQ565Encoder,
+    "rgb565": benchRGB565,
+    "q565py": benchPythonQ565,
+    "ratio": benchQ565Ratio,
+    "pipeline": benchPipeline,
+    "spinner": benchSpinner,
+    "text": benchText,
+    "e2e": benchEndToEnd,
+    "gif": benchGif,
+    "gifpalette": benchGifPalette,
+}
+
+
+def main():
+    selected = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    for name in selected or BENCHMARKS.keys():
+        if name not in BENCHMARKS:
+            print(f"unknown benchmark {name!r}, available: {', '.join(BENCHMARKS)}")
+            return
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+Minimal asyncio HTTP/1.1 server used by the SignalRGB bridge.
+
+Every connection is served from a single event loop and kept alive between
+requests, so SignalRGB's per-frame POSTs no longer spawn a thread each. Cheap
+routes run directly on the loop; routes that may block (USB access, GIF
+uploads) are marked as blocking and run on a small bounded executor so they
+never stall frame ingestion. Paths registered with websocket() additionally
+accept a WebSocket upgrade (RFC 6455) for clients that stream frames over a
+single persistent connection.
+"""
+
+import asyncio
+import base64
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from utils import debug
+
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_CONTINUATION = 0x0
+WS_TEXT = 0x1
+WS_BINARY = 0x2
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+# close status for a frame that breaks RFC 6455
+WS_CLOSE_PROTOCOL_ERROR = 1002
+# close status for a message over MAX_BODY_SIZE
+WS_CLOSE_TOO_BIG = 1009
+# control frames can neither be fragmented nor carry more than this
+WS_MAX_CONTROL_SIZE = 125
+
+Request = namedtuple(
+    "Request", ["method", "path", "query", "headers", "body", "keepAlive"]
+)
+
+
+class Response:
+    def __init__(self, body=b"", contentType="application/json", status=200):
+        self.body = body
+        self.contentType = contentType
+        self.status = status
+
+
+class HttpError(Exception):
+    def __init__(self, status: int):
+        super().__init__(HTTPStatus(status).phrase)
+        self.status = status
+
+
+class WebSocketError(Exception):
+    def __init__(self, status: int):
+        super().__init__("WebSocket protocol error {}".format(status))
+        self.status = status
+
+
+class BridgeServer:
+    def __init__(self, port: int, workers: int = 2):
+        self.port = port
+        self.workers = workers
+        self.routes = {}
+        self.sockets = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="BridgeWorker"
+        )
+        self.pending = None
+        self.connections = 0
+        self.requests = 0
+
+    def route(self, method: str, path, handler, blocking=False):
+        """
+        Register handler(request) for method and path. A path of None matches
+        any path not registered explicitly. The handler returns a Response,
+        bytes, or None for an empty JSON response.
+        """
+        self.routes[(method, path)] = (handler, blocking)
+
+    def websocket(self, path: str, handler):
+        """
+        Accept WebSocket upgrades on path. handler(message, binary) is called
+        on the event loop for every complete message, so it must not block.
+        """
+        self.sockets[path] = handler
+
+    def serveForever(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        # bounds queued blocking work, the executor queue itself is unbounded
+        self.pending = asyncio.Semaphore(self.workers * 4)
+        server = await asyncio.start_server(
+            self.handleConnection, port=self.port, limit=MAX_HEADER_SIZE
+        )
+        debug("Bridge server listening on port {}".format(self.port))
+        async with server:
+            await server.serve_forever()
+
+    async def handleConnection(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await self.readRequest(reader)
+                except HttpError as error:
+                    writer.write(self.encodeResponse(Response(status=error.status), False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                self.requests += 1
+                if self.isUpgrade(request):
+                    await self.serveWebSocket(request, reader, writer)
+                    break
+                response = await self.dispatch(request)
+                writer.write(
+                    self.encodeResponse(
+                        response, request.keepAlive, request.method == "HEAD"
+                    )
+                )
+                await writer.drain()
+                if not request.keepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def readRequest(self, reader: asyncio.StreamReader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            # the client closed the connection between requests
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(431)
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400)
+
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(411)
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(400)
+        if length > MAX_BODY_SIZE:
+            raise HttpError(413)
+        body = await reader.readexactly(length) if length else b""
+
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.1":
+            keepAlive = connection != "close"
+        else:
+            keepAlive = connection == "keep-alive"
+
+        path, _, query = target.partition("?")
+        return Request(method, path, query, headers, body, keepAlive)
+
+    def isUpgrade(self, request: Request) -> bool:
+        return (
+            request.method == "GET"
+            and request.path in self.sockets
+            and request.headers.get("upgrade", "").lower() == "websocket"
+            and "sec-websocket-key" in request.headers
+        )
+
+    async def serveWebSocket(self, request: Request, reader, writer):
+        accept = base64.b64encode(
+            hashlib.sha1(
+                request.headers["sec-websocket-key"].encode("latin-1") + WEBSOCKET_GUID
+            ).digest()
+        )
+        writer.write(
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+        )
+        await writer.drain()
+        debug("WebSocket client connected on {}".format(request.path))
+
+        handler = self.sockets[request.path]
+        fragments = []
+        messageSize = 0
+        messageOpcode = WS_BINARY
+        while True:
+            try:
+                fin, opcode, payload = await self.readWebSocketFrame(reader)
+            except WebSocketError as error:
+                await self.closeWebSocket(writer, error.status)
+                return
+            if opcode == WS_CLOSE:
+                writer.write(self.encodeWebSocketFrame(WS_CLOSE, payload[:2]))
+                await writer.drain()
+                return
+            if opcode == WS_PING:
+                writer.write(self.encodeWebSocketFrame(WS_PONG, payload))
+                await writer.drain()
+                continue
+            if opcode == WS_PONG:
+                continue
+
+            if opcode != WS_CONTINUATION:
+                messageOpcode = opcode
+                fragments = []
+                messageSize = 0
+            messageSize += len(payload)
+            if messageSize > MAX_BODY_SIZE:
+                # endless continuation frames must not grow fragments unbounded
+                await self.closeWebSocket(writer, WS_CLOSE_TOO_BIG)
+                return
+            fragments.append(payload)
+            if not fin:
+                continue
+
+            message = fragments[0] if len(fragments) == 1 else b"".join(fragments)
+            fragments = []
+            messageSize = 0
+            try:
+                handler(message, messageOpcode == WS_BINARY)
+            except Exception as e:
+                print(f"[Bridge] WebSocket {request.path} message failed: {e}")
+
+    async def readWebSocketFrame(self, reader: asyncio.StreamReader):
+        first, second = await reader.readexactly(2)
+        fin = bool(first & 0x80)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        # no extension is negotiated, so every RSV bit must be clear, and
+        # clients must mask every frame they send
+        if first & 0x70 or not second & 0x80:
+            raise WebSocketError(WS_CLOSE_PROTOCOL_ERROR)
+        if opcode >= WS_CLOSE and (length > WS_MAX_CONTROL_SIZE or not fin):
+            raise WebSocketError(WS_CLOSE_PROTOCOL_ERROR)
+        if length == 126:
+            length = int.from_bytes(await reader.readexactly(2), "big")
+        elif length == 127:
+            length = int.from_bytes(await reader.readexactly(8), "big")
+        if length > MAX_BODY_SIZE:
+            raise ConnectionError("WebSocket frame too large")
+
+        mask = await reader.readexactly(4)
+        payload = await reader.readexactly(length)
+        if length:
+            # one big-integer XOR unmasks the whole payload without a python loop
+            keystream = (mask * (length // 4 + 1))[:length]
+            payload = (
+                int.from_bytes(payload, "little") ^ int.from_bytes(keystream, "little")
+            ).to_bytes(length, "little")
+        return fin, opcode, payload
+
+    def encodeWebSocketFrame(self, opcode: int, payload: bytes) -> bytes:
+        # server frames are never masked
+        length = len(payload)
+        if length < 126:
+            header = bytes([0x80 | opcode, length])
+        elif length < 1 << 16:
+            header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
+        else:
+            header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+        return header + payload
+
+    async def closeWebSocket(self, writer, status: int):
+        writer.write(self.encodeWebSocketFrame(WS_CLOSE, status.to_bytes(2, "big")))
+        await writer.drain()
+
+    async def dispatch(self, request: Request) -> Response:
+        route = self.routes.get((request.method, request.path)) or self.routes.get(
+            (request.method, None)
+        )
+        if route is None:
+            return Response(status=404)
+
+        handler, blocking = route
+        try:
+            if blocking:
+                async with self.pending:
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, handler, request
+                    )
+            else:
+                result = handler(request)
+        except HttpError as error:
+            return Response(status=error.status)
+        except Exception as e:
+            print(f"[Bridge] {request.method} {request.path} failed: {e}")
+            return Response(status=500)
+
+        if isinstance(result, Response):
+            return result
+        return Response(result or b"")
+
+    def encodeResponse(self, response: Response, keepAlive: bool, headOnly=False) -> bytes:
+        status = HTTPStatus(response.status)
+        head = (
+            "HTTP/1.1 {} {}\r\n"
+            "Content-Type: {}\r\n"
+            "Content-Length: {}\r\n"
+            "Connection: {}\r\n"
+            "\r\n".format(
+                status.value,
+                status.phrase,
+                response.contentType,
+                len(response.body),
+                "keep-alive" if keepAlive else "close",
+            )
+        ).encode("latin-1")
+        if headOnly:
+            return head
+        return head + response.body
@@ -1,18 +1,26 @@
 from io import BytesIO
 import time
-import hid
 import math
-from winusbcdc import WinUsbPy
 from typing import Tuple
 from collections import namedtuple
 from enum import Enum, IntEnum
-from PIL import Image, ImageDraw
-from q565 import encode_img
+from PIL import Image
+import q565
+from framebuffer import CircleMask, packRGBX
+from transport import COMMON_WRITE_HEADER, openTransport
 from utils import debounce, timing, debugUsb
 import threading
-import q565_rust
 
-_NZXT_VID = 0x1E71
+try:
+    import q565_rust
+
+    Q565Encoder = q565_rust.Q565Encoder
+    # wheels built before DIFF_INDEXED or BGRA input reject these arguments
+    Q565Encoder(1, 1, "BGRA", parallel=True, diff_indexed=True).encode_into
+except (ImportError, AttributeError, TypeError, ValueError):
+    # missing or outdated extension: the pure python encoder produces the same stream, only slower
+    print("q565_rust not available, falling back to the python Q565 encoder")
+    Q565Encoder = q565.Q565Encoder
 
 # Module-level USB lock container - signalrgb.py replaces [0] after lcd_lock is created
 # Using a list so @debounce captures the container reference, not the lock object itself
@@ -21,20 +29,10 @@ _DEFAULT_TIMEOUT_MS = 1000
 _HID_WRITE_LENGTH = 64
 _HID_READ_LENGTH = 64
 _MAX_READ_UNTIL_RETRIES = 50
-_COMMON_WRITE_HEADER = [
-    0x12,
-    0xFA,
-    0x01,
-    0xE8,
-    0xAB,
-    0xCD,
-    0xEF,
-    0x98,
-    0x76,
-    0x54,
-    0x32,
-    0x10,
-]
+# Q565 output and RGBX frame buffers are recycled round-robin: one frame being
+# encoded, one waiting in the frame mailbox, one being written over USB and a spare
+_FRAME_RING_SIZE = 4
+_COMMON_WRITE_HEADER = list(COMMON_WRITE_HEADER)
 
 Resolution = namedtuple("Resolution", ["width", "height"])
 
@@ -86,80 +84,6 @@ SUPPORTED_DEVICES = [
 ]
 
 
-# WinUSB device interface GUID — devices using the WinUSB driver register under this GUID
-
-
-_NZXT_GUID = "{30123011-7ee7-1125-0724-101503010819}"
-
-def _find_bulk_path_from_registry(vid: int, pid: int) -> str:
-    """
-    Find the WinUSB bulk device interface path from the Windows registry.
-    Reads HKLM\\SYSTEM\\CurrentControlSet\\Control\\DeviceClasses\\{NZXT_GUID}
-    which contains the exact registered device interface paths — no enumeration,
-    no touching other HID devices, no mouse freezes.
-    """
-    import winreg
-
-    guid_upper = _NZXT_GUID.upper()
-    vid_pid = "VID_{:04X}&PID_{:04X}".format(vid, pid)
-
-    # DeviceClasses stores registered interface paths as subkey names.
-    # Format: ##?#USB#VID_1E71&PID_3012&MI_00#instance#{GUID}
-    # We convert ## -> \\? to get the actual device path.
-    try:
-        base = r"SYSTEM\CurrentControlSet\Control\DeviceClasses\\" + guid_upper
-        key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, base)
-        i = 0
-        best = None
-        while True:
-            try:
-                name = winreg.EnumKey(key, i)
-                i += 1
-                if vid_pid in name.upper():
-                    # Prefer MI_00 (bulk), accept MI_01 as fallback
-                    if "MI_00" in name.upper():
-                        best = name
-                        break
-                    elif best is None:
-                        best = name
-            except OSError:
-                break
-        winreg.CloseKey(key)
-
-        if best is not None:
-            # Convert registry key name to device path:
-            # ##?#USB#VID_...  ->  \\?\USB#VID_...
-            path = best.replace("##?#", "\\\\?\\")
-            # The registry key name uses # as separator throughout - that's correct
-            return path
-    except Exception:
-        pass
-
-    # Fallback: enumerate USB instances directly
-    try:
-        for mi_suffix in ["&MI_00", "&MI_01"]:
-            subkey = "VID_{:04X}&PID_{:04X}{}".format(vid, pid, mi_suffix)
-            try:
-                key = winreg.OpenKey(
-                    winreg.HKEY_LOCAL_MACHINE,
-                    r"SYSTEM\CurrentControlSet\Enum\USB\\" + subkey
-                )
-                try:
-                    instance = winreg.EnumKey(key, 0)
-                    path = "\\\\?\\usb#{}#{}#{}".format(
-                        subkey.lower(), instance.lower(), _NZXT_GUID
-                    )
-                    return path
-                finally:
-                    winreg.CloseKey(key)
-            except Exception:
-                continue
-    except Exception:
-        pass
-
-    return None
-
-
 class KrakenLCD:
     pid: int
     serial: str
@@ -172,18 +96,18 @@ class KrakenLCD:
     renderingMode: RENDERING_MODE
     lastReadMessage: bytes
     streamReady = False
+    streamEpoch = 0
     nextFrameBucket = 0
     bucketsToUse = 2
-    black: Image.Image
-    mask: Image.Image
+    mask: CircleMask
 
     cache = None
 
-    def __init__(self):
+    def __init__(self, transport=None):
+        # the USB transport by default, or the simulated device with --simulate
+        self.transport = transport or openTransport(SUPPORTED_DEVICES)
         for dev in SUPPORTED_DEVICES:
-            info = hid.enumerate(_NZXT_VID, dev["pid"])
-            if len(info) > 0:
-                self.hidInfo = info[0]
+            if dev["pid"] == self.transport.pid:
                 self.name = dev["name"]
 
                 self.pid = dev["pid"]
@@ -198,33 +122,27 @@ class KrakenLCD:
                     (self.resolution.width * self.resolution.height * 4),
                 )
                 self.bucketsToUse = max(self.totalBuckets, 2)
-                print()
                 break
         else:
             raise Exception("No supported device found")
 
-        try:
-            self.serial = self.hidInfo["serial_number"]
-            self.hidDev = hid.device()
-            self.hidDev.open_path(self.hidInfo["path"])
-            self.bulkDev = WinUsbPy()
-
-            # Look up the WinUSB bulk interface path from the Windows registry.
-            # This avoids list_usb_devices() which enumerates ALL HID devices
-            # (including Razer ghost entries) causing mouse freezes.
-            bulk_path = _find_bulk_path_from_registry(_NZXT_VID, self.pid)
-            if bulk_path is None:
-                raise Exception("Could not find NZXT device in registry")
-            self.bulkDev.init_winusb_device_with_path(bulk_path)
-
-        except Exception:
-            raise Exception("Could not connect to kraken device. Is NZXT CAM closed ?")
+        self.serial = self.transport.serial
+        self.simulated = self.transport.simulated
         debugUsb("found")
 
-        self.black = Image.new("RGBA", self.resolution, (0, 0, 0, 0))
-        self.mask = Image.new("RGBA", self.resolution, (0, 0, 0, 0))
-        maskCanvas = ImageDraw.Draw(self.mask)
-        maskCanvas.ellipse([(0, 0), self.resolution], fill=(255, 255, 255, 255))
+        self.mask = CircleMask(self.resolution)
+        # frame buffer rings, allocated up front for the device's own rendering
+        # mode and on the first frame for one switched to later
+        self.q565Encoders = {}
+        self.q565Buffers = []
+        self.nextQ565Buffer = 0
+        self.rawBuffers = {}
+        self.rgbxBuffers = []
+        self.nextRGBXBuffer = 0
+        if self.renderingMode == RENDERING_MODE.Q565:
+            self.setupQ565Buffers()
+        elif self.renderingMode == RENDERING_MODE.RGBA:
+            self.setupRGBXBuffers()
 
         self.write([0x36, 0x3])
         self.setBrightness(100)
@@ -242,21 +160,14 @@ class KrakenLCD:
         }
 
     def read(self, length=_HID_READ_LENGTH, timeout=_DEFAULT_TIMEOUT_MS):
-        self.hidDev.set_nonblocking(False)
-        self.lastReadMessage = self.hidDev.read(max_length=length, timeout_ms=timeout)
+        self.lastReadMessage = self.transport.read(length, timeout)
         if timeout and not self.lastReadMessage:
             raise Exception("Read timeout")
         return self.lastReadMessage
 
     @timing
     def clear(self):
-        if self.hidDev.set_nonblocking(True) == 0:
-            timeout_ms = 0
-        else:
-            timeout_ms = 1
-        discarded = 0
-        while self.hidDev.read(max_length=64, timeout_ms=timeout_ms):
-            discarded += 1
+        self.transport.clear()
 
     @timing
     def readUntil(self, parsers, retries=_MAX_READ_UNTIL_RETRIES):
@@ -280,9 +191,8 @@ class KrakenLCD:
 
     @timing
     def write(self, data) -> int:
-        self.hidDev.set_nonblocking(False)
         padding = [0x0] * (_HID_WRITE_LENGTH - len(data))
-        res = self.hidDev.write(data + padding)
+        res = self.transport.write(data + padding)
         if res < 0:
             raise OSError("Could not write to device")
         if res != _HID_WRITE_LENGTH:
@@ -291,7 +201,7 @@ class KrakenLCD:
 
     @timing
     def bulkWrite(self, data: bytes) -> None:
-        self.bulkDev.write(0x2, data)
+        self.transport.bulkWrite(data)
 
     def parseStandardResult(self, packet) -> bool:
         return packet[14] == 1
@@ -509,43 +419,92 @@ class KrakenLCD:
         self.nextFrameBucket = (self.nextFrameBucket + 1) % self.bucketsToUse
         return result
 
+    def setupQ565Buffers(self):
+        self.q565Encoders = {}
+        capacity = self.q565Encoder("RGB").capacity
+        self.q565Buffers = [bytearray(capacity) for _ in range(_FRAME_RING_SIZE)]
+        self.nextQ565Buffer = 0
+        self.rawBuffers = {}
+
+    def setupRGBXBuffers(self):
+        size = self.resolution.width * self.resolution.height * 4
+        self.rgbxBuffers = [bytearray(size) for _ in range(_FRAME_RING_SIZE)]
+        self.nextRGBXBuffer = 0
+
+    def q565Encoder(self, pixelFormat: str):
+        encoder = self.q565Encoders.get(pixelFormat)
+        if encoder is None:
+            encoder = Q565Encoder(
+                self.resolution.width,
+                self.resolution.height,
+                pixelFormat,
+                parallel=True,
+                diff_indexed=True,
+            )
+            self.q565Encoders[pixelFormat] = encoder
+        return encoder
+
     @timing
     def imageToFrame(self, img: Image.Image, adaptive=False) -> bytes:
+        """
+        Encode an image at device resolution for the current rendering mode.
+        RGBA and Q565 frames are views of buffers recycled round-robin, each
+        stays valid only until _FRAME_RING_SIZE more frames are encoded.
+        """
         # cut the image to circular frame. This reduce gif size by ~20%
-        img = Image.composite(img, self.black, self.mask)
-
         if self.renderingMode == RENDERING_MODE.RGBA:
-            raw = list(img.convert("RGB").getdata())
-            output = []
-            for i in range(img.size[0] * img.size[1]):
-                output.append(raw[i][0])
-                output.append(raw[i][1])
-                output.append(raw[i][2])
-                output.append(0)
-            return bytes(output)
-        elif self.renderingMode == RENDERING_MODE.Q565:
-            img = img.convert("RGB")
-            width, height = img.size
-            img_bytes = img.tobytes()
-            return q565_rust.py_encode(
-                width, height, img_bytes
-            )  # encode_img(img.convert("RGB"))
-        else:
-            byteio = BytesIO()
-
-            @timing
-            def convert():
-                nonlocal img
-                if adaptive:
-                    img = img.convert("RGB").convert(
-                        "P", palette=Image.Palette.ADAPTIVE, colors=64
-                    )
-                else:
-                    img = img.convert("RGB").convert("P")
-                img.save(byteio, "GIF", interlace=False, optimize=True)
+            if not self.rgbxBuffers:
+                self.setupRGBXBuffers()
+            buffer = self.rgbxBuffers[self.nextRGBXBuffer]
+            self.nextRGBXBuffer = (self.nextRGBXBuffer + 1) % len(self.rgbxBuffers)
+            return self.mask.apply(packRGBX(img, buffer), 4)
+
+        if self.renderingMode == RENDERING_MODE.Q565:
+            return self.rawToFrame(img.convert("RGB").tobytes(), "RGB")
+
+        frame = self.mask.apply(bytearray(img.convert("RGB").tobytes()), 3)
+        img = Image.frombytes("RGB", img.size, frame)
+        byteio = BytesIO()
+
+        @timing
+        def convert():
+            nonlocal img
+            if adaptive:
+                img = img.convert(
+                    "P", palette=Image.Palette.ADAPTIVE, colors=64
+                )
+            else:
+                img = img.convert("P")
+            img.save(byteio, "GIF", interlace=False, optimize=True)
 
-            convert()
-            return byteio.getvalue()
+        convert()
+        return byteio.getvalue()
+
+    @timing
+    def rawToFrame(self, data: bytes, pixelFormat="RGB", adaptive=False) -> bytes:
+        """
+        Convert packed pixels at device resolution straight to a frame.
+        pixelFormat is one of RGB, RGBA or BGRA (mss screenshots), so Q565
+        devices can skip the PIL conversion entirely. Like imageToFrame, the
+        frame is only valid until _FRAME_RING_SIZE more frames are encoded.
+        """
+        if self.renderingMode != RENDERING_MODE.Q565:
+            mode = "RGB" if pixelFormat == "RGB" else "RGBA"
+            img = Image.frombuffer(mode, self.resolution, data, "raw", pixelFormat, 0, 1)
+            return self.imageToFrame(img, adaptive)
+
+        if not self.q565Buffers:
+            self.setupQ565Buffers()
+        staging = self.rawBuffers.get(pixelFormat)
+        if staging is None or len(staging) != len(data):
+            staging = self.rawBuffers[pixelFormat] = bytearray(len(data))
+        staging[:] = data
+        self.mask.apply(staging, 3 if pixelFormat == "RGB" else 4)
+
+        output = self.q565Buffers[self.nextQ565Buffer]
+        self.nextQ565Buffer = (self.nextQ565Buffer + 1) % len(self.q565Buffers)
+        size = self.q565Encoder(pixelFormat).encode_into(staging, output)
+        return memoryview(output)[:size]
 
     @timing
     def setupStream(self):
@@ -564,6 +523,7 @@ class KrakenLCD:
                 self.createBucket(i, startAddress)
 
         self.setLcdMode(DISPLAY_MODE.BUCKET, 0x0)
+        self.streamEpoch += 1
         self.streamReady = True
 
 
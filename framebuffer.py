@@ -0,0 +1,98 @@
+from typing import Dict, List, Optional, Tuple
+from PIL import Image, ImageDraw
+
+
+_padding = memoryview(b"")
+
+
+def packRGBX(img: Image.Image, buffer: Optional[bytearray] = None) -> bytearray:
+    """
+    Pack an image into the Kraken Z3 bucket layout: 4 bytes per pixel,
+    R G B followed by a zero padding byte.
+
+    The pixels are copied once into buffer, which callers reuse across frames;
+    a new one is allocated when it is missing or sized for another resolution.
+    PIL's raw RGBX packer pads with 0xFF and RGBA carries alpha there, so the
+    padding bytes are cleared afterwards with one strided assignment.
+    """
+    global _padding
+    pixels = img.size[0] * img.size[1]
+    if buffer is None or len(buffer) != pixels * 4:
+        buffer = bytearray(pixels * 4)
+
+    if img.mode in ("RGBA", "RGBX"):
+        buffer[:] = img.tobytes()
+    else:
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        buffer[:] = img.tobytes("raw", "RGBX")
+
+    if len(_padding) < pixels:
+        _padding = memoryview(bytes(pixels))
+    buffer[3::4] = _padding[:pixels]
+    return buffer
+
+
+class CircleMask:
+    """
+    Circular LCD mask stored as one in-circle span per scanline.
+
+    The spans are read back from the same PIL ellipse the driver used to
+    composite against, so masked output stays pixel-identical. Pixels outside
+    the circle are contiguous across row boundaries, which lets apply() clear a
+    whole frame with roughly one slice assignment per scanline.
+    """
+
+    def __init__(self, resolution: Tuple[int, int]):
+        width, height = resolution
+        self.width = width
+        self.height = height
+
+        mask = Image.new("L", resolution, 0)
+        ImageDraw.Draw(mask).ellipse([(0, 0), resolution], fill=255)
+        maskBytes = mask.tobytes()
+
+        # (start, end) of the visible pixels of each row, end exclusive
+        self.spans: List[Tuple[int, int]] = []
+        for y in range(height):
+            row = maskBytes[y * width : (y + 1) * width]
+            start = row.find(255)
+            if start < 0:
+                self.spans.append((0, 0))
+            else:
+                self.spans.append((start, row.rfind(255) + 1))
+
+        self._runs: Dict[int, List[Tuple[int, int]]] = {}
+        self._zeros = memoryview(b"")
+
+    def outsideRuns(self, bytesPerPixel: int) -> List[Tuple[int, int]]:
+        """Byte (offset, length) runs covering every pixel outside the circle."""
+        runs = self._runs.get(bytesPerPixel)
+        if runs is not None:
+            return runs
+
+        runs = []
+        stride = self.width * bytesPerPixel
+        runStart = 0
+        for y, (start, end) in enumerate(self.spans):
+            if end > start:
+                rowStart = y * stride
+                if rowStart + start * bytesPerPixel > runStart:
+                    runs.append((runStart, rowStart + start * bytesPerPixel - runStart))
+                runStart = rowStart + end * bytesPerPixel
+        if self.height * stride > runStart:
+            runs.append((runStart, self.height * stride - runStart))
+
+        longest = max((length for _, length in runs), default=0)
+        if longest > len(self._zeros):
+            self._zeros = memoryview(bytes(longest))
+        self._runs[bytesPerPixel] = runs
+        return runs
+
+    def apply(self, buffer: bytearray, bytesPerPixel: int = 3) -> bytearray:
+        """Zero the out-of-circle pixels of a packed frame buffer in place."""
+        runs = self.outsideRuns(bytesPerPixel)
+        zeros = self._zeros
+        for offset, length in runs:
+            buffer[offset : offset + length] = zeros[:length]
+        return buffer
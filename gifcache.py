@@ -0,0 +1,138 @@
+"""
+On-disk cache of device-ready GIF blobs.
+
+Preparing a GIF for a bucket takes seconds to minutes, and GifPlayer is
+restarted with the same file and settings all the time: the tray toggle,
+SignalRGB switching display modes, a restart of the bridge. GifCache keeps the
+prepared blobs in a directory, one file per content hash of the source GIF and
+the settings that shape the output, and evicts the least recently used ones
+once the directory outgrows its size limit. Entry mtimes are the LRU order, so
+it survives restarts without an index file.
+"""
+
+import hashlib
+import os
+import tempfile
+from threading import Lock
+
+from utils import LRUCache
+
+# part of every key, bump it when gifprep produces different bytes for the
+# same input so stale entries are never served
+KEY_VERSION = 3
+SUFFIX = ".gif"
+# source files whose content hash is remembered
+FILE_HASHES = 64
+
+
+class GifCache:
+    def __init__(self, directory: str, maxBytes: int):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.bytesSaved = 0
+        # (path, mtime, size) -> content hash, so an unchanged file is read once
+        self.fileHashes = LRUCache(FILE_HASHES)
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def fileHash(self, path: str) -> str:
+        stat = os.stat(path)
+        fileKey = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            digest = self.fileHashes.get(fileKey)
+        if digest is None:
+            hasher = hashlib.blake2b(digest_size=20)
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    hasher.update(chunk)
+            digest = hasher.hexdigest()
+            with self.lock:
+                self.fileHashes.put(fileKey, digest)
+        return digest
+
+    def key(self, path: str, *settings) -> str:
+        """Cache key of the GIF at path prepared with settings."""
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(repr((KEY_VERSION, self.fileHash(path)) + settings).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def entryPath(self, key: str) -> str:
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key: str):
+        """Cached blob of key, or None."""
+        path = self.entryPath(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # evicted by a concurrent put since it was read, the data is whole
+            # because entries are only ever replaced by rename
+            pass
+        with self.lock:
+            self.hits += 1
+            self.bytesSaved += len(data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.maxBytes:
+            return
+        # written aside and renamed, a crash never leaves a truncated entry
+        fd, temp = tempfile.mkstemp(SUFFIX + ".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp, self.entryPath(key))
+        except OSError:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        self.evict()
+
+    def entries(self):
+        """(mtime, size, path) of every entry, least recently used first."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already evicted by another put, or still open for a get on
+                # Windows; it is retried on the next put
+                continue
+            total -= size
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytesSaved": self.bytesSaved,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "maxBytes": self.maxBytes,
+        }
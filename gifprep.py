@@ -0,0 +1,686 @@
+"""
+GIF preparation for bucket uploads, shared by GifPlayer and writeGif.py.
+
+A GIF has to be re-quantized until it fits the device bucket, which takes a
+binary search over the palette size. The source frames are decoded, rotated
+and fitted to the LCD once by loadFrames(); every search pass then only
+quantizes the cached device-resolution frames, spread over a pool of workers,
+and encodes the result.
+
+Animations whose fitted frames would not fit in FRAME_MEMORY are not cached:
+loadFrames() returns a GifFrames that decodes them again on every pass. Full
+passes stream the frames through the workers and a GifWriter a few at a time,
+with the output written to a temp file, so memory stays bounded by a small
+window of frames and the bucket size whatever the animation length.
+
+With globalPalette every frame is quantized to one palette built from the
+sampled frames instead of its own, unless that costs them more than
+MAX_PALETTE_LOSS dB of PSNR. Pixels that did not change then keep their
+index, so the GifWriter finds the changes without going back to RGB and
+stores the frames without a colour table of their own.
+
+Pillow releases the GIL while quantizing, so threads already scale, and they
+are what signalrgb.py uses since its import-time device setup must not run
+again in spawned children. With processes the frames are shared with the
+workers through one SharedMemory block instead of being pickled per pass.
+"""
+
+import math
+import os
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from multiprocessing import shared_memory
+from threading import Event, Thread
+from typing import List
+from PIL import Image, ImageChops, ImageSequence, ImageStat
+from utils import argValue, timing
+
+try:
+    import psutil
+except ImportError:
+    # only needed to report the peak memory of a preparation
+    psutil = None
+
+MIN_COLORS = 16
+MAX_COLORS = 256
+MAX_PASSES = 20
+# frame ranges sampled by GifPreparer.estimate()
+SAMPLE_STRATA = 12
+# --gif-frame-palettes gives every frame its own palette and stores it whole
+# instead of sharing one palette and storing only what changed
+GLOBAL_PALETTE = "--gif-frame-palettes" not in sys.argv
+# PSNR in dB a shared palette may lose on the sampled frames against their own
+# palettes, animations whose colours change too much keep per-frame palettes
+MAX_PALETTE_LOSS = 6
+# --gif-frame-memory=MB bounds the fitted frames kept decoded between passes,
+# longer animations are decoded again on every pass instead
+FRAME_MEMORY = int(float(argValue("gif-frame-memory", 256)) * 1024 * 1024)
+
+
+def fitFrame(
+    frame: Image.Image, target, fitMode="Fill", zoom=100, offsetX=0, offsetY=0
+) -> Image.Image:
+    """Resize a frame according to fit mode, zoom, and offset settings."""
+    target_w, target_h = target
+    src_w, src_h = frame.size
+
+    if fitMode == "Stretch":
+        frame = frame.resize((target_w, target_h), Image.Resampling.LANCZOS)
+    elif fitMode == "Fit":
+        scale = min(target_w / src_w, target_h / src_h)
+        scale *= zoom / 100.0
+        new_w = max(1, round(src_w * scale))
+        new_h = max(1, round(src_h * scale))
+        frame = frame.resize((new_w, new_h), Image.Resampling.LANCZOS)
+        bg = Image.new("RGB", (target_w, target_h), (0, 0, 0))
+        paste_x = (target_w - new_w) // 2 + round(offsetX / 50 * target_w / 2)
+        paste_y = (target_h - new_h) // 2 + round(offsetY / 50 * target_h / 2)
+        bg.paste(frame, (paste_x, paste_y))
+        frame = bg
+    else:  # Fill (default)
+        scale = max(target_w / src_w, target_h / src_h)
+        scale *= zoom / 100.0
+        new_w = max(1, round(src_w * scale))
+        new_h = max(1, round(src_h * scale))
+        frame = frame.resize((new_w, new_h), Image.Resampling.LANCZOS)
+        crop_x = (new_w - target_w) // 2 - round(offsetX / 50 * target_w / 2)
+        crop_y = (new_h - target_h) // 2 - round(offsetY / 50 * target_h / 2)
+        crop_x = max(0, min(crop_x, new_w - target_w))
+        crop_y = max(0, min(crop_y, new_h - target_h))
+        frame = frame.crop((crop_x, crop_y, crop_x + target_w, crop_y + target_h))
+
+    return frame
+
+
+class GifFrames:
+    """
+    The frames of a GIF rotated and fitted to resolution, decoded again each
+    time they are iterated instead of being kept in memory.
+    """
+
+    def __init__(self, path: str, resolution, rotation=0, **fit):
+        self.path = path
+        self.resolution = resolution
+        self.rotation = rotation
+        self.fit = fit
+        with Image.open(path) as img:
+            self.count = img.n_frames
+
+    def __len__(self):
+        return self.count
+
+    def lastInfo(self) -> dict:
+        with Image.open(self.path) as img:
+            img.seek(self.count - 1)
+            # seeking updates info, so this is the last frame's like the GIF always got
+            return dict(img.info)
+
+    def fitted(self, frame: Image.Image) -> Image.Image:
+        frame = frame.convert("RGB").rotate(self.rotation)
+        return fitFrame(frame, self.resolution, **self.fit)
+
+    def __iter__(self):
+        with Image.open(self.path) as img:
+            for frame in ImageSequence.Iterator(img):
+                yield self.fitted(frame)
+
+    def select(self, indices) -> List[Image.Image]:
+        """Frames at the ascending indices, decoding up to the last one."""
+        frames = []
+        with Image.open(self.path) as img:
+            for index in indices:
+                img.seek(index)
+                frames.append(self.fitted(img))
+        return frames
+
+
+@timing
+def loadFrames(path: str, resolution, rotation=0, **fit):
+    """
+    Decode every frame of path once, rotated and fitted to resolution.
+    Returns the RGB frames and the GIF info to save them with; the frames are
+    a GifFrames when they would take more than FRAME_MEMORY bytes.
+    """
+    source = GifFrames(path, resolution, rotation, **fit)
+    if source.count * resolution[0] * resolution[1] * 3 > FRAME_MEMORY:
+        return source, source.lastInfo()
+    frames = []
+    with Image.open(path) as img:
+        for frame in ImageSequence.Iterator(img):
+            frames.append(source.fitted(frame))
+        info = dict(img.info)
+    if not frames:
+        raise Exception("GIF contained no frames")
+    return frames, info
+
+
+def quantizeFrame(frame: Image.Image, colors: int, palette: Image.Image = None) -> Image.Image:
+    if palette is None:
+        palette = frame.quantize(colors)
+    quantized = frame.quantize(colors, palette=palette, dither=Image.Dither.FLOYDSTEINBERG)
+    # the source's transparent index means nothing in the new palette
+    quantized.info.pop("transparency", None)
+    return quantized
+
+
+def meanSquaredError(frames, quantized) -> float:
+    """Mean squared error per channel of quantized against the RGB frames."""
+    total = 0
+    count = 0
+    for frame, output in zip(frames, quantized):
+        difference = ImageChops.difference(frame, output.convert("RGB"))
+        total += sum(ImageStat.Stat(difference).sum2) / (3 * frame.width * frame.height)
+        count += 1
+    return total / count
+
+
+_sharedFrames = None
+
+
+def _attachFrames(name: str, size, count: int):
+    global _sharedFrames
+    _sharedFrames = (shared_memory.SharedMemory(name), size, count)
+
+
+def _quantizeShared(index: int, colors: int, palette: Image.Image = None) -> Image.Image:
+    memory, size, count = _sharedFrames
+    length = size[0] * size[1] * 3
+    frame = Image.frombuffer(
+        "RGB", size, memory.buf[index * length : (index + 1) * length], "raw", "RGB", 0, 1
+    )
+    return quantizeFrame(frame, colors, palette)
+
+
+def windowed(executor, func, arguments, window: int):
+    """
+    executor.map() that reads arguments lazily, with at most window calls
+    submitted ahead of the result being consumed.
+    """
+    pending = deque()
+    try:
+        for args in arguments:
+            pending.append(executor.submit(func, *args))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _imageData(frame: Image.Image):
+    """
+    (colour table, compressed image data) of frame saved alone as a GIF:
+    the table Pillow wrote and everything from the LZW code size up to the
+    block terminator, ready to be spliced behind another image descriptor.
+    """
+    output = BytesIO()
+    # unoptimized, so the data keeps the indices of frame's palette
+    frame.save(output, "GIF", optimize=False, interlace=False)
+    data = output.getbuffer()
+    table = b""
+    flags = data[10]
+    pos = 13
+    if flags & 0x80:
+        table = bytes(data[pos : pos + 3 * (2 << (flags & 7))])
+        pos += len(table)
+    while data[pos] == 0x21:
+        # skip extensions, sub-block by sub-block
+        pos += 2
+        while data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    if data[pos] != 0x2C:
+        raise ValueError("no image in single frame GIF")
+    flags = data[pos + 9]
+    pos += 10
+    if flags & 0x80:
+        table = bytes(data[pos : pos + 3 * (2 << (flags & 7))])
+        pos += len(table)
+    return table, bytes(data[pos:-1])
+
+
+def _tableBits(table: bytes) -> int:
+    return (len(table) // 3).bit_length() - 2
+
+
+class GifWriter:
+    """
+    Writes an animated GIF a frame at a time, holding only the previous
+    frame. Pillow saves an animation in one go with every frame in memory,
+    so each frame's changed rectangle is saved alone instead and its
+    compressed data spliced in here behind our own frame headers.
+
+    Every frame is the rectangle that changed since the previous one, drawn
+    over it (disposal 1), with the unchanged pixels inside it transparent
+    when an index is free. With sharedPalette the frames are compared by
+    index and all use the first frame's colour table; otherwise they are
+    compared in RGB and each brings its own. A repeated frame lengthens the
+    previous one.
+    """
+
+    def __init__(self, fp, info: dict, duration=None, sharedPalette=False):
+        self.fp = fp
+        self.info = info
+        self.duration = duration
+        self.sharedPalette = sharedPalette
+        self.table = None
+        self.previous = None
+        # [duration, transparency, bbox, table, data] of the last frame,
+        # written once the next one is known not to repeat it
+        self.pending = None
+        self.written = 0
+
+    def append(self, frame: Image.Image):
+        duration = self.duration
+        if duration is None:
+            duration = frame.info.get("duration", self.info.get("duration"))
+        current = frame if self.sharedPalette else frame.convert("RGB")
+
+        if self.previous is None:
+            bbox = (0, 0) + frame.size
+            unchanged = None
+        else:
+            delta = ImageChops.difference(self.previous, current)
+            bbox = delta.getbbox()
+            if bbox is None:
+                if duration and self.pending[0]:
+                    self.pending[0] += duration
+                return
+            delta = delta.crop(bbox)
+            if not self.sharedPalette:
+                red, green, blue = delta.split()
+                delta = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+            # index differences as plain values, not palette entries
+            delta = Image.frombytes("L", delta.size, delta.tobytes())
+            unchanged = delta.point(lambda value: 0 if value else 255)
+
+        self.flush()
+        region = frame.crop(bbox)
+        transparency = None
+        if unchanged is not None and unchanged.getextrema()[1]:
+            transparency = self.freeIndex(region, ImageChops.invert(unchanged))
+            if transparency is not None:
+                region.paste(transparency, mask=unchanged)
+        self.pending = [duration, transparency, bbox] + list(_imageData(region))
+        self.previous = current
+
+    def freeIndex(self, region: Image.Image, changed: Image.Image):
+        """Palette index no changed pixel of region uses, or None."""
+        size = len(region.getpalette()) // 3
+        histogram = region.histogram(changed)
+        tableSize = 2 << max(0, (size - 1).bit_length() - 1)
+        for index in range(tableSize):
+            if not histogram[index]:
+                return index
+        return None
+
+    def writeHeader(self, table: bytes, size):
+        self.table = table
+        self.fp.write(b"GIF89a" + size[0].to_bytes(2, "little") + size[1].to_bytes(2, "little"))
+        self.fp.write(bytes((0xF0 | _tableBits(table), 0, 0)) + table)
+        if "loop" in self.info:
+            self.fp.write(
+                b"!\xff\x0bNETSCAPE2.0\x03\x01"
+                + self.info["loop"].to_bytes(2, "little")
+                + b"\x00"
+            )
+
+    def flush(self):
+        if self.pending is None:
+            return
+        duration, transparency, bbox, table, data = self.pending
+        self.pending = None
+        if self.table is None:
+            self.writeHeader(table, bbox[2:])
+        # graphic control extension: do not dispose, delay, transparency
+        delay = int((duration or 0) / 10)
+        self.fp.write(
+            b"!\xf9\x04"
+            + bytes((1 << 2 | (transparency is not None),))
+            + delay.to_bytes(2, "little")
+            + bytes((transparency or 0, 0))
+        )
+        left, top, right, bottom = bbox
+        descriptor = b"," + b"".join(
+            value.to_bytes(2, "little") for value in (left, top, right - left, bottom - top)
+        )
+        if table == self.table:
+            self.fp.write(descriptor + b"\x00")
+        else:
+            self.fp.write(descriptor + bytes((0x80 | _tableBits(table),)) + table)
+        self.fp.write(data)
+        self.written += 1
+
+    def close(self):
+        self.flush()
+        self.fp.write(b";")
+        self.previous = None
+
+
+class PeakMemory:
+    """
+    Context manager sampling the resident set size of this process, peak is
+    the largest one seen in bytes, or None without psutil.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = None
+
+    def __enter__(self):
+        if psutil is not None:
+            self.process = psutil.Process()
+            self.peak = self.process.memory_info().rss
+            self.stopped = Event()
+            self.thread = Thread(target=self.sample, name="PeakMemory", daemon=True)
+            self.thread.start()
+        return self
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __exit__(self, *exc):
+        if psutil is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+class GifPreparer:
+    def __init__(
+        self, frames: List[Image.Image], info: dict, workers=None, processes=False, globalPalette=False
+    ):
+        # a list of frames, or a GifFrames decoding them again on every pass
+        self.frames = frames
+        # fitted frames are opaque, a transparent index would punch holes in them
+        self.info = {key: value for key, value in info.items() if key != "transparency"}
+        self.workers = workers or os.cpu_count() or 1
+        self.memory = None
+        self.samples = {}
+        self.palettes = {}
+        # whether the frames share a palette, decided with the first one
+        self.shared = None if globalPalette else False
+        if processes and isinstance(frames, list):
+            size = frames[0].size
+            length = size[0] * size[1] * 3
+            self.memory = shared_memory.SharedMemory(create=True, size=length * len(frames))
+            for index, frame in enumerate(frames):
+                self.memory.buf[index * length : (index + 1) * length] = frame.tobytes()
+            self.executor = ProcessPoolExecutor(
+                self.workers,
+                initializer=_attachFrames,
+                initargs=(self.memory.name, size, len(frames)),
+            )
+        elif processes:
+            # streamed frames are pickled to the workers, a few at a time
+            self.executor = ProcessPoolExecutor(self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="GifQuantizer")
+
+    def sample(self, indices) -> List[Image.Image]:
+        if isinstance(self.frames, list):
+            return [self.frames[index] for index in indices]
+        # the sampled frames are the same on every pass, keep them decoded
+        missing = [index for index in indices if index not in self.samples]
+        if missing:
+            self.samples.update(zip(missing, self.frames.select(missing)))
+        return [self.samples[index] for index in indices]
+
+    @timing
+    def palette(self, colors: int):
+        """
+        The palette shared by every frame, or None when each gets its own. It
+        is quantized from the sampled frames at half resolution, one colour
+        short of colors so an index stays free for the transparent pixels.
+        """
+        if self.shared is False:
+            return None
+        if colors not in self.palettes:
+            count = len(self.frames)
+            indices = sorted({min(first + 1, count - 1) for first, _ in self.strata()} | {0})
+            frames = self.sample(indices)
+            width, height = frames[0].width // 2, frames[0].height // 2
+            montage = Image.new("RGB", (width, height * len(frames)))
+            for index, frame in enumerate(frames):
+                montage.paste(frame.reduce(2), (0, height * index))
+            quantized = montage.quantize(min(colors, MAX_COLORS - 1))
+            # only the palette travels to the workers
+            palette = Image.new("P", (1, 1))
+            palette.putpalette(quantized.getpalette())
+            self.palettes[colors] = palette
+            if self.shared is None:
+                self.shared = self.paletteLoss(frames, colors, palette) <= MAX_PALETTE_LOSS
+                if not self.shared:
+                    return None
+        return self.palettes[colors]
+
+    @timing
+    def paletteLoss(self, frames: List[Image.Image], colors: int, palette: Image.Image) -> float:
+        """PSNR in dB frames lose when quantized to palette instead of their own."""
+        count = len(frames)
+        own = meanSquaredError(frames, self.executor.map(quantizeFrame, frames, [colors] * count))
+        shared = meanSquaredError(
+            frames, self.executor.map(quantizeFrame, frames, [colors] * count, [palette] * count)
+        )
+        if shared == own:
+            return 0
+        return math.inf if own == 0 else 10 * math.log10(shared / own)
+
+    @timing
+    def quantize(self, colors: int, indices=None) -> List[Image.Image]:
+        if indices is None:
+            return list(self.quantized(colors))
+        count = len(indices)
+        palette = self.palette(colors)
+        if self.memory is not None:
+            return list(
+                self.executor.map(
+                    _quantizeShared,
+                    indices,
+                    [colors] * count,
+                    [palette] * count,
+                    chunksize=max(1, count // (self.workers * 4)),
+                )
+            )
+        frames = self.sample(indices)
+        return list(self.executor.map(quantizeFrame, frames, [colors] * count, [palette] * count))
+
+    def quantized(self, colors: int):
+        """Every frame quantized to colors, in order, a few in flight at a time."""
+        palette = self.palette(colors)
+        if self.memory is not None:
+            arguments = ((index, colors, palette) for index in range(len(self.frames)))
+            return windowed(self.executor, _quantizeShared, arguments, self.workers * 2)
+        arguments = ((frame, colors, palette) for frame in self.frames)
+        return windowed(self.executor, quantizeFrame, arguments, self.workers * 2)
+
+    def save(self, frames: List[Image.Image], duration=None) -> bytes:
+        output = BytesIO()
+        writer = GifWriter(output, self.info, duration, bool(self.shared))
+        for frame in frames:
+            writer.append(frame)
+        writer.close()
+        return output.getvalue()
+
+    @timing
+    def encode(self, colors: int, duration=None) -> bytes:
+        return self.encodeWithin(colors, None, duration)[0]
+
+    @timing
+    def encodeWithin(self, colors: int, limit, duration=None):
+        """
+        (GIF bytes, size) of every frame quantized to colors, streamed through
+        a GifWriter. Once the output passes limit the rest of the frames are
+        skipped and (None, size the whole GIF was heading for) is returned.
+        """
+        count = len(self.frames)
+        # the output only comes back into memory once it is known to fit
+        with tempfile.TemporaryFile() as spool:
+            # quantized() settles whether the frames share a palette
+            frames = self.quantized(colors)
+            writer = GifWriter(spool, self.info, duration, bool(self.shared))
+            try:
+                for done, frame in enumerate(frames, 1):
+                    writer.append(frame)
+                    if limit is not None and spool.tell() > limit:
+                        return None, spool.tell() * count // done
+            finally:
+                frames.close()
+            writer.close()
+            spool.seek(0)
+            data = spool.read()
+        return data, len(data)
+
+    def strata(self):
+        """(first, end) frame ranges the sample is drawn from, one run per range."""
+        count = len(self.frames)
+        return [
+            (count * stratum // SAMPLE_STRATA, count * (stratum + 1) // SAMPLE_STRATA)
+            for stratum in range(SAMPLE_STRATA)
+        ]
+
+    @timing
+    def estimate(self, colors: int, duration=None) -> int:
+        """
+        Predicted size of encode(colors). Frames after the first are stored
+        as changes from the previous one, so each stratum encodes one frame
+        alone and together with its successor: the difference is what a
+        frame of that stratum adds to the whole animation.
+        """
+        count = len(self.frames)
+        if count <= SAMPLE_STRATA * 2:
+            return len(self.encode(colors, duration))
+
+        strata = self.strata()
+        indices = []
+        for first, _ in strata:
+            indices += [first, first + 1]
+        quantized = self.quantize(colors, indices)
+
+        total = 0
+        for stratum, (first, end) in enumerate(strata):
+            alone = len(self.save(quantized[2 * stratum : 2 * stratum + 1], duration))
+            pair = len(self.save(quantized[2 * stratum : 2 * stratum + 2], duration))
+            if stratum == 0:
+                # the first frame is stored whole, with the file header
+                total += alone
+                first += 1
+            total += (pair - alone) * (end - first)
+        return total
+
+    def search(self, maxSize: int, size, upper=MAX_COLORS, log=None):
+        """
+        Binary search the largest palette, up to upper, whose size(colors)
+        fits in maxSize bytes, stopping early once more colours no longer
+        change the size. Returns None when even MIN_COLORS does not fit.
+        """
+        color_boundary = [MIN_COLORS, upper]
+        best = None
+        previous_run = (0, 0)
+
+        for iteration in range(MAX_PASSES):
+            colors = color_boundary[0] + (color_boundary[1] - color_boundary[0]) // 2
+            gif_size = size(colors)
+            if log:
+                log(iteration, colors, gif_size, None)
+
+            if gif_size > maxSize:
+                if colors == color_boundary[0]:
+                    break
+                color_boundary[1] = colors
+            else:
+                color_boundary[0] = best = colors
+                if (previous_run[0] <= colors and previous_run[1] == gif_size) or \
+                   (color_boundary[1] - color_boundary[0] < 10):
+                    break
+            previous_run = (colors, gif_size)
+        return best
+
+    def fit(self, maxSize: int, duration=None, log=print) -> bytes:
+        """
+        GIF with the largest palette that fits in maxSize bytes, or the
+        smallest one found when none does. The search runs on estimate() and
+        only the chosen palette is fully encoded; if that misses, the
+        estimates are scaled by the error and searched again once, and only
+        if that misses too does an exact search of the smaller palettes
+        follow. Encodes that miss stop as soon as they pass maxSize.
+        log(pass, colors, predicted, actual) gets every pass, actual is None
+        for estimated ones and projected for encodes stopped early.
+        """
+        estimates = {}
+
+        def predict(colors):
+            if colors not in estimates:
+                estimates[colors] = self.estimate(colors, duration)
+            return estimates[colors]
+
+        passes = 0
+
+        def logPass(iteration, colors, predicted, actual):
+            nonlocal passes
+            log(passes, colors, predicted, actual)
+            passes += 1
+
+        # size of every full encode, and the bytes of those that fit
+        sizes = {}
+        encoded = {}
+
+        def encodeFit(colors):
+            if colors not in sizes:
+                gif_data, sizes[colors] = self.encodeWithin(colors, maxSize, duration)
+                if gif_data is not None:
+                    encoded[colors] = gif_data
+            return encoded.get(colors), sizes[colors]
+
+        def smallest(sizes):
+            return min(sizes, key=lambda colors: (sizes[colors], -colors))
+
+        colors = self.search(maxSize, predict, log=logPass)
+        if colors is None:
+            # fewer colours dither into noisier frames that can take more
+            # space, above all with a shared palette, so the largest may fit
+            logPass(0, MAX_COLORS, predict(MAX_COLORS), None)
+            colors = smallest(estimates)
+        gif_data, size = encodeFit(colors)
+        logPass(0, colors, predict(colors), size)
+        if gif_data is not None:
+            return gif_data
+
+        error = size / predict(colors)
+        colors = self.search(
+            maxSize, lambda colors: round(predict(colors) * error), colors, logPass
+        )
+        if colors is not None:
+            gif_data, size = encodeFit(colors)
+            logPass(0, colors, round(predict(colors) * error), size)
+            if gif_data is not None:
+                return gif_data
+
+        # estimates are too far off for this animation, search exactly
+        # below the smallest palette that missed
+        def exact(colors):
+            return encodeFit(colors)[1]
+
+        colors = self.search(
+            maxSize, exact, min(sizes), lambda _, colors, size, __: logPass(0, colors, size, size)
+        )
+        if colors is None:
+            colors = smallest(sizes)
+        return encoded.get(colors) or self.encode(colors, duration)
+
+    def cancel(self):
+        """Abandon a fit() running on another thread, its next wait raises."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        self.executor.shutdown()
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
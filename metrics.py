@@ -0,0 +1,235 @@
+"""
+Span recording behind utils.timing.
+
+Every thread records into its own ThreadSpans: a preallocated ring buffer of
+the most recent (span, start, duration) triples and a fixed bucket histogram
+per span name, so recording a span takes no lock and allocates nothing once
+the span name is known. Readers merge the per-thread data when metrics are
+scraped (/metrics, Prometheus text format) or summarised, tolerating the
+counters of a span that is being recorded at the same moment. Threads that
+have exited are folded into one retired histogram on the next scrape and
+their ring buffers released, so pools and restarted workers do not pile up.
+"""
+
+import threading
+import time
+import weakref
+from array import array
+from bisect import bisect_right
+from time import perf_counter_ns
+
+# histogram bucket upper bounds, in ns
+SPAN_BUCKETS_NS = [
+    bound * 1000
+    for bound in (
+        10, 50, 100, 250, 500,
+        1_000, 2_500, 5_000, 10_000, 25_000, 50_000,
+        100_000, 250_000, 500_000, 1_000_000, 5_000_000,
+    )
+]
+RING_SIZE = 4096
+
+
+class ThreadSpans:
+    __slots__ = ("threadName", "thread", "ring", "position", "counts", "sums", "stack")
+
+    def __init__(self, threadName: str, ringSize: int, thread=None):
+        self.threadName = threadName
+        self.thread = weakref.ref(thread) if thread is not None else None
+        # span id, start and duration of the last ringSize spans
+        self.ring = array("q", bytes(3 * 8 * ringSize))
+        self.position = 0
+        self.counts = []
+        self.sums = []
+        # ids of the spans open on this thread, innermost last
+        self.stack = []
+
+    def alive(self) -> bool:
+        thread = self.thread() if self.thread is not None else None
+        return thread is not None and thread.is_alive()
+
+    def grow(self, spanId: int):
+        if spanId >= len(self.counts):
+            for _ in range(len(self.counts), spanId + 1):
+                self.counts.append([0] * (len(SPAN_BUCKETS_NS) + 1))
+                self.sums.append(0)
+
+    def record(self, spanId: int, start: int, duration: int):
+        self.grow(spanId)
+        self.counts[spanId][bisect_right(SPAN_BUCKETS_NS, duration)] += 1
+        self.sums[spanId] += duration
+        offset = self.position % (len(self.ring) // 3) * 3
+        self.ring[offset] = spanId
+        self.ring[offset + 1] = start
+        self.ring[offset + 2] = duration
+        self.position += 1
+
+    def merge(self, other: "ThreadSpans"):
+        """Add the histograms of other, whose thread no longer records."""
+        for spanId, (counts, total) in enumerate(zip(other.counts, other.sums)):
+            self.grow(spanId)
+            merged = self.counts[spanId]
+            for bucket, count in enumerate(counts):
+                merged[bucket] += count
+            self.sums[spanId] += total
+
+
+class SpanRecorder:
+    def __init__(self, ringSize=RING_SIZE):
+        self.ringSize = ringSize
+        self.names = []
+        self.ids = {}
+        self.threads = []
+        # histograms of the threads that have exited, without ring buffer
+        self.retired = ThreadSpans("retired", 0)
+        self.local = threading.local()
+        # only taken to register span names and threads
+        self.lock = threading.Lock()
+
+    def spanId(self, name: str) -> int:
+        spanId = self.ids.get(name)
+        if spanId is None:
+            with self.lock:
+                spanId = self.ids.get(name)
+                if spanId is None:
+                    spanId = self.ids[name] = len(self.names)
+                    self.names.append(name)
+        return spanId
+
+    def threadSpans(self) -> ThreadSpans:
+        try:
+            return self.local.spans
+        except AttributeError:
+            thread = threading.current_thread()
+            spans = self.local.spans = ThreadSpans(thread.name, self.ringSize, thread)
+            with self.lock:
+                self.threads.append(spans)
+            return spans
+
+    def span(self, name: str, func):
+        spanId = self.spanId(name)
+
+        def inner(*args, **kwargs):
+            spans = self.threadSpans()
+            spans.stack.append(spanId)
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                spans.record(spans.stack.pop(), start, perf_counter_ns() - start)
+
+        inner.__name__ = func.__name__
+        inner.__qualname__ = func.__qualname__
+        inner.__doc__ = func.__doc__
+        return inner
+
+    def note(self, note: str):
+        """Record the innermost open span of this thread as "name [note]"."""
+        stack = self.threadSpans().stack
+        if stack:
+            stack[-1] = self.spanId("{} [{}]".format(self.names[stack[-1]], note))
+
+    def prune(self):
+        """Fold the spans of exited threads into the retired histograms."""
+        with self.lock:
+            alive = []
+            for spans in self.threads:
+                if spans.alive():
+                    alive.append(spans)
+                else:
+                    self.retired.merge(spans)
+            self.threads = alive
+
+    def histograms(self):
+        """{name: (bucket counts, total ns)} merged across threads."""
+        self.prune()
+        merged = {}
+        for spans in [self.retired] + self.threads:
+            for spanId, (counts, total) in enumerate(zip(list(spans.counts), list(spans.sums))):
+                name = self.names[spanId]
+                if name in merged:
+                    mergedCounts, mergedTotal = merged[name]
+                    merged[name] = (
+                        [a + b for a, b in zip(mergedCounts, counts)],
+                        mergedTotal + total,
+                    )
+                else:
+                    merged[name] = (list(counts), total)
+        return merged
+
+    def recent(self):
+        """{name: [durations in ns]} of the spans still held in the ring buffers."""
+        self.prune()
+        durations = {}
+        for spans in list(self.threads):
+            ring = spans.ring.tolist()
+            for offset in range(0, 3 * min(spans.position, self.ringSize), 3):
+                name = self.names[ring[offset]]
+                durations.setdefault(name, []).append(ring[offset + 2])
+        return durations
+
+    def prometheus(self, counters=None, gauges=None) -> str:
+        """Span histograms plus the given {name: value} counters and gauges."""
+        lines = [
+            "# HELP kraken_span_duration_seconds Time spent in instrumented calls.",
+            "# TYPE kraken_span_duration_seconds histogram",
+        ]
+        for name, (counts, total) in sorted(self.histograms().items()):
+            label = name.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            cumulative = 0
+            for bound, count in zip(SPAN_BUCKETS_NS + [None], counts):
+                cumulative += count
+                le = "+Inf" if bound is None else repr(bound / 1e9)
+                lines.append(
+                    'kraken_span_duration_seconds_bucket{{span="{}",le="{}"}} {}'.format(
+                        label, le, cumulative
+                    )
+                )
+            lines.append(
+                'kraken_span_duration_seconds_sum{{span="{}"}} {}'.format(label, total / 1e9)
+            )
+            lines.append(
+                'kraken_span_duration_seconds_count{{span="{}"}} {}'.format(label, cumulative)
+            )
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name, value in (values or {}).items():
+                lines.append("# TYPE kraken_{} {}".format(name, kind))
+                lines.append("kraken_{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Per span count, total and percentiles of the recent spans, busiest first."""
+        rows = []
+        for name, durations in self.recent().items():
+            durations.sort()
+            count = len(durations)
+            rows.append(
+                (
+                    sum(durations),
+                    "{:40} {:7} calls {:9.2f}ms total  p50 {:7.3f}  p95 {:7.3f}  p99 {:7.3f}  max {:7.3f}ms".format(
+                        name[:40],
+                        count,
+                        sum(durations) / 1e6,
+                        durations[count // 2] / 1e6,
+                        durations[min(count - 1, count * 95 // 100)] / 1e6,
+                        durations[min(count - 1, count * 99 // 100)] / 1e6,
+                        durations[-1] / 1e6,
+                    ),
+                )
+            )
+        rows.sort(reverse=True)
+        return "\n".join(row for _, row in rows)
+
+    def startSummary(self, interval: float):
+        """Print summary() every interval seconds from a daemon thread."""
+
+        def run():
+            while True:
+                time.sleep(interval)
+                print("Timings of the last {} spans per thread:".format(self.ringSize))
+                print(self.summary())
+
+        threading.Thread(target=run, name="TimingSummary", daemon=True).start()
+
+
+recorder = SpanRecorder()
@@ -0,0 +1,189 @@
+"""
+Overlay composition and encoding for the SignalRGB bridge.
+
+OverlayRenderer turns a decoded canvas and its overlay settings into a device
+frame: it draws the ring, sensor text and spinner over the canvas and encodes
+the result for the LCD. It holds no threads or buffers, so signalrgb.py runs
+it from its OverlayProducer thread while benchmark.py drives it directly.
+"""
+
+from PIL import Image, ImageDraw
+from pipeline import ResamplePolicy, decodeFrame
+from spinner import SpinnerRenderer
+from textsprites import TextSprites
+from utils import LRUCache, timing
+
+MIN_SPEED = 2
+BASE_SPEED = 18
+
+# overlay settings used until the plugin sends its own
+OVERLAY_DEFAULTS = {
+    "rotation": 0,
+    "colorPalette": "WEB",
+    "composition": "OVERLAY",
+    "overlayTransparency": 0,
+    "spinner": "STATIC",
+    "textOverlay": True,
+    "titleText": "SignalRGB",
+    "titleFontSize": 40,
+    "sensorFontSize": 160,
+    "sensorLabelFontSize": 40,
+    "sensorSource": "Liquid",
+}
+
+SENSOR_MAP = {
+    "Liquid": ("liquid", "Liquid"),
+    "CPU Temp": ("cpu_temp", "CPU"),
+    "GPU Temp": ("gpu_temp", "GPU"),
+}
+
+
+class OverlayRenderer:
+    def __init__(self, lcd, fontFile: str, stats: dict, resample: ResamplePolicy = None):
+        self.lcd = lcd
+        self.stats = stats
+        # text and ring layers only change with the settings or the sensor
+        # value, the CPU/PUMP spinner is the only part redrawn every frame
+        self.staticLayers = LRUCache(4)
+        self.overlayLayers = LRUCache(16)
+        self.resample = resample or ResamplePolicy()
+        self.nativeOverlay = (None, None)
+        self.spinner = SpinnerRenderer(lcd.resolution)
+        self.text = TextSprites(fontFile)
+
+    @timing
+    def parseFrame(self, postData):
+        return decodeFrame(postData, self.lcd.resolution, self.resample)
+
+    @timing
+    def renderOverlay(self, data):
+        alpha = 255
+        if data["composition"] == "OVERLAY":
+            alpha = round((100 - data["overlayTransparency"]) * 255 / 100)
+
+        layer = self.textLayer(data, alpha)
+        if data["spinner"] == "CPU" or data["spinner"] == "PUMP":
+            angle = MIN_SPEED + BASE_SPEED * self.stats[data["spinner"].lower()] / 100
+            spinner = self.spinner.render(angle, alpha, data["rotation"])
+            return Image.alpha_composite(spinner, layer)
+        return layer
+
+    def textLayer(self, data, alpha):
+        """Ring and text overlay, already rotated. Shared, must not be modified."""
+        resolution = self.lcd.resolution
+        source = data.get("sensorSource", "Liquid")
+        sensor_key, sensor_label = SENSOR_MAP.get(source, ("liquid", "Liquid"))
+        sensor_val = self.stats.get(sensor_key)
+        if sensor_val is not None:
+            value_text = "{:.0f}".format(sensor_val)
+        else:
+            value_text = "--"
+
+        staticKey = (alpha, data["spinner"] == "STATIC", data["textOverlay"])
+        valueKey = None
+        if data["textOverlay"]:
+            staticKey += (
+                data["titleText"],
+                data["titleFontSize"],
+                data["sensorLabelFontSize"],
+                sensor_label,
+            )
+            valueKey = (value_text, data["sensorFontSize"])
+        key = (staticKey, valueKey, data["rotation"])
+
+        layer = self.overlayLayers.get(key)
+        if layer is not None:
+            return layer
+
+        static = self.staticLayers.get(staticKey)
+        if static is None:
+            static = self.staticLayers.put(
+                staticKey, self.renderStaticLayer(data, alpha, sensor_label)
+            )
+
+        layer = static.copy()
+        if data["textOverlay"]:
+            textBbox = self.text.draw(
+                layer,
+                (resolution.width // 2, resolution.height // 2),
+                value_text,
+                data["sensorFontSize"],
+                (255, 255, 255, alpha),
+            )
+            self.text.draw(
+                layer,
+                (textBbox[2], textBbox[1]),
+                "°",
+                data["sensorFontSize"] // 3,
+                (255, 255, 255, alpha),
+                anchor="lt",
+            )
+
+        return self.overlayLayers.put(key, layer.rotate(data["rotation"]))
+
+    def renderStaticLayer(self, data, alpha, sensor_label):
+        resolution = self.lcd.resolution
+        overlay = Image.new("RGBA", resolution, (0, 0, 0, 0))
+        overlayCanvas = ImageDraw.Draw(overlay)
+
+        if data["spinner"] == "STATIC":
+            overlayCanvas.ellipse(
+                [(0, 0), resolution],
+                outline=(255, 255, 255, alpha),
+                width=resolution.width // 20,
+            )
+        if data["textOverlay"]:
+            self.text.draw(
+                overlay,
+                (resolution.width // 2, resolution.height // 5),
+                data["titleText"],
+                data["titleFontSize"],
+                (255, 255, 255, alpha),
+            )
+            self.text.draw(
+                overlay,
+                (resolution.width // 2, 4 * resolution.height // 5),
+                sensor_label,
+                data["sensorLabelFontSize"],
+                (255, 255, 255, alpha),
+            )
+
+        return overlay
+
+    @timing
+    def scaleOverlay(self, overlay, size):
+        # cached text layers are reused as-is, so remember the last one scaled
+        source, scaled = self.nativeOverlay
+        if source is not overlay or scaled.size != size:
+            scaled = overlay.resize(size, Image.Resampling.BOX)
+            self.nativeOverlay = (overlay, scaled)
+        return scaled
+
+    @timing
+    def compose(self, data, img, overlay):
+        if data["composition"] == "MIX":
+            return Image.composite(
+                img, Image.new("RGBA", img.size, (0, 0, 0, 0)), overlay
+            )
+        if data["composition"] == "OVERLAY":
+            return Image.alpha_composite(img, overlay)
+
+    @timing
+    def composeFrame(self, data, img) -> Image.Image:
+        """Canvas with the overlay described by data drawn over it, at LCD resolution."""
+        if data["composition"] != "OFF":
+            if img.mode != "RGBA":
+                img = img.convert("RGBA")
+            overlay = self.renderOverlay(data)
+            if overlay.size != img.size:
+                overlay = self.scaleOverlay(overlay, img.size)
+            img = self.compose(data, img, overlay)
+        if img.size != self.lcd.resolution:
+            # native compose, the only full resolution pass left is this one
+            img = self.resample.resize(img.convert("RGB"), self.lcd.resolution)
+        return img
+
+    @timing
+    def encodeFrame(self, img, adaptive=False):
+        # identical frames are skipped by FrameWriter from the payload alone
+        return self.lcd.imageToFrame(img, adaptive=adaptive)
@@ -0,0 +1,231 @@
+"""
+Frame decoding for the SignalRGB bridge, optionally spread over several workers.
+
+Decoding the posted image and scaling it to the LCD resolution is stateless, so
+ParallelDecoder can run it on N threads or processes. Overlay drawing (the
+spinner carries state from frame to frame) and encoding (the driver recycles
+its output buffers) stay on the overlay thread, which receives the decoded
+frames strictly in submission order.
+"""
+
+import base64
+import json
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from multiprocessing import shared_memory
+from PIL import Image
+from utils import timing, timingNote
+
+# Body of a /frame/raw request: packed RGB when width and height are given,
+# otherwise an encoded PNG/JPEG
+RawFrame = namedtuple("RawFrame", ["body", "width", "height", "rotation"])
+
+# well above any SignalRGB canvas or LCD, bounds what a raw frame may claim
+MAX_RAW_SIDE = 4096
+
+RESAMPLE_FILTERS = {
+    "nearest": Image.Resampling.NEAREST,
+    "bilinear": Image.Resampling.BILINEAR,
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+}
+
+
+class ResamplePolicy:
+    """
+    Chooses the filter that scales SignalRGB canvases to the LCD. "auto" uses
+    BILINEAR when the canvas is upscaled 4x or more (the 40x40 default is
+    upscaled 16x, where LANCZOS costs twice as much and its extra taps only
+    add ringing) and LANCZOS otherwise. The choice is made once per pair of
+    sizes. With native set, frames stay at canvas resolution and the overlay
+    is composed there, so only the final image is scaled.
+    """
+
+    def __init__(self, name="auto", native=False):
+        if name != "auto" and name not in RESAMPLE_FILTERS:
+            raise ValueError(f"unknown resample filter {name!r}")
+        self.name = name
+        self.native = native
+        self.filters = {}
+
+    def filter(self, source, target):
+        key = (source, target)
+        resample = self.filters.get(key)
+        if resample is None:
+            if self.name != "auto":
+                resample = RESAMPLE_FILTERS[self.name]
+            elif source[0] * 4 <= target[0] and source[1] * 4 <= target[1]:
+                resample = Image.Resampling.BILINEAR
+            else:
+                resample = Image.Resampling.LANCZOS
+            self.filters[key] = resample
+        return resample
+
+    @timing
+    def resize(self, img: Image.Image, target) -> Image.Image:
+        target = tuple(target)
+        if img.size == target:
+            return img
+        resample = self.filter(img.size, target)
+        timingNote(
+            "{} {}x{} -> {}x{}".format(resample.name, *img.size, *target)
+        )
+        return img.resize(target, resample)
+
+
+def checkRawFrame(frame: RawFrame) -> RawFrame:
+    """
+    Raise ValueError unless frame is either an encoded image (no width and
+    height) or exactly width * height packed RGB pixels. Runs where frames
+    arrive, so a bad client gets an error instead of the overlay thread.
+    """
+    if not frame.width and not frame.height:
+        return frame
+    if not (0 < frame.width <= MAX_RAW_SIDE and 0 < frame.height <= MAX_RAW_SIDE):
+        raise ValueError(
+            "raw frame size {}x{} outside 1..{}".format(
+                frame.width, frame.height, MAX_RAW_SIDE
+            )
+        )
+    expected = frame.width * frame.height * 3
+    if len(frame.body) != expected:
+        raise ValueError(
+            "raw {}x{} frame needs {} bytes, got {}".format(
+                frame.width, frame.height, expected, len(frame.body)
+            )
+        )
+    return frame
+
+
+def decodeFrame(payload, resolution, resample: ResamplePolicy = None):
+    """
+    Decode a /frame JSON body or a RawFrame and scale it to resolution, unless
+    the resample policy composes at native resolution. Returns (settings,
+    image) where settings holds whatever overlay settings travelled with the
+    frame: all of them for JSON bodies, only the rotation for raw frames.
+    Images come back as RGB or RGBA; scaling RGB is about three times cheaper,
+    so converting for composition is left to the caller.
+    """
+    if isinstance(payload, RawFrame):
+        settings = {"rotation": payload.rotation}
+        if payload.width and payload.height:
+            img = Image.frombuffer(
+                "RGB",
+                (payload.width, payload.height),
+                payload.body,
+                "raw",
+                "RGB",
+                0,
+                1,
+            )
+        else:
+            img = Image.open(BytesIO(payload.body))
+    else:
+        settings = json.loads(bytes(payload).decode("utf-8"))
+        img = Image.open(BytesIO(base64.b64decode(settings.pop("raw"))))
+
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    if resample is None:
+        resample = ResamplePolicy()
+    if not resample.native:
+        img = resample.resize(img, resolution)
+    return settings, img
+
+
+_attachedSlots = {}
+
+
+def _decodeToSlot(payload, resolution, resample, slotName):
+    # runs in a worker process, the pixels go back through shared memory so
+    # only the small settings dict is pickled
+    settings, img = decodeFrame(payload, resolution, resample)
+    slot = _attachedSlots.get(slotName)
+    if slot is None:
+        slot = _attachedSlots[slotName] = shared_memory.SharedMemory(slotName)
+    pixels = img.tobytes()
+    if len(pixels) > len(slot.buf):
+        # a native resolution canvas larger than the LCD, pickled instead
+        return settings, img.mode, img.size, pixels
+    slot.buf[: len(pixels)] = pixels
+    return settings, img.mode, img.size, None
+
+
+class ParallelDecoder:
+    def __init__(
+        self, resolution, workers: int, processes=False, resample: ResamplePolicy = None
+    ):
+        self.resolution = tuple(resolution)
+        self.resample = resample or ResamplePolicy()
+        self.workers = workers
+        self.sequence = 0
+        self.pending = deque()
+        self.slots = []
+        if processes:
+            self.executor = ProcessPoolExecutor(workers)
+            # one slot per frame in flight plus the one being composed; frames
+            # complete in order so slots can be recycled round-robin. They fit
+            # an RGBA frame at LCD resolution, larger native canvases are
+            # pickled back instead
+            size = self.resolution[0] * self.resolution[1] * 4
+            self.slots = [
+                shared_memory.SharedMemory(create=True, size=size)
+                for _ in range(workers + 1)
+            ]
+        else:
+            self.executor = ThreadPoolExecutor(
+                workers, thread_name_prefix="FrameDecoder"
+            )
+
+    def busy(self) -> bool:
+        return len(self.pending) >= self.workers
+
+    def idle(self) -> bool:
+        return not self.pending
+
+    def submit(self, payload, *context):
+        """Queue payload for decoding, context is handed back with the result."""
+        if self.slots:
+            if isinstance(payload, RawFrame):
+                # memoryviews into WebSocket messages cannot be pickled
+                payload = payload._replace(body=bytes(payload.body))
+            slot = self.slots[self.sequence % len(self.slots)]
+            future = self.executor.submit(
+                _decodeToSlot, payload, self.resolution, self.resample, slot.name
+            )
+        else:
+            slot = None
+            future = self.executor.submit(
+                decodeFrame, payload, self.resolution, self.resample
+            )
+        self.pending.append((self.sequence, future, slot, context))
+        self.sequence += 1
+
+    def next(self):
+        """
+        Wait for the oldest submitted frame and return (sequence, settings,
+        image, context). With process workers the image is backed by shared
+        memory and is only valid until `workers` more frames are submitted.
+        """
+        sequence, future, slot, context = self.pending.popleft()
+        if slot is None:
+            settings, img = future.result()
+        else:
+            settings, mode, size, pixels = future.result()
+            if pixels is None:
+                img = Image.frombuffer(mode, size, slot.buf, "raw", mode, 0, 1)
+            else:
+                img = Image.frombuffer(mode, size, pixels, "raw", mode, 0, 1)
+        return sequence, settings, img, context
+
+    def superseded(self) -> bool:
+        """Whether a frame submitted after the last one returned is decoded already."""
+        return any(future.done() for _, future, _, _ in self.pending)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
+        self.slots = []
@@ -1,10 +1,16 @@
-from dataclasses import dataclass, field
-from typing import Dict, Optional
+import sys
+import time
+from typing import Dict, List, Tuple
 
 from PIL import Image
 
 from utils import debugQ565, timing
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 Q565_OP_INDEX = 0b0000_0000
 
 Q565_OP_DIFF = 0b0100_0000
@@ -22,123 +28,20 @@ Q565_MASK_3 = 0b1110_0000
 
 Q565_MAGIC = ord("q") << 24 | ord("5") << 16 | ord("6") << 8 | ord("5")
 
+Q565_MAX_RUN = 62
 
-@dataclass
-class Pixel:
-    px_bytes: bytearray = field(init=False)
-
-    def __post_init__(self):
-        self.px_bytes = bytearray((0, 0))
-
-    def setBytes(self, values: bytes) -> None:
-        if len(values) != 2:
-            raise ValueError("a tuple of 2 values should be provided")
-
-        self.px_bytes[0:2] = values
-
-    def setRGB565(self, values: tuple):
-        data = values[0] << 11 | values[1] << 5 | values[2]
-        self.px_bytes[0:2] = data.to_bytes(2, "big")
-
-    def __str__(self) -> str:
-        r, g, b = self.RGB565
-        return f"R: {r} G: {g} B: {b}"
-
-    def smallDiff(self, diff):
-        rDiff = ((diff >> 4) & 0b11) - 2
-        gDiff = ((diff >> 2) & 0b11) - 2
-        bDiff = (diff & 0b11) - 2
-
-        self.applyDiff((rDiff, gDiff, bDiff))
-
-    def largeDiff(self, diff1, diff2):
-        gDiff = (diff1 & 0b0001_1111) - 16
-        rDiff = ((diff2 >> 4) & 0x0F) - 8 + gDiff
-        bDiff = (diff2 & 0x0F) - 8 + gDiff
-
-        self.applyDiff((rDiff, gDiff, bDiff))
-
-    def indexedDiff(self, diff1, diff2):
-        gDiff = ((diff1 & 0b0001_1100) >> 2) - 4
-        rDiff = (diff1 & 0b0000_0011) - 2
-        bDiff = (diff2 >> 6) - 2
-
-        self.applyDiff((rDiff, gDiff, bDiff))
-
-    def applyDiff(self, diffs):
-        rDiff, gDiff, bDiff = diffs
-        r, g, b = self.RGB565
-        before = self.int
-        red = (r + rDiff) & 0b1_1111
-        green = (g + gDiff) & 0b11_1111
-        blue = (b + bDiff) & 0b1_1111
-        self.setRGB565((red, green, blue))
-        debugQ565(
-            "    before {} - diff [{} {} {}] - after {}".format(
-                before, *diffs, self.int
-            )
-        )
-
-    @property
-    def int(self):
-        return self.px_bytes[0] << 8 | self.px_bytes[1]
-
-    @property
-    def RGB565(self):
-        data = self.px_bytes[0] << 8 | self.px_bytes[1]
-        r = (data & 0b1111_1000_0000_0000) >> 11
-        g = (data & 0b0000_0111_1110_0000) >> 5
-        b = data & 0b0000_0000_0001_1111
-        return (r, g, b)
-
-    @property
-    def RGB888(self):
-        r, g, b = self.RGB565
-        r8 = (r * 527 + 23) >> 6
-        g8 = (g * 259 + 33) >> 6
-        b8 = (b * 527 + 23) >> 6
-
-        return (r8, g8, b8)
-
-    @property
-    def bytes(self) -> bytes:
-        return bytes(self.px_bytes)
-
-    @property
-    def hash(self) -> int:
-        return (self.px_bytes[0] + self.px_bytes[1]) & 0b0011_1111
-
-
-class ByteWriter:
-    def __init__(self, size: int):
-        self.bytes = bytearray(size)
-        self.write_pos = 0
-
-    def write(self, byte: int):
-        self.bytes[self.write_pos] = byte % 256
-        self.write_pos += 1
-
-    def output(self):
-        return bytes(self.bytes[0 : self.write_pos])
+# (red offset, green offset, blue offset, bytes per pixel) of supported inputs
+PIXEL_FORMATS = {
+    "RGB": (0, 1, 2, 3),
+    "RGBA": (0, 1, 2, 4),
+    "RGBX": (0, 1, 2, 4),
+    "BGRA": (2, 1, 0, 4),
+    "BGRX": (2, 1, 0, 4),
+}
 
-
-class ByteReader:
-    def __init__(self, data: bytes):
-        self.bytes = data
-        self.read_pos = 0
-        self.max_pos = len(self.bytes)
-
-    def read(self) -> Optional[int]:
-        if self.read_pos >= self.max_pos:
-            return None
-
-        out = self.bytes[self.read_pos]
-        self.read_pos += 1
-        return out
-
-    @timing
-    def output(self):
-        return bytes(self.bytes[0 : self.read_pos])
+# RGB888 -> RGB565 channel quantisation, same rounding as the rust encoder
+_R5 = [(v * 249 + 1014) >> 11 for v in range(256)]
+_G6 = [(v * 253 + 505) >> 10 for v in range(256)]
 
 
 @timing
@@ -156,197 +59,350 @@ def decode_to_img(img_bytes: bytes) -> Image.Image:
     return Image.frombuffer(out["channels"], size, bytes(out["bytes"]), "raw")
 
 
-def write_32_bits(value: int, writer: ByteWriter) -> None:
-    writer.write((0xFF000000 & value) >> 24)
-    writer.write((0x00FF0000 & value) >> 16)
-    writer.write((0x0000FF00 & value) >> 8)
-    writer.write((0x000000FF & value))
-
-
-def read_32_bits(reader: ByteReader) -> int:
-    data = [reader.read() for _ in range(4)]
-    b1, b2, b3, b4 = data
-    return b1 << 24 | b2 << 16 | b3 << 8 | b4
-
-
-def write_16_bits(value: bytes, writer: ByteWriter) -> None:
-    writer.write(value[0])
-    writer.write(value[1])
-
-
-def read_16_bits(reader: ByteReader) -> int:
-    data = [reader.read() for _ in range(2)]
-    b1, b2 = data
-    return b2 << 8 | b1
+def pixelFormatLayout(pixel_format: str) -> Tuple[int, int, int, int]:
+    layout = PIXEL_FORMATS.get(pixel_format)
+    if layout is None:
+        raise ValueError(
+            f"unsupported pixel format {pixel_format!r}, expected RGB, RGBA or BGRA"
+        )
+    return layout
+
+
+def rgb565Segments(
+    img_bytes: bytes, pixel_format: str = "RGB"
+) -> Tuple[List[int], List[int], int]:
+    """
+    Quantise pixels to RGB565 and return (starts, values, total): the index
+    of every pixel whose value differs from the one before it (the encoder
+    starts from a black pixel), the new value at that index and the pixel
+    count. Everything between two starts is a run of the same colour.
+    """
+    ro, go, bo, bpp = pixelFormatLayout(pixel_format)
+    total = len(img_bytes) // bpp
+
+    if numpy is not None:
+        px = numpy.frombuffer(img_bytes, dtype=numpy.uint8, count=total * bpp)
+        px = px.reshape(total, bpp).astype(numpy.uint16)
+        # 255 * 253 + 505 still fits in 16 bits
+        plane = (
+            ((px[:, ro] * 249 + 1014) >> 11) << 11
+            | ((px[:, go] * 253 + 505) >> 10) << 5
+            | ((px[:, bo] * 249 + 1014) >> 11)
+        )
+        changed = numpy.empty(total, dtype=bool)
+        changed[:1] = plane[:1] != 0
+        numpy.not_equal(plane[1:], plane[:-1], out=changed[1:])
+        starts = numpy.flatnonzero(changed)
+        return starts.tolist(), plane[starts].tolist(), total
+
+    end = total * bpp
+    plane = [
+        _R5[r] << 11 | _G6[g] << 5 | _R5[b]
+        for r, g, b in zip(
+            img_bytes[ro:end:bpp], img_bytes[go:end:bpp], img_bytes[bo:end:bpp]
+        )
+    ]
+    starts = []
+    values = []
+    prev = 0
+    for i, value in enumerate(plane):
+        if value != prev:
+            starts.append(i)
+            values.append(value)
+            prev = value
+    return starts, values, total
+
+
+def _writeRun(out: bytearray, count: int) -> None:
+    full, rest = divmod(count, Q565_MAX_RUN)
+    if full:
+        out += bytes((Q565_OP_RUN | (Q565_MAX_RUN - 1),)) * full
+    if rest:
+        out.append(Q565_OP_RUN | (rest - 1))
+
+
+def _writeDiffIndexed(out: bytearray, hash_array: List[int], r, g, b) -> bool:
+    # first table entry within r -2..1, g -4..3, b -2..1 of the pixel
+    for index_pos, base in enumerate(hash_array):
+        rDiff = (r - (base >> 11) + 2) & 0b1_1111
+        if rDiff > 3:
+            continue
+        gDiff = (g - ((base >> 5) & 0b11_1111) + 4) & 0b11_1111
+        if gDiff > 7:
+            continue
+        bDiff = (b - (base & 0b1_1111) + 2) & 0b1_1111
+        if bDiff > 3:
+            continue
+        out.append(Q565_OP_DIFF_INDEXED | gDiff << 2 | rDiff)
+        out.append(bDiff << 6 | index_pos)
+        return True
+    return False
 
 
 @timing
-def encode(img_bytes: bytes, width: int, height: int):
-    total_size = height * width
-    channels = 3
-    pixel_data = (
-        img_bytes[i : i + channels] for i in range(0, len(img_bytes), channels)
-    )
-    max_n_bytes = 6 + total_size * 3 + 1  # header + max 3 bytes per pixel + end
-    writer = ByteWriter(max_n_bytes)
-    hash_array = [Pixel() for _ in range(64)]
-    for px in hash_array:
-        px.setBytes(bytearray((0, 0)))
-
-    # write header
-    write_32_bits(Q565_MAGIC, writer)
-    write_16_bits(width.to_bytes(2, "little"), writer)
-    write_16_bits(height.to_bytes(2, "little"), writer)
-
-    # encode pixels
-
-    @timing
-    def loop():
-        run = 0
-        prev_px_value = Pixel()
-        px_value = Pixel()
-        for i, px in enumerate(pixel_data):
-            prev_px_value.setBytes(px_value.bytes)
-
-            r = (px[0] * 249 + 1014) >> 11
-            g = (px[1] * 253 + 505) >> 10
-            b = (px[2] * 249 + 1014) >> 11
-
-            px_value.setRGB565((r, g, b))
-
-            if px_value == prev_px_value:
-                run += 1
-                if run == 62 or (i + 1) >= total_size:
-                    writer.write(Q565_OP_RUN | (run - 1))
-                    run = 0
-                continue
-
-            if run:
-                writer.write(Q565_OP_RUN | (run - 1))
-                run = 0
-
-            index_pos = px_value.hash
-            if hash_array[index_pos] == px_value:
-                writer.write(Q565_OP_INDEX | index_pos)
-                continue
-
-            prevR, prevG, prevB = prev_px_value.RGB565
+def encode(
+    img_bytes: bytes,
+    width: int,
+    height: int,
+    pixel_format: str = "RGB",
+    diff_indexed: bool = False,
+):
+    """
+    Encode packed pixels to Q565. With diff_indexed, colours that would cost a
+    3 byte RGB565 op are matched against the 64 entry colour table and sent as
+    a 2 byte DIFF_INDEXED op when one is close enough. It is off by default so
+    the output matches the q565 crate, which never emits it.
+    """
+    starts, values, total = rgb565Segments(img_bytes, pixel_format)
+    if total != width * height:
+        raise ValueError(
+            f"expected {width * height} pixels for {width}x{height}, got {total}"
+        )
 
-            rDiff = (r - prevR) & 0b1_1111
-            gDiff = (g - prevG) & 0b11_1111
-            bDiff = (b - prevB) & 0b1_1111
+    out = bytearray()
+    out += Q565_MAGIC.to_bytes(4, "big")
+    out += width.to_bytes(2, "little")
+    out += height.to_bytes(2, "little")
+
+    # pixels matching the initial black pixel are a run
+    _writeRun(out, starts[0] if starts else total)
+
+    append = out.append
+    hash_array = [0] * 64
+    prevR = prevG = prevB = 0
+    segments = len(starts)
+    for n in range(segments):
+        value = values[n]
+        r = value >> 11
+        g = (value >> 5) & 0b11_1111
+        b = value & 0b1_1111
+        index_pos = ((value >> 8) + (value & 0xFF)) & 0b0011_1111
+
+        if hash_array[index_pos] == value:
+            append(Q565_OP_INDEX | index_pos)
+        else:
+            # wrapped signed channel differences, as the decoder wraps on apply
+            rDiff = ((r - prevR + 16) & 0b1_1111) - 16
+            gDiff = ((g - prevG + 32) & 0b11_1111) - 32
+            bDiff = ((b - prevB + 16) & 0b1_1111) - 16
 
-            if all(-2 <= x <= 1 for x in (rDiff, gDiff, bDiff)):
-                writer.write(
+            if -2 <= rDiff <= 1 and -2 <= gDiff <= 1 and -2 <= bDiff <= 1:
+                append(
                     Q565_OP_DIFF | (rDiff + 2) << 4 | (gDiff + 2) << 2 | (bDiff + 2)
                 )
-                continue
-
-            rgDiff = rDiff - gDiff
-            bgDiff = bDiff - gDiff
-
-            if all(-8 <= x <= 7 for x in (rgDiff, bgDiff)) and -16 <= gDiff <= 15:
-                writer.write(Q565_OP_LUMA | (gDiff + 16))
-                writer.write((rgDiff + 8) << 4 | (bgDiff + 8))
-
-            # TODO: OP_DIFF_INDEXED
             else:
-                writer.write(Q565_OP_RGB565)
-                writer.write(px_value.px_bytes[1])
-                writer.write(px_value.px_bytes[0])
-
-            hash_array[px_value.hash].setBytes(px_value.bytes)
-
-    loop()
-    writer.write(Q565_OP_END)
-    return writer.output()
-
+                rgDiff = rDiff - gDiff
+                bgDiff = bDiff - gDiff
+                if -16 <= gDiff <= 15 and -8 <= rgDiff <= 7 and -8 <= bgDiff <= 7:
+                    append(Q565_OP_LUMA | (gDiff + 16))
+                    append((rgDiff + 8) << 4 | (bgDiff + 8))
+                elif not (
+                    diff_indexed and _writeDiffIndexed(out, hash_array, r, g, b)
+                ):
+                    append(Q565_OP_RGB565)
+                    append(value & 0xFF)
+                    append(value >> 8)
+                hash_array[index_pos] = value
+
+        prevR, prevG, prevB = r, g, b
+        end = starts[n + 1] if n + 1 < segments else total
+        if end - starts[n] > 1:
+            _writeRun(out, end - starts[n] - 1)
+
+    append(Q565_OP_END)
+    return bytes(out)
+
+
+class Q565Encoder:
+    """
+    Pure Python stand-in for q565_rust.Q565Encoder, used when the rust
+    extension is not installed. Same constructor, attributes and methods.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        pixel_format="RGB",
+        parallel=False,
+        diff_indexed=False,
+    ):
+        pixelFormatLayout(pixel_format)
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.parallel = parallel
+        self.diff_indexed = diff_indexed
+        self.last_bytes_written = 0
+        self.last_encode_time = 0.0
 
-def writePixel(buffer, index, pixel):
-    end = index + 3
-    buffer[index:end] = pixel.RGB888
-    return end
-
-
-def writeMany(buffer, index, pixel, count):
-    end = index
-    while count > 0:
-        end = writePixel(buffer, end, pixel)
-        count -= 1
-    return end
-
-
-def decode(file_bytes: bytes) -> Dict:
-    reader = ByteReader(file_bytes)
-    header_magic = read_32_bits(reader)
-    if header_magic != Q565_MAGIC:
-        raise ValueError("provided image does not contain QOI header")
-
-    width = read_16_bits(reader)
-    height = read_16_bits(reader)
-    channels = 3
-
-    hash_array = [Pixel() for _ in range(64)]
-    for px in hash_array:
-        px.setBytes(bytearray((0, 0)))
-    out_size = width * height * channels
-    pixel_data = bytearray(out_size)
-    px_value = Pixel()
-    index = 0
-    op = 0
-    while True:
-        op += 1
-        b1 = reader.read()
-        if b1 is None:
-            break
-        updatePalette = True
-        debugQ565("\n")
-        if b1 == Q565_OP_END:
-            debugQ565("{} {} - Q565_OP_END".format(op, b1))
-            break
-
-        elif b1 == Q565_OP_RGB565:
-            debugQ565("{} {} - Q565_OP_RGB565".format(op, b1))
-            b2, b3 = (reader.read(), reader.read())
-            px_value.setBytes((b3, b2))
-            debugQ565("[{} {}] {}".format(b2, b3, px_value.int))
-
-        elif (b1 & Q565_MASK_2) == Q565_OP_RUN:
-            count = (b1 & 0b0011_1111) + 1
-            debugQ565("{} {} - Q565_OP_RUN {}".format(op, b1, count))
-            updatePalette = False
-            index = writeMany(pixel_data, index, px_value, count)
-            continue
-
-        elif (b1 & Q565_MASK_2) == Q565_OP_INDEX:
-            debugQ565("{} {} - Q565_OP_INDEX".format(op, b1))
-            px_value.setBytes(hash_array[b1].bytes)
-            updatePalette = False
-
-        elif (b1 & Q565_MASK_2) == Q565_OP_DIFF:
-            debugQ565("{} {} - Q565_OP_DIFF".format(op, b1))
-            px_value.smallDiff(b1)
-            updatePalette = False
+    @property
+    def capacity(self) -> int:
+        # header + worst case 3 bytes per pixel + end marker
+        return 8 + self.width * self.height * 3 + 1
+
+    def encode(self, pixels) -> bytes:
+        start = time.perf_counter()
+        output = encode(
+            pixels, self.width, self.height, self.pixel_format, self.diff_indexed
+        )
+        self.last_encode_time = time.perf_counter() - start
+        self.last_bytes_written = len(output)
+        return output
+
+    def encode_into(self, pixels, out) -> int:
+        output = self.encode(pixels)
+        if len(out) < len(output):
+            raise ValueError(
+                f"out buffer too small: {len(output)} bytes needed, {len(out)} available"
+            )
+        out[: len(output)] = output
+        return len(output)
+
+
+def rgb565ToRGB888(value: int) -> Tuple[int, int, int]:
+    r = value >> 11
+    g = (value >> 5) & 0b11_1111
+    b = value & 0b1_1111
+    return ((r * 527 + 23) >> 6, (g * 259 + 33) >> 6, (b * 527 + 23) >> 6)
+
+
+def decodeHeader(file_bytes: bytes) -> Tuple[int, int]:
+    if len(file_bytes) < 8 or int.from_bytes(file_bytes[0:4], "big") != Q565_MAGIC:
+        raise ValueError("provided image does not contain Q565 header")
+    width = int.from_bytes(file_bytes[4:6], "little")
+    height = int.from_bytes(file_bytes[6:8], "little")
+    return width, height
+
+
+def decodeSegments(file_bytes: bytes) -> Tuple[int, int, List[int], List[int]]:
+    """
+    Walk the opcode stream and return (width, height, values, counts): the
+    RGB565 colour of every emitted pixel group and how many pixels it covers.
+    """
+    width, height = decodeHeader(file_bytes)
+    data = file_bytes
+    size = len(data)
+    hash_array = [0] * 64
+    values = []
+    counts = []
+    addValue = values.append
+    addCount = counts.append
+    value = 0
+    pos = 8
+    ops = 0
+    try:
+        while pos < size:
+            b1 = data[pos]
+            pos += 1
+            ops += 1
+            tag = b1 & Q565_MASK_2
+
+            if b1 == Q565_OP_END:
+                break
+            elif b1 == Q565_OP_RGB565:
+                value = data[pos] | data[pos + 1] << 8
+                pos += 2
+                hash_array[((value >> 8) + (value & 0xFF)) & 0b0011_1111] = value
+            elif tag == Q565_OP_RUN:
+                if counts and values[-1] == value:
+                    counts[-1] += (b1 & 0b0011_1111) + 1
+                else:
+                    addValue(value)
+                    addCount((b1 & 0b0011_1111) + 1)
+                continue
+            elif tag == Q565_OP_INDEX:
+                value = hash_array[b1]
+            else:
+                r = value >> 11
+                g = (value >> 5) & 0b11_1111
+                b = value & 0b1_1111
+                if tag == Q565_OP_DIFF:
+                    r += ((b1 >> 4) & 0b11) - 2
+                    g += ((b1 >> 2) & 0b11) - 2
+                    b += (b1 & 0b11) - 2
+                elif (b1 & Q565_MASK_3) == Q565_OP_LUMA:
+                    b2 = data[pos]
+                    pos += 1
+                    gDiff = (b1 & 0b0001_1111) - 16
+                    r += ((b2 >> 4) & 0x0F) - 8 + gDiff
+                    g += gDiff
+                    b += (b2 & 0x0F) - 8 + gDiff
+                else:  # Q565_OP_DIFF_INDEXED
+                    b2 = data[pos]
+                    pos += 1
+                    base = hash_array[b2 & 0b0011_1111]
+                    r = (base >> 11) + (b1 & 0b0000_0011) - 2
+                    g = ((base >> 5) & 0b11_1111) + ((b1 & 0b0001_1100) >> 2) - 4
+                    b = (base & 0b1_1111) + (b2 >> 6) - 2
+                value = (r & 0b1_1111) << 11 | (g & 0b11_1111) << 5 | (b & 0b1_1111)
+                if tag != Q565_OP_DIFF:
+                    hash_array[((value >> 8) + (value & 0xFF)) & 0b0011_1111] = value
+
+            addValue(value)
+            addCount(1)
+    except IndexError:
+        raise ValueError("truncated Q565 stream") from None
+
+    debugQ565("decoded {} ops into {} pixel groups".format(ops, len(values)))
+    if sum(counts) > width * height:
+        raise ValueError(
+            "Q565 stream holds more pixels than its {}x{} header".format(width, height)
+        )
+    return width, height, values, counts
 
-        elif (b1 & Q565_MASK_3) == Q565_OP_LUMA:
-            debugQ565("{} {} - Q565_OP_LUMA".format(op, b1))
-            b2 = reader.read()
-            px_value.largeDiff(b1, b2)
 
-        elif (b1 & Q565_MASK_3) == Q565_OP_DIFF_INDEXED:
-            debugQ565("{} {} - Q565_OP_DIFF_INDEXED".format(op, b1))
-            b2 = reader.read()
-            px_value.setBytes(hash_array[b2 & 0b0011_1111].bytes)
-            px_value.indexedDiff(b1, b2)
+@timing
+def decode_into(file_bytes: bytes, out, channels: str = "RGB") -> Tuple[int, int]:
+    """
+    Decode into a preallocated writable buffer and return (width, height).
+    channels is "RGB" for RGB888 output or "RGB565" for native-endian words.
+    Pixels missing from a short stream are left untouched.
+    """
+    width, height, values, counts = decodeSegments(file_bytes)
+    bpp = 3 if channels == "RGB" else 2
+    if len(out) < width * height * bpp:
+        raise ValueError(
+            f"out buffer too small: {width * height * bpp} bytes needed, {len(out)} available"
+        )
+    if not values:
+        return width, height
 
+    if numpy is not None:
+        plane = numpy.repeat(
+            numpy.array(values, dtype=numpy.uint16), numpy.array(counts)
+        )
+        if bpp == 2:
+            target = numpy.frombuffer(out, dtype=numpy.uint16, count=len(plane))
+            target[:] = plane
         else:
-            raise "UNRECOGNISED COMMAND"
+            target = numpy.frombuffer(out, dtype=numpy.uint8, count=len(plane) * 3)
+            target = target.reshape(-1, 3)
+            target[:, 0] = ((plane >> 11) * 527 + 23) >> 6
+            target[:, 1] = (((plane >> 5) & 0b11_1111) * 259 + 33) >> 6
+            target[:, 2] = ((plane & 0b1_1111) * 527 + 23) >> 6
+        return width, height
+
+    cache = {}
+    pos = 0
+    for value, count in zip(values, counts):
+        px = cache.get(value)
+        if px is None:
+            if bpp == 2:
+                px = value.to_bytes(2, sys.byteorder)
+            else:
+                px = bytes(rgb565ToRGB888(value))
+            cache[value] = px
+        end = pos + count * bpp
+        out[pos:end] = px * count
+        pos = end
+    return width, height
 
-        if updatePalette:
-            debugQ565("    HASH:", px_value.hash)
-            hash_array[px_value.hash].setBytes(px_value.bytes)
 
-        index = writePixel(pixel_data, index, px_value)
+def decode(file_bytes: bytes) -> Dict:
+    width, height = decodeHeader(file_bytes)
+    pixel_data = bytearray(width * height * 3)
+    decode_into(file_bytes, pixel_data)
 
     out = {
         "width": width,
@@ -1,6 +1,21 @@
 from q565 import encode_img, decode_to_img
 from PIL import Image
+import math
+import os
 import sys
+import time
+import q565
+
+from driver import Q565Encoder
+
+try:
+    import q565_rust
+except ImportError:
+    q565_rust = None
+
+numpy = q565.numpy
+# wheels built before py_decode existed still encode
+decode_into = getattr(q565_rust, "py_decode", q565.decode_into)
 
 
 def replace_extension(path: str, extension: str) -> str:
@@ -9,10 +24,103 @@ def replace_extension(path: str, extension: str) -> str:
     return new_path
 
 
+def psnr(expected: bytes, actual: bytes) -> float:
+    if numpy is not None:
+        # int64, the squares of a whole frame overflow int32
+        diff = numpy.frombuffer(expected, numpy.uint8).astype(numpy.int64)
+        diff -= numpy.frombuffer(actual, numpy.uint8)
+        squared = float(numpy.dot(diff, diff))
+    else:
+        squared = sum((a - b) * (a - b) for a, b in zip(expected, actual))
+    if squared == 0:
+        return math.inf
+    return 10 * math.log10(255 * 255 * len(expected) / squared)
+
+
+def verify(directory: str):
+    print(
+        "encoder: {}, decoder: {}".format(
+            "q565_rust" if Q565Encoder is not q565.Q565Encoder else "python",
+            "q565_rust" if decode_into is not q565.decode_into else "python",
+        )
+    )
+
+    files = sorted(os.listdir(directory))
+    totals = {"raw": 0, "encoded": 0, "encode": 0.0, "decode": 0.0}
+    failures = 0
+    for name in files:
+        path = os.path.join(directory, name)
+        try:
+            img = Image.open(path).convert("RGB")
+        except Exception:
+            continue
+
+        width, height = img.size
+        raw = img.tobytes()
+        decoded = bytearray(len(raw))
+
+        # the stream the driver sends, DIFF_INDEXED ops included
+        encoder = Q565Encoder(width, height, "RGB", parallel=True, diff_indexed=True)
+        start = time.perf_counter()
+        encoded = encoder.encode(raw)
+        encodeTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            size = decode_into(encoded, decoded)
+        except ValueError as exc:
+            print(f"{name}: decode failed: {exc}")
+            failures += 1
+            continue
+        decodeTime = time.perf_counter() - start
+
+        quality = psnr(raw, decoded)
+        # RGB565 quantisation alone stays well above 30dB
+        ok = size == (width, height) and quality > 30
+        failures += not ok
+        print(
+            "{:30} {:4}x{:<4} {:8} bytes ({:5.1f}%) PSNR {:6.2f}dB "
+            "encode {:7.1f}MB/s decode {:7.1f}MB/s {}".format(
+                name[:30],
+                width,
+                height,
+                len(encoded),
+                len(encoded) * 100 / len(raw),
+                quality,
+                len(raw) / encodeTime / 1e6,
+                len(raw) / decodeTime / 1e6,
+                "" if ok else "FAILED",
+            )
+        )
+        totals["raw"] += len(raw)
+        totals["encoded"] += len(encoded)
+        totals["encode"] += encodeTime
+        totals["decode"] += decodeTime
+
+    if totals["raw"]:
+        print(
+            "total: {} bytes -> {} bytes ({:.1f}%), encode {:.1f}MB/s, "
+            "decode {:.1f}MB/s, {} failed".format(
+                totals["raw"],
+                totals["encoded"],
+                totals["encoded"] * 100 / totals["raw"],
+                totals["raw"] / totals["encode"] / 1e6,
+                totals["raw"] / totals["decode"] / 1e6,
+                failures,
+            )
+        )
+    return failures == 0
+
+
 def main():
     encode = "--encode" in sys.argv
     decode = "--decode" in sys.argv
     file_path = sys.argv[1]
+    if "--verify" in sys.argv:
+        if not verify(file_path):
+            sys.exit(1)
+        return
+
     if encode:
         try:
             img = Image.open(file_path)
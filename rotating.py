@@ -2,13 +2,12 @@ import time
 import driver
 from PIL import Image, ImageDraw
 from io import BytesIO
-import queue
 import colorsys
 from threading import Thread, Event
 from utils import FPS
 from mss import mss
 from utils import FPS, debug
-from workers import FrameWriter
+from workers import FrameMailbox, FrameWriter
 
 
 lcd = driver.KrakenLCD()
@@ -16,7 +15,7 @@ lcd.setupStream()
 
 
 class FrameProducer(Thread):
-    def __init__(self, frameBuffer: queue.Queue):
+    def __init__(self, frameBuffer: FrameMailbox):
         Thread.__init__(self)
         self.daemon = True
         self.frameBuffer = frameBuffer
@@ -28,9 +27,7 @@ class FrameProducer(Thread):
         print("Frame generator worker started")
         frameCount = 0
         while True:
-            if self.frameBuffer.full():
-                time.sleep(0.001)
-                continue
+            self.frameBuffer.waitEmpty()
             startTime = time.time()
             color = self.hsv2rgb(((5 * frameCount) % 360) / 360, 1, 1)
             img = Image.new("RGB", lcd.resolution)
@@ -55,7 +52,7 @@ class FrameProducer(Thread):
             frameCount += 1
 
 
-frameBuffer = queue.Queue(maxsize=1)
+frameBuffer = FrameMailbox()
 
 frameProducer = FrameProducer(frameBuffer)
 frameWriter = FrameWriter(frameBuffer, lcd)
@@ -1,27 +1,121 @@
-use pyo3::{prelude::*, types::PyBytes};
+use std::time::Instant;
+
+use pyo3::{buffer::PyBuffer, exceptions::PyValueError, prelude::*, types::PyBytes};
+use rayon::prelude::*;
+
+// frames at least this large are converted on the rayon pool when allowed
+const PARALLEL_MIN_PIXELS: usize = 512 * 512;
+const PARALLEL_CHUNK_PIXELS: usize = 32 * 1024;
+
+// header (magic + width + height) + worst case 3 bytes per pixel + end marker
+fn max_encoded_size(width: u16, height: u16) -> usize {
+  8 + width as usize * height as usize * 3 + 1
+}
+
+#[derive(Clone, Copy, PartialEq)]
+enum PixelFormat {
+  Rgb,
+  Rgba,
+  Bgra,
+}
+
+impl PixelFormat {
+  fn parse(name: &str) -> PyResult<Self> {
+    match name {
+      "RGB" => Ok(PixelFormat::Rgb),
+      "RGBA" | "RGBX" => Ok(PixelFormat::Rgba),
+      "BGRA" | "BGRX" => Ok(PixelFormat::Bgra),
+      _ => Err(PyValueError::new_err(format!(
+        "unsupported pixel format {:?}, expected RGB, RGBA or BGRA",
+        name
+      ))),
+    }
+  }
+
+  fn bytes_per_pixel(self) -> usize {
+    match self {
+      PixelFormat::Rgb => 3,
+      PixelFormat::Rgba | PixelFormat::Bgra => 4,
+    }
+  }
+}
+
+#[inline(always)]
+fn quantize(r: u8, g: u8, b: u8) -> u16 {
+  let r = (r as u32 * 249 + 1014) >> 11;
+  let g = (g as u32 * 253 + 505) >> 10;
+  let b = (b as u32 * 249 + 1014) >> 11;
+  ((r << 11) | (g << 5) | b) as u16
+}
+
+// Fixed stride and channel offsets let the compiler unroll and vectorise the loop
+fn convert_chunk<const BPP: usize, const R: usize, const G: usize, const B: usize>(
+  src: &[u8],
+  dst: &mut [u16],
+) {
+  for (px, out) in src.chunks_exact(BPP).zip(dst.iter_mut()) {
+    *out = quantize(px[R], px[G], px[B]);
+  }
+}
+
+fn convert_slice(format: PixelFormat, src: &[u8], dst: &mut [u16]) {
+  match format {
+    PixelFormat::Rgb => convert_chunk::<3, 0, 1, 2>(src, dst),
+    PixelFormat::Rgba => convert_chunk::<4, 0, 1, 2>(src, dst),
+    PixelFormat::Bgra => convert_chunk::<4, 2, 1, 0>(src, dst),
+  }
+}
+
+fn to_rgb565(format: PixelFormat, src: &[u8], rgb565: &mut Vec<u16>, parallel: bool) {
+  let bpp = format.bytes_per_pixel();
+  let pixels = src.len() / bpp;
+  // keeps the allocation once the buffer has grown to frame size
+  rgb565.resize(pixels, 0);
+
+  if parallel && pixels >= PARALLEL_MIN_PIXELS {
+    rgb565
+      .par_chunks_mut(PARALLEL_CHUNK_PIXELS)
+      .zip(src.par_chunks(PARALLEL_CHUNK_PIXELS * bpp))
+      .for_each(|(dst, src)| convert_slice(format, src, dst));
+  } else {
+    convert_slice(format, &src[..pixels * bpp], rgb565);
+  }
+}
+
+fn rgb888_to_rgb565(rgb888_raw: &[u8], rgb565: &mut Vec<u16>) {
+  to_rgb565(PixelFormat::Rgb, rgb888_raw, rgb565, false);
+}
 
 fn encode(width: u16, height: u16, rgb888_raw: &[u8]) -> Vec<u8> {
 
-  let mut v = Vec::with_capacity(1024 * 1024);
+  let mut v = Vec::with_capacity(max_encoded_size(width, height));
   let mut vec: Vec<u16> = Vec::new();
-  for x in (0..rgb888_raw.len()).step_by(3) {
-    let r = (rgb888_raw[x + 0] as u32 * 249 + 1014) >> 11;
-    let g = (rgb888_raw[x + 1] as u32 * 253 + 505) >> 10;
-    let b = (rgb888_raw[x + 2] as u32 * 249 + 1014) >> 11;
-    vec.push(((r as u16) << 11) | ((g as u16) << 5) | (b as u16))
-}
-  let rgb565_raw: &[u16] = unsafe { std::slice::from_raw_parts(vec.as_ptr() as *const u16, vec.len()) };
+  rgb888_to_rgb565(rgb888_raw, &mut vec);
 
   q565::encode::Q565EncodeContext::encode_to_vec(
     width as u16,
     height as u16,
-    rgb565_raw,
+    &vec,
     &mut v
   );
 
   return v;
 }
 
+fn contiguous_bytes(buffer: &PyBuffer<u8>, name: &str) -> PyResult<()> {
+  if !buffer.is_c_contiguous() {
+    return Err(PyValueError::new_err(format!("{} must be a contiguous buffer", name)));
+  }
+  Ok(())
+}
+
+// Whether two exported buffers share any byte
+fn overlapping(a: &PyBuffer<u8>, b: &PyBuffer<u8>) -> bool {
+  let (a_start, a_len) = (a.buf_ptr() as usize, a.len_bytes());
+  let (b_start, b_len) = (b.buf_ptr() as usize, b.len_bytes());
+  a_len > 0 && b_len > 0 && a_start < b_start + b_len && b_start < a_start + a_len
+}
+
 #[pyfunction]
 fn py_encode(py: Python, width: u16, height: u16, rgb888_raw: &[u8]) -> PyObject  {
 
@@ -31,9 +125,385 @@ fn py_encode(py: Python, width: u16, height: u16, rgb888_raw: &[u8]) -> PyObject
   return PyBytes::new(py, &v).into();
 }
 
+/// Convert packed RGB, RGBA or BGRA pixels to native-endian RGB565 words.
+#[pyfunction]
+#[pyo3(signature = (data, pixel_format = "RGB", parallel = true))]
+fn py_to_rgb565(py: Python, data: PyBuffer<u8>, pixel_format: &str, parallel: bool) -> PyResult<PyObject> {
+  contiguous_bytes(&data, "data")?;
+  let format = PixelFormat::parse(pixel_format)?;
+  let src_addr = data.buf_ptr() as usize;
+  let len = data.item_count();
+
+  // the exported buffer keeps the memory pinned until `data` is dropped
+  let rgb565 = py.allow_threads(move || {
+    let src = unsafe { std::slice::from_raw_parts(src_addr as *const u8, len) };
+    let mut rgb565 = Vec::new();
+    to_rgb565(format, src, &mut rgb565, parallel);
+    rgb565
+  });
+
+  let raw = unsafe {
+    std::slice::from_raw_parts(rgb565.as_ptr() as *const u8, rgb565.len() * 2)
+  };
+  Ok(PyBytes::new(py, raw).into())
+}
+
+const Q565_MAGIC: &[u8; 4] = b"q565";
+
+#[inline(always)]
+fn q565_hash(px: u16) -> usize {
+  (((px >> 8) + (px & 0xFF)) & 0x3F) as usize
+}
+
+#[inline(always)]
+fn apply_diff(px: u16, r_diff: i32, g_diff: i32, b_diff: i32) -> u16 {
+  let r = ((px >> 11) as i32 + r_diff) & 0x1F;
+  let g = (((px >> 5) & 0x3F) as i32 + g_diff) & 0x3F;
+  let b = ((px & 0x1F) as i32 + b_diff) & 0x1F;
+  ((r << 11) | (g << 5) | b) as u16
+}
+
+#[inline(always)]
+fn write_pixels(out: &mut [u8], start: usize, count: usize, px: u16, rgb565_out: bool) {
+  if rgb565_out {
+    let word = px.to_ne_bytes();
+    for dst in out[start * 2..(start + count) * 2].chunks_exact_mut(2) {
+      dst.copy_from_slice(&word);
+    }
+  } else {
+    let r = ((px >> 11) as u32 * 527 + 23) >> 6;
+    let g = (((px >> 5) & 0x3F) as u32 * 259 + 33) >> 6;
+    let b = ((px & 0x1F) as u32 * 527 + 23) >> 6;
+    let rgb = [r as u8, g as u8, b as u8];
+    for dst in out[start * 3..(start + count) * 3].chunks_exact_mut(3) {
+      dst.copy_from_slice(&rgb);
+    }
+  }
+}
+
+fn decode_header(data: &[u8]) -> Result<(u16, u16), String> {
+  if data.len() < 8 || &data[0..4] != Q565_MAGIC {
+    return Err("provided image does not contain Q565 header".to_string());
+  }
+  Ok((
+    u16::from_le_bytes([data[4], data[5]]),
+    u16::from_le_bytes([data[6], data[7]]),
+  ))
+}
+
+// Decodes into `out` (RGB888 or native-endian RGB565), mirrors q565.decode_into
+fn decode_to(data: &[u8], out: &mut [u8], rgb565_out: bool) -> Result<(u16, u16), String> {
+  let (width, height) = decode_header(data)?;
+  let total = width as usize * height as usize;
+  let bpp = if rgb565_out { 2 } else { 3 };
+  if out.len() < total * bpp {
+    return Err(format!(
+      "out buffer too small: {} bytes needed, {} available",
+      total * bpp,
+      out.len()
+    ));
+  }
+
+  let truncated = || "truncated Q565 stream".to_string();
+  let mut table = [0u16; 64];
+  let mut px: u16 = 0;
+  let mut pos = 8;
+  let mut written = 0;
+
+  while pos < data.len() {
+    let b1 = data[pos];
+    pos += 1;
+
+    let mut count = 1;
+    match b1 {
+      0xFF => break,
+      0xFE => {
+        let bytes = data.get(pos..pos + 2).ok_or_else(truncated)?;
+        px = u16::from_le_bytes([bytes[0], bytes[1]]);
+        pos += 2;
+        table[q565_hash(px)] = px;
+      }
+      b if b & 0xC0 == 0xC0 => count = (b & 0x3F) as usize + 1,
+      b if b & 0xC0 == 0x00 => px = table[b as usize],
+      b if b & 0xC0 == 0x40 => {
+        px = apply_diff(
+          px,
+          ((b >> 4) & 0x03) as i32 - 2,
+          ((b >> 2) & 0x03) as i32 - 2,
+          (b & 0x03) as i32 - 2,
+        );
+      }
+      b if b & 0xE0 == 0x80 => {
+        let b2 = *data.get(pos).ok_or_else(truncated)?;
+        pos += 1;
+        let g_diff = (b & 0x1F) as i32 - 16;
+        px = apply_diff(
+          px,
+          ((b2 >> 4) & 0x0F) as i32 - 8 + g_diff,
+          g_diff,
+          (b2 & 0x0F) as i32 - 8 + g_diff,
+        );
+        table[q565_hash(px)] = px;
+      }
+      b => {
+        // DIFF_INDEXED
+        let b2 = *data.get(pos).ok_or_else(truncated)?;
+        pos += 1;
+        px = apply_diff(
+          table[(b2 & 0x3F) as usize],
+          (b & 0x03) as i32 - 2,
+          ((b & 0x1C) >> 2) as i32 - 4,
+          (b2 >> 6) as i32 - 2,
+        );
+        table[q565_hash(px)] = px;
+      }
+    }
+
+    if written + count > total {
+      return Err(format!(
+        "Q565 stream holds more pixels than its {}x{} header",
+        width, height
+      ));
+    }
+    write_pixels(out, written, count, px, rgb565_out);
+    written += count;
+  }
+
+  Ok((width, height))
+}
+
+#[inline(always)]
+fn wrapped_diff(value: u16, prev: u16, bits: u32) -> i32 {
+  let half = 1i32 << (bits - 1);
+  ((value as i32 - prev as i32 + half) & ((1 << bits) - 1)) - half
+}
+
+// First table entry within r -2..1, g -4..3, b -2..1 of `px`, as a DIFF_INDEXED op
+fn find_diff_indexed(table: &[u16; 64], px: u16) -> Option<[u8; 2]> {
+  let (r, g, b) = (px >> 11, (px >> 5) & 0x3F, px & 0x1F);
+  table.iter().enumerate().find_map(|(index, &base)| {
+    let r_diff = wrapped_diff(r, base >> 11, 5);
+    let g_diff = wrapped_diff(g, (base >> 5) & 0x3F, 6);
+    let b_diff = wrapped_diff(b, base & 0x1F, 5);
+    if (-2..=1).contains(&r_diff) && (-4..=3).contains(&g_diff) && (-2..=1).contains(&b_diff) {
+      Some([
+        0xA0 | ((g_diff + 4) as u8) << 2 | (r_diff + 2) as u8,
+        ((b_diff + 2) as u8) << 6 | index as u8,
+      ])
+    } else {
+      None
+    }
+  })
+}
+
+// Opcode emitter mirroring q565.encode, including the optional DIFF_INDEXED
+// op that the q565 crate never produces
+fn encode_native(width: u16, height: u16, pixels: &[u16], diff_indexed: bool, out: &mut Vec<u8>) {
+  out.extend_from_slice(Q565_MAGIC);
+  out.extend_from_slice(&width.to_le_bytes());
+  out.extend_from_slice(&height.to_le_bytes());
+
+  let mut table = [0u16; 64];
+  let mut prev: u16 = 0;
+  let mut run: u8 = 0;
+  for &px in pixels {
+    if px == prev {
+      run += 1;
+      if run == 62 {
+        out.push(0xC0 | (run - 1));
+        run = 0;
+      }
+      continue;
+    }
+    if run > 0 {
+      out.push(0xC0 | (run - 1));
+      run = 0;
+    }
+
+    let index = q565_hash(px);
+    if table[index] == px {
+      out.push(index as u8);
+    } else {
+      let r_diff = wrapped_diff(px >> 11, prev >> 11, 5);
+      let g_diff = wrapped_diff((px >> 5) & 0x3F, (prev >> 5) & 0x3F, 6);
+      let b_diff = wrapped_diff(px & 0x1F, prev & 0x1F, 5);
+      let (rg_diff, bg_diff) = (r_diff - g_diff, b_diff - g_diff);
+
+      if (-2..=1).contains(&r_diff) && (-2..=1).contains(&g_diff) && (-2..=1).contains(&b_diff) {
+        out.push(0x40 | ((r_diff + 2) << 4 | (g_diff + 2) << 2 | (b_diff + 2)) as u8);
+      } else {
+        if (-16..=15).contains(&g_diff) && (-8..=7).contains(&rg_diff) && (-8..=7).contains(&bg_diff) {
+          out.push(0x80 | (g_diff + 16) as u8);
+          out.push(((rg_diff + 8) << 4 | (bg_diff + 8)) as u8);
+        } else if let Some(op) = diff_indexed.then(|| find_diff_indexed(&table, px)).flatten() {
+          out.extend_from_slice(&op);
+        } else {
+          out.push(0xFE);
+          out.extend_from_slice(&px.to_le_bytes());
+        }
+        table[index] = px;
+      }
+    }
+    prev = px;
+  }
+  if run > 0 {
+    out.push(0xC0 | (run - 1));
+  }
+  out.push(0xFF);
+}
+
+/// Decode a Q565 stream into a writable buffer, returns (width, height).
+/// The buffer receives RGB888 pixels, or native-endian RGB565 words when
+/// `rgb565` is set.
+#[pyfunction]
+#[pyo3(signature = (data, out, rgb565 = false))]
+fn py_decode(py: Python, data: PyBuffer<u8>, out: PyBuffer<u8>, rgb565: bool) -> PyResult<(u16, u16)> {
+  contiguous_bytes(&data, "data")?;
+  contiguous_bytes(&out, "out")?;
+  if out.readonly() {
+    return Err(PyValueError::new_err("out must be a writable buffer"));
+  }
+  // `src` and `dst` below must not alias, a shared and a mutable slice over
+  // the same bytes is undefined behaviour
+  if overlapping(&data, &out) {
+    return Err(PyValueError::new_err("data and out must not overlap"));
+  }
+  let (src_addr, src_len) = (data.buf_ptr() as usize, data.item_count());
+  let (dst_addr, dst_len) = (out.buf_ptr() as usize, out.item_count());
+
+  py.allow_threads(move || {
+    let src = unsafe { std::slice::from_raw_parts(src_addr as *const u8, src_len) };
+    let dst = unsafe { std::slice::from_raw_parts_mut(dst_addr as *mut u8, dst_len) };
+    decode_to(src, dst, rgb565)
+  })
+  .map_err(PyValueError::new_err)
+}
+
+/// Q565 encoder bound to one resolution and input pixel format.
+///
+/// The RGB565 conversion plane and the encoded output are kept between calls,
+/// so streaming a frame only costs the copy into the caller's buffer.
+#[pyclass]
+struct Q565Encoder {
+  #[pyo3(get)]
+  width: u16,
+  #[pyo3(get)]
+  height: u16,
+  format: PixelFormat,
+  /// Split the RGB565 conversion across the rayon pool for large frames.
+  #[pyo3(get, set)]
+  parallel: bool,
+  /// Emit DIFF_INDEXED ops, which the q565 crate encoder never does.
+  #[pyo3(get, set)]
+  diff_indexed: bool,
+  rgb565: Vec<u16>,
+  output: Vec<u8>,
+  /// Size in bytes of the last encoded frame.
+  #[pyo3(get)]
+  last_bytes_written: usize,
+  /// Wall time in seconds spent converting and encoding the last frame.
+  #[pyo3(get)]
+  last_encode_time: f64,
+}
+
+impl Q565Encoder {
+  fn encode_frame(&mut self, py: Python, pixels: &PyBuffer<u8>) -> PyResult<()> {
+    contiguous_bytes(pixels, "pixels")?;
+    let expected = self.width as usize * self.height as usize * self.format.bytes_per_pixel();
+    if pixels.item_count() != expected {
+      return Err(PyValueError::new_err(format!(
+        "expected {} bytes of pixel data for {}x{}, got {}",
+        expected, self.width, self.height, pixels.item_count()
+      )));
+    }
+
+    // raw pointers are not Send; the exported buffer keeps the memory pinned
+    // until `pixels` is dropped, which outlives the closure below
+    let src_addr = pixels.buf_ptr() as usize;
+    let (width, height) = (self.width, self.height);
+    let (format, parallel, diff_indexed) = (self.format, self.parallel, self.diff_indexed);
+    let rgb565 = &mut self.rgb565;
+    let output = &mut self.output;
+
+    let elapsed = py.allow_threads(move || {
+      let start = Instant::now();
+      let src = unsafe { std::slice::from_raw_parts(src_addr as *const u8, expected) };
+      to_rgb565(format, src, rgb565, parallel);
+      output.clear();
+      if diff_indexed {
+        encode_native(width, height, rgb565, true, output);
+      } else {
+        q565::encode::Q565EncodeContext::encode_to_vec(width, height, &rgb565[..], output);
+      }
+      start.elapsed().as_secs_f64()
+    });
+
+    self.last_bytes_written = self.output.len();
+    self.last_encode_time = elapsed;
+    Ok(())
+  }
+}
+
+#[pymethods]
+impl Q565Encoder {
+  #[new]
+  #[pyo3(signature = (width, height, pixel_format = "RGB", parallel = false, diff_indexed = false))]
+  fn new(width: u16, height: u16, pixel_format: &str, parallel: bool, diff_indexed: bool) -> PyResult<Self> {
+    let pixels = width as usize * height as usize;
+    Ok(Q565Encoder {
+      width,
+      height,
+      format: PixelFormat::parse(pixel_format)?,
+      parallel,
+      diff_indexed,
+      rgb565: Vec::with_capacity(pixels),
+      output: Vec::with_capacity(max_encoded_size(width, height)),
+      last_bytes_written: 0,
+      last_encode_time: 0.0,
+    })
+  }
+
+  /// Upper bound of an encoded frame, use it to size `encode_into` buffers.
+  #[getter]
+  fn capacity(&self) -> usize {
+    max_encoded_size(self.width, self.height)
+  }
+
+  /// Encode into a new bytes object.
+  fn encode(&mut self, py: Python, pixels: PyBuffer<u8>) -> PyResult<PyObject> {
+    self.encode_frame(py, &pixels)?;
+    Ok(PyBytes::new(py, &self.output).into())
+  }
+
+  /// Encode into a writable buffer (bytearray, memoryview, ...) and return
+  /// the number of bytes written.
+  fn encode_into(&mut self, py: Python, pixels: PyBuffer<u8>, out: PyBuffer<u8>) -> PyResult<usize> {
+    contiguous_bytes(&out, "out")?;
+    if out.readonly() {
+      return Err(PyValueError::new_err("out must be a writable buffer"));
+    }
+    self.encode_frame(py, &pixels)?;
+
+    let written = self.output.len();
+    if out.item_count() < written {
+      return Err(PyValueError::new_err(format!(
+        "out buffer too small: {} bytes needed, {} available",
+        written, out.item_count()
+      )));
+    }
+    unsafe {
+      std::ptr::copy_nonoverlapping(self.output.as_ptr(), out.buf_ptr() as *mut u8, written);
+    }
+    Ok(written)
+  }
+}
+
 /// A Python module implemented in Rust.
 #[pymodule]
 fn q565_rust(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(py_encode, m)?)?;
+    m.add_function(wrap_pyfunction!(py_to_rgb565, m)?)?;
+    m.add_function(wrap_pyfunction!(py_decode, m)?)?;
+    m.add_class::<Q565Encoder>()?;
     Ok(())
-}
\ No newline at end of file
+}
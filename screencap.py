@@ -1,13 +1,11 @@
 import time
 import driver
 import time
-from PIL import Image
 from mss import mss
-import queue
 from threading import Thread
 from utils import debug
 import driver
-from workers import FrameWriter
+from workers import FrameMailbox, FrameWriter
 
 
 lcd = driver.KrakenLCD()
@@ -15,7 +13,7 @@ lcd.setupStream()
 
 
 class RawProducer(Thread):
-    def __init__(self, rawBuffer: queue.Queue):
+    def __init__(self, rawBuffer: FrameMailbox):
         Thread.__init__(self)
         self.daemon = True
         self.rawBuffer = rawBuffer
@@ -24,9 +22,7 @@ class RawProducer(Thread):
         debug("Screencap worker started")
         sct = mss()
         while True:
-            if self.rawBuffer.full():
-                time.sleep(0.005)
-                continue
+            self.rawBuffer.waitEmpty()
             startTime = time.time()
             screenshot = sct.grab(
                 {
@@ -41,7 +37,7 @@ class RawProducer(Thread):
 
 
 class FrameProducer(Thread):
-    def __init__(self, rawBuffer: queue.Queue, frameBuffer: queue.Queue):
+    def __init__(self, rawBuffer: FrameMailbox, frameBuffer: FrameMailbox):
         Thread.__init__(self)
         self.daemon = True
         self.rawBuffer = rawBuffer
@@ -50,25 +46,17 @@ class FrameProducer(Thread):
     def run(self):
         print("Image converter worker started")
         while True:
-            if self.frameBuffer.full():
-                time.sleep(0.001)
-                continue
-
+            self.frameBuffer.waitEmpty()
             (screenshot, rawTime) = self.rawBuffer.get()
             startTime = time.time()
-            img = Image.frombytes(
-                "RGB",
-                (screenshot.width, screenshot.height),
-                screenshot.rgb,
-            )
+            # mss captures BGRA, which the encoder consumes without PIL
+            frame = lcd.rawToFrame(screenshot.raw, "BGRA", adaptive=True)
 
-            self.frameBuffer.put(
-                (lcd.imageToFrame(img, adaptive=True), rawTime, time.time() - startTime)
-            )
+            self.frameBuffer.put((frame, rawTime, time.time() - startTime))
 
 
-rawBuffer = queue.Queue(maxsize=1)
-frameBuffer = queue.Queue(maxsize=1)
+rawBuffer = FrameMailbox()
+frameBuffer = FrameMailbox()
 
 rawProducer = RawProducer(rawBuffer)
 frameProducer = FrameProducer(rawBuffer, frameBuffer)
@@ -2,22 +2,27 @@ import time
 import driver
 import time
 import pystray
-from PIL import Image, ImageFont, ImageDraw, ImageSequence
+from PIL import Image, ImageDraw
 from io import BytesIO
 from mss import mss
-import queue
 from threading import Thread, Event, Lock
-from utils import debug, timing
+from utils import argValue, debug, timing
 import json
 import psutil
 import sys
 import os
-from workers import FrameWriter
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import base64
-from socketserver import ThreadingMixIn
+from workers import FrameMailbox, FrameWriter
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
 import shutil
+from gifcache import GifCache
+from gifprep import GLOBAL_PALETTE, GifPreparer, PeakMemory, loadFrames
 from hwmonitor import hw_monitor
+from metrics import recorder
+from bridgeserver import BridgeServer, HttpError, Response
+from overlay import OVERLAY_DEFAULTS, OverlayRenderer
+from pipeline import ParallelDecoder, RawFrame, ResamplePolicy, checkRawFrame
 
 PORT = 30003
 BASE_PATH = "."
@@ -27,8 +32,29 @@ if getattr(sys, "frozen", False) and hasattr(sys, "_MEIPASS"):
 FONT_FILE = os.path.join(BASE_PATH, "fonts/Rubik-Bold.ttf")
 APP_ICON = os.path.join(BASE_PATH, "images/plugin.png")
 
-MIN_SPEED = 2
-BASE_SPEED = 18
+# --workers=N decodes and scales incoming frames on N threads, only worth it
+# when a single core cannot keep up with SignalRGB at the LCD resolution
+DECODE_WORKERS = int(argValue("workers", 0))
+# --resample=auto|nearest|bilinear|bicubic|lanczos picks the canvas upscaling
+# filter, --native-compose composes the overlay at canvas resolution and only
+# scales the final image
+RESAMPLE = argValue("resample", "auto")
+NATIVE_COMPOSE = "--native-compose" in sys.argv
+# --record=DIR saves the first RECORD_FRAMES /frame bodies for
+# `python benchmark.py e2e --replay=DIR`
+RECORD_DIR = argValue("record")
+RECORD_FRAMES = 300
+# --gif-cache=DIR keeps prepared GIFs so restarting one with the same file and
+# settings skips the conversion, --gif-cache-size=MB bounds it (0 disables it)
+GIF_CACHE_DIR = argValue(
+    "gif-cache",
+    os.path.join(
+        os.environ.get("LOCALAPPDATA") or os.path.expanduser("~/.cache"),
+        "KrakenLCDBridge",
+        "gif-cache",
+    ),
+)
+GIF_CACHE_SIZE = int(float(argValue("gif-cache-size", 200)) * 1024 * 1024)
 
 import ctypes.wintypes
 
@@ -41,15 +67,22 @@ stats = {
     "gpu_temp": None,
 }
 
-SENSOR_MAP = {
-    "Liquid": ("liquid", "Liquid"),
-    "CPU Temp": ("cpu_temp", "CPU"),
-    "GPU Temp": ("gpu_temp", "GPU"),
-}
-
 MIN_COLORS = 64
 colors = MIN_COLORS * 2
 
+# Overlay settings rarely change, so /frame/raw clients send them once through
+# /overlay/config and only stream pixels afterwards
+overlayConfig = dict(OVERLAY_DEFAULTS)
+
+# /stream WebSocket messages are a sequence of records, each a u8 type and a
+# little-endian u32 payload length. CONFIG carries a JSON delta of overlay
+# settings, FRAME carries u16 width, u16 height and i16 rotation followed by
+# the same body /frame/raw accepts.
+STREAM_RECORD = struct.Struct("<BI")
+STREAM_FRAME_HEADER = struct.Struct("<HHh")
+STREAM_CONFIG = 1
+STREAM_FRAME = 2
+
 
 lcd = driver.KrakenLCD()
 lcd.setupStream()
@@ -77,8 +110,12 @@ try:
 except Exception:
     print("Could not automatically install SignalRGB plugin")
 
-
-ThreadingMixIn.daemon_threads = True
+gifCache = None
+if GIF_CACHE_SIZE > 0:
+    try:
+        gifCache = GifCache(GIF_CACHE_DIR, GIF_CACHE_SIZE)
+    except OSError as e:
+        print(f"Could not use GIF cache {GIF_CACHE_DIR}: {e}")
 
 
 # ---------------------------------------------------------------------------
@@ -116,6 +153,7 @@ class GifPlayer(Thread):
         self.offset_x = max(-50, min(50, offset_x))
         self.offset_y = max(-50, min(50, offset_y))
         self._stop_event = Event()
+        self._preparer = None
         self._load_error = None
         self.effective_fps = 0.0
 
@@ -129,99 +167,73 @@ class GifPlayer(Thread):
             pass
         return None
 
-    def _fit_frame(self, frame: Image.Image, target_w: int, target_h: int) -> Image.Image:
-        """Resize a frame according to fit_mode, zoom, and offset settings."""
-        src_w, src_h = frame.size
-
-        if self.fit_mode == "Stretch":
-            frame = frame.resize((target_w, target_h), Image.Resampling.LANCZOS)
-        elif self.fit_mode == "Fit":
-            scale = min(target_w / src_w, target_h / src_h)
-            scale *= self.zoom / 100.0
-            new_w = max(1, round(src_w * scale))
-            new_h = max(1, round(src_h * scale))
-            frame = frame.resize((new_w, new_h), Image.Resampling.LANCZOS)
-            bg = Image.new("RGB", (target_w, target_h), (0, 0, 0))
-            paste_x = (target_w - new_w) // 2 + round(self.offset_x / 50 * target_w / 2)
-            paste_y = (target_h - new_h) // 2 + round(self.offset_y / 50 * target_h / 2)
-            bg.paste(frame, (paste_x, paste_y))
-            frame = bg
-        else:  # Fill (default)
-            scale = max(target_w / src_w, target_h / src_h)
-            scale *= self.zoom / 100.0
-            new_w = max(1, round(src_w * scale))
-            new_h = max(1, round(src_h * scale))
-            frame = frame.resize((new_w, new_h), Image.Resampling.LANCZOS)
-            crop_x = (new_w - target_w) // 2 - round(self.offset_x / 50 * target_w / 2)
-            crop_y = (new_h - target_h) // 2 - round(self.offset_y / 50 * target_h / 2)
-            crop_x = max(0, min(crop_x, new_w - target_w))
-            crop_y = max(0, min(crop_y, new_h - target_h))
-            frame = frame.crop((crop_x, crop_y, crop_x + target_w, crop_y + target_h))
-
-        return frame
-
-    def _prepare_gif(self) -> bytes:
-        """Convert and optimise the GIF to fit the device bucket (<=20 MB)."""
-        img = Image.open(self.gif_path)
-        resolution = self.lcd.resolution
-        max_size = self.lcd.maxBucketSize
-
-        MIN_COLORS = 16
-        color_boundary = [MIN_COLORS, 256]
-        gif_data = None
-        previous_run = (0, 0)
-
-        for iteration in range(20):
-            colors = color_boundary[0] + (color_boundary[1] - color_boundary[0]) // 2
-            byteio = BytesIO()
-
-            frames = ImageSequence.Iterator(img)
-            new_frames = []
-            for frame in frames:
-                frame = frame.convert("RGB").rotate(self.rotation)
-                frame = self._fit_frame(frame, resolution.width, resolution.height)
-                pal = frame.quantize(colors)
-                new_frame = frame.quantize(
-                    colors, palette=pal, dither=Image.FLOYDSTEINBERG
-                )
-                new_frames.append(new_frame)
-
-            if not new_frames:
-                raise Exception("GIF contained no frames")
-
-            om = new_frames[0]
-            om.info = img.info
-            save_kwargs = dict(
-                interlace=False,
-                optimize=True,
-                save_all=True,
-                append_images=new_frames[1:],
-            )
-            frame_dur = self._get_frame_duration_ms()
-            if frame_dur is not None:
-                save_kwargs["duration"] = frame_dur
-            om.save(byteio, "GIF", **save_kwargs)
-            gif_data = byteio.getvalue()
-            gif_size = len(gif_data)
-            print(f"[GifPlayer] Optimisation pass {iteration+1}: {colors} colors, {gif_size/1024:.1f} KB")
-
-            if gif_size > max_size:
-                color_boundary[1] = colors
-            else:
-                color_boundary[0] = colors
-                if (previous_run[0] <= colors and previous_run[1] == gif_size) or \
-                   (color_boundary[1] - color_boundary[0] < 10):
-                    break
-            previous_run = (colors, gif_size)
-
-        frame_dur = self._get_frame_duration_ms()
+    def _set_effective_fps(self, frame_dur, native_dur):
         if frame_dur is not None:
             self.effective_fps = 1000.0 / frame_dur
         else:
-            native_dur = img.info.get('duration', 100)
             self.effective_fps = 1000.0 / max(native_dur, 1)
+
+    def _cache_key(self) -> str:
+        return gifCache.key(
+            self.gif_path,
+            self.rotation,
+            self._get_frame_duration_ms(),
+            self.fit_mode,
+            self.zoom,
+            self.offset_x,
+            self.offset_y,
+            tuple(self.lcd.resolution),
+            self.lcd.maxBucketSize,
+            GLOBAL_PALETTE,
+        )
+
+    def _cached_gif(self, key: str):
+        """Blob prepared earlier with the same file and settings, or None."""
+        gif_data = gifCache.get(key)
+        if gif_data is not None:
+            # the blob carries the frame duration it was prepared with
+            native_dur = Image.open(BytesIO(gif_data)).info.get('duration', 100)
+            self._set_effective_fps(self._get_frame_duration_ms(), native_dur)
+            print(f"[GifPlayer] Using cached GIF: {len(gif_data)/1024:.1f} KB ({self.effective_fps:.1f}fps)")
+        return gif_data
+
+    def _prepare_gif(self) -> bytes:
+        """Convert and optimise the GIF to fit the device bucket (<=20 MB)."""
+        frame_dur = self._get_frame_duration_ms()
+
+        def log(iteration, colors, predicted, actual):
+            size = f"predicted {predicted/1024:.1f} KB"
+            if actual is not None:
+                size += f", actual {actual/1024:.1f} KB"
+            print(f"[GifPlayer] Optimisation pass {iteration+1}: {colors} colors, {size}")
+
+        with PeakMemory() as memory:
+            # frames are decoded and fitted once, only quantizing repeats per
+            # pass, unless the animation is too long to keep them decoded
+            frames, info = loadFrames(
+                self.gif_path,
+                self.lcd.resolution,
+                self.rotation,
+                fitMode=self.fit_mode,
+                zoom=self.zoom,
+                offsetX=self.offset_x,
+                offsetY=self.offset_y,
+            )
+            preparer = self._preparer = GifPreparer(frames, info, globalPalette=GLOBAL_PALETTE)
+            try:
+                if self._stop_event.is_set():
+                    # stop() ran before there was a preparer to cancel
+                    preparer.cancel()
+                gif_data = preparer.fit(self.lcd.maxBucketSize, frame_dur, log)
+            finally:
+                self._preparer = None
+                preparer.close()
+
+        self._set_effective_fps(frame_dur, info.get('duration', 100))
         timing = f"{frame_dur}ms/frame ({self.effective_fps:.1f}fps)" if frame_dur else f"native timing ({self.effective_fps:.1f}fps)"
-        print(f"[GifPlayer] Final GIF: {len(gif_data)/1024:.1f} KB ({len(new_frames)} frames, {timing})")
+        palette = "shared palette" if preparer.shared else "frame palettes"
+        peak = f", peak memory {memory.peak/1024/1024:.0f} MB" if memory.peak is not None else ""
+        print(f"[GifPlayer] Final GIF: {len(gif_data)/1024:.1f} KB ({len(frames)} frames, {palette}, {timing}{peak})")
         return gif_data
 
     def _upload_to_device(self, gif_data: bytes):
@@ -275,13 +287,31 @@ class GifPlayer(Thread):
     def run(self):
         global _gif_fps
         try:
-            gif_data = self._prepare_gif()
+            key = gif_data = None
+            if gifCache is not None:
+                key = self._cache_key()
+                gif_data = self._cached_gif(key)
+            if gif_data is None:
+                gif_data = self._prepare_gif()
+                if key is not None:
+                    try:
+                        gifCache.put(key, gif_data)
+                    except OSError as e:
+                        print(f"[GifPlayer] Could not cache GIF: {e}")
         except Exception as e:
+            if self._stop_event.is_set():
+                print("[GifPlayer] Stopped during preparation")
+                return
             self._load_error = str(e)
             print(f"[GifPlayer] Failed to prepare GIF: {e}")
             self._recover()
             return
 
+        # whoever stopped the player owns the device now
+        if self._stop_event.is_set():
+            print("[GifPlayer] Stopped before upload, skipping it")
+            return
+
         try:
             self._upload_to_device(gif_data)
         except Exception as e:
@@ -297,6 +327,10 @@ class GifPlayer(Thread):
 
     def stop(self):
         self._stop_event.set()
+        preparer = self._preparer
+        if preparer is not None:
+            # the quantizer pool would otherwise run the remaining passes
+            preparer.cancel()
 
 
 # ---------------------------------------------------------------------------
@@ -376,290 +410,268 @@ def _stop_gif():
 # ---------------------------------------------------------------------------
 
 class RawProducer(Thread):
-    def __init__(self, rawBuffer: queue.Queue):
+    IMAGES = [
+        "/images/2023elite.png",
+        "/images/2023.png",
+        "/images/z3.png",
+        "/images/plugin.png",
+    ]
+
+    def __init__(self, rawBuffer: FrameMailbox):
         Thread.__init__(self, name="RawProducer")
         self.daemon = True
         self.rawBuffer = rawBuffer
+        self.lastFrame = time.time()
+        self.images = {}
+        self.recordedFrames = 0
+        self.recordWriter = None
+        if RECORD_DIR:
+            os.makedirs(RECORD_DIR, exist_ok=True)
+            # frames are written off the event loop, in the order they came
+            self.recordWriter = ThreadPoolExecutor(1, thread_name_prefix="FrameRecorder")
+
+        server = self.server = BridgeServer(PORT)
+        server.route("HEAD", None, lambda request: None)
+        server.route("GET", None, self.getInfo)
+        server.route("GET", "/metrics", self.getMetrics)
+        for image in self.IMAGES:
+            server.route("GET", image, self.getImage)
+        # these touch the device or wait on GifPlayer, keep them off the loop
+        server.route("POST", "/brightness", self.setBrightness, blocking=True)
+        server.route("POST", "/gif", self.startGif, blocking=True)
+        server.route("POST", "/gif/stop", self.stopGif, blocking=True)
+        server.route("POST", "/gif/config", self.setGifConfig)
+        server.route("POST", "/frame", self.postFrame)
+        server.route("POST", "/frame/raw", self.postRawFrame)
+        server.route("POST", "/overlay/config", self.setOverlayConfig)
+        server.websocket("/stream", self.onStreamMessage)
 
     def run(self):
         debug("Server worker started")
-        rawBuffer = self.rawBuffer
-        lastFrame = time.time()
-
-        class Handler(BaseHTTPRequestHandler):
-            def log_message(self, format, *args):
-                pass
-
-            def _set_headers(self, contentType="application/json"):
-                self.send_response(200)
-                self.send_header("Content-type", contentType)
-                self.end_headers()
-
-            def do_HEAD(self):
-                self._set_headers()
-
-            def do_GET(self):
-                if (
-                    self.path == "/images/2023elite.png"
-                    or self.path == "/images/2023.png"
-                    or self.path == "/images/z3.png"
-                    or self.path == "/images/plugin.png"
-                ):
-                    file = open(BASE_PATH + self.path, "rb")
-                    data = file.read()
-                    file.close()
-                    self._set_headers("image/png")
-                    self.wfile.write(data)
-                else:
-                    self._set_headers()
-                    info = lcd.getInfo()
-                    info["gifMode"] = _current_mode == "gif"
-                    info["gifPath"] = _gif_path_active or ""
-                    info["gifRunning"] = _gif_player is not None and _gif_player.is_alive()
-                    self.wfile.write(bytes(json.dumps(info), "utf-8"))
-
-            def do_POST(self):
-                global _current_mode
-                nonlocal lastFrame
-                postData = self.rfile.read(
-                    int(self.headers["Content-Length"] or "0")
-                )
+        self.server.serveForever()
+
+    def getImage(self, request):
+        if request.path not in self.images:
+            with open(BASE_PATH + request.path, "rb") as file:
+                self.images[request.path] = file.read()
+        return Response(self.images[request.path], "image/png")
+
+    def getInfo(self, request):
+        info = lcd.getInfo()
+        info["gifMode"] = _current_mode == "gif"
+        info["gifPath"] = _gif_path_active or ""
+        info["gifRunning"] = _gif_player is not None and _gif_player.is_alive()
+        info["skippedFrames"] = frameWriterWithStats.skippedFrames
+        info["keepAliveFrames"] = frameWriterWithStats.keepAlives
+        info["overlayCache"] = overlayProducer.overlayLayers.stats()
+        info["textCache"] = overlayProducer.text.stats()
+        info["droppedFrames"] = dataBuffer.dropped + frameBuffer.dropped
+        info["gifCache"] = gifCache.stats() if gifCache is not None else None
+        info["rawFrames"] = True
+        info["stream"] = "/stream"
+        return bytes(json.dumps(info), "utf-8")
+
+    def getMetrics(self, request):
+        text = recorder.prometheus(
+            counters={
+                "skipped_frames_total": frameWriterWithStats.skippedFrames,
+                "keepalive_frames_total": frameWriterWithStats.keepAlives,
+                "dropped_frames_total": dataBuffer.dropped + frameBuffer.dropped,
+                "bridge_requests_total": self.server.requests,
+                "gif_cache_hits_total": gifCache.hits if gifCache is not None else 0,
+                "gif_cache_misses_total": gifCache.misses if gifCache is not None else 0,
+            },
+            gauges={
+                "fps": frameWriterWithStats.fps.value,
+                "bridge_connections": self.server.connections,
+            },
+        )
+        return Response(text.encode("utf-8"), "text/plain; version=0.0.4")
 
-                if self.path == "/brightness":
-                    data = json.loads(postData.decode("utf-8"))
-                    with lcd_lock:
-                        lcd.setBrightness(data["brightness"])
-
-                elif self.path == "/gif":
-                    data = json.loads(postData.decode("utf-8"))
-                    gif_path = data.get("path", "").strip()
-                    rotation = int(data.get("rotation", 0))
-                    fps_str = data.get("fps", "")
-                    fit_mode = data.get("fitMode", "Fill")
-                    zoom = int(data.get("zoom", 100))
-                    offset_x = int(data.get("offsetX", 0))
-                    offset_y = int(data.get("offsetY", 0))
-                    if gif_path and os.path.isfile(gif_path):
-                        _start_gif(gif_path, rotation, fps_str,
-                                   fit_mode, zoom, offset_x, offset_y)
-                    else:
-                        print(f"[GifPlayer] Invalid path: {gif_path!r}")
-
-                elif self.path == "/gif/config":
-                    data = json.loads(postData.decode("utf-8"))
-                    gif_path = data.get("path", "").strip()
-                    if gif_path:
-                        global _last_gif_path, _last_gif_rotation, _last_gif_fps_str
-                        global _last_gif_fit_mode, _last_gif_zoom
-                        global _last_gif_offset_x, _last_gif_offset_y
-                        _last_gif_path = gif_path
-                        _last_gif_rotation = int(data.get("rotation", 0))
-                        _last_gif_fps_str = data.get("fps", "")
-                        _last_gif_fit_mode = data.get("fitMode", "Fill")
-                        _last_gif_zoom = int(data.get("zoom", 100))
-                        _last_gif_offset_x = int(data.get("offsetX", 0))
-                        _last_gif_offset_y = int(data.get("offsetY", 0))
-
-                elif self.path == "/gif/stop":
-                    _stop_gif()
-                    print("[GifPlayer] Stopped, returning to SignalRGB canvas")
-
-                elif self.path == "/frame":
-                    if _current_mode != "gif":
-                        rawTime = time.time() - lastFrame
-                        rawBuffer.put((postData, rawTime))
-                        lastFrame = time.time()
-
-                self._set_headers()
-
-        class ThreadingSimpleServer(ThreadingMixIn, HTTPServer):
-            pass
+    def setBrightness(self, request):
+        data = json.loads(request.body.decode("utf-8"))
+        with lcd_lock:
+            lcd.setBrightness(data["brightness"])
+
+    def startGif(self, request):
+        data = json.loads(request.body.decode("utf-8"))
+        gif_path = data.get("path", "").strip()
+        rotation = int(data.get("rotation", 0))
+        fps_str = data.get("fps", "")
+        fit_mode = data.get("fitMode", "Fill")
+        zoom = int(data.get("zoom", 100))
+        offset_x = int(data.get("offsetX", 0))
+        offset_y = int(data.get("offsetY", 0))
+        if gif_path and os.path.isfile(gif_path):
+            _start_gif(gif_path, rotation, fps_str,
+                       fit_mode, zoom, offset_x, offset_y)
+        else:
+            print(f"[GifPlayer] Invalid path: {gif_path!r}")
+
+    def setGifConfig(self, request):
+        global _last_gif_path, _last_gif_rotation, _last_gif_fps_str
+        global _last_gif_fit_mode, _last_gif_zoom
+        global _last_gif_offset_x, _last_gif_offset_y
+        data = json.loads(request.body.decode("utf-8"))
+        gif_path = data.get("path", "").strip()
+        if gif_path:
+            _last_gif_path = gif_path
+            _last_gif_rotation = int(data.get("rotation", 0))
+            _last_gif_fps_str = data.get("fps", "")
+            _last_gif_fit_mode = data.get("fitMode", "Fill")
+            _last_gif_zoom = int(data.get("zoom", 100))
+            _last_gif_offset_x = int(data.get("offsetX", 0))
+            _last_gif_offset_y = int(data.get("offsetY", 0))
+
+    def stopGif(self, request):
+        _stop_gif()
+        print("[GifPlayer] Stopped, returning to SignalRGB canvas")
+
+    def putFrame(self, frame):
+        # never blocks: a frame the overlay thread has not picked up yet is
+        # simply replaced by this one
+        if _current_mode != "gif":
+            rawTime = time.time() - self.lastFrame
+            self.rawBuffer.put((frame, rawTime))
+            self.lastFrame = time.time()
+
+    def recordFrame(self, path, body):
+        try:
+            with open(path, "wb") as file:
+                file.write(body)
+        except OSError as e:
+            print(f"[Bridge] Could not record frame: {e}")
+
+    def postFrame(self, request):
+        if self.recordWriter is not None and self.recordedFrames < RECORD_FRAMES:
+            path = os.path.join(RECORD_DIR, "frame-{:04}.json".format(self.recordedFrames))
+            self.recordWriter.submit(self.recordFrame, path, request.body)
+            self.recordedFrames += 1
+        self.putFrame(request.body)
+
+    def postRawFrame(self, request):
+        params = parse_qs(request.query)
+        try:
+            frame = checkRawFrame(
+                RawFrame(
+                    request.body,
+                    int(params.get("width", [0])[0]),
+                    int(params.get("height", [0])[0]),
+                    int(params.get("rotation", [0])[0]),
+                )
+            )
+        except ValueError as e:
+            debug("Rejected raw frame: {}".format(e))
+            raise HttpError(400)
+        self.putFrame(frame)
+
+    def setOverlayConfig(self, request):
+        self.updateOverlayConfig(request.body)
+
+    def updateOverlayConfig(self, body):
+        global overlayConfig
+        data = json.loads(bytes(body).decode("utf-8"))
+        # replaced rather than mutated so the overlay thread never sees a
+        # half-applied update
+        overlayConfig = {**overlayConfig, **data}
+
+    def onStreamMessage(self, message, binary):
+        if not binary:
+            self.updateOverlayConfig(message)
+            return
 
-        server_address = ("", PORT)
-        server = ThreadingSimpleServer(server_address, Handler)
-        server.serve_forever()
+        view = memoryview(message)
+        offset = 0
+        while offset < len(view):
+            kind, length = STREAM_RECORD.unpack_from(view, offset)
+            offset += STREAM_RECORD.size
+            body = view[offset : offset + length]
+            offset += length
+            if kind == STREAM_CONFIG:
+                self.updateOverlayConfig(body)
+            elif kind == STREAM_FRAME:
+                try:
+                    width, height, rotation = STREAM_FRAME_HEADER.unpack_from(body)
+                    frame = checkRawFrame(
+                        RawFrame(
+                            body[STREAM_FRAME_HEADER.size :], width, height, rotation
+                        )
+                    )
+                except (ValueError, struct.error) as e:
+                    print(f"[Bridge] Dropped stream frame: {e}")
+                    continue
+                self.putFrame(frame)
 
 
 # ---------------------------------------------------------------------------
-# Overlay Producer (unchanged from original)
+# Overlay Producer (rendering lives in overlay.py)
 # ---------------------------------------------------------------------------
 
-class OverlayProducer(Thread):
-    def __init__(self, rawBuffer: queue.Queue, frameBuffer: queue.Queue):
+class OverlayProducer(OverlayRenderer, Thread):
+    def __init__(self, rawBuffer: FrameMailbox, frameBuffer: FrameMailbox):
         Thread.__init__(self, name="OverlayProducer")
+        OverlayRenderer.__init__(
+            self, lcd, FONT_FILE, stats, ResamplePolicy(RESAMPLE, NATIVE_COMPOSE)
+        )
         self.daemon = True
         self.rawBuffer = rawBuffer
         self.frameBuffer = frameBuffer
-        self.lastAngle = 0
-        self.circleImg = Image.new("RGBA", lcd.resolution, (0, 0, 0, 0))
-        self.fonts = {
-            "titleFontSize": 10,
-            "sensorFontSize": 100,
-            "sensorLabelFontSize": 10,
-            "fontTitle": ImageFont.truetype(FONT_FILE, 10),
-            "fontSensor": ImageFont.truetype(FONT_FILE, 100),
-            "fontSensorLabel": ImageFont.truetype(FONT_FILE, 10),
-            "fontDegree": ImageFont.truetype(FONT_FILE, 10 // 3),
-        }
-
-    def updateFonts(self, data):
-        if data["titleFontSize"] != self.fonts["titleFontSize"]:
-            data["titleFontSize"] = data["titleFontSize"]
-            self.fonts["fontTitle"] = ImageFont.truetype(
-                FONT_FILE, data["titleFontSize"]
-            )
-        if data["sensorFontSize"] != self.fonts["sensorFontSize"]:
-            data["sensorFontSize"] = data["sensorFontSize"]
-            self.fonts["fontSensor"] = ImageFont.truetype(
-                FONT_FILE, data["sensorFontSize"]
-            )
-            self.fonts["fontDegree"] = ImageFont.truetype(
-                FONT_FILE, data["sensorFontSize"] // 3
-            )
-        if data["sensorLabelFontSize"] != self.fonts["sensorLabelFontSize"]:
-            data["sensorLabelFontSize"] = data["sensorLabelFontSize"]
-            self.fonts["fontSensorLabel"] = ImageFont.truetype(
-                FONT_FILE, data["sensorLabelFontSize"]
+        self.decoder = None
+        if DECODE_WORKERS > 1:
+            self.decoder = ParallelDecoder(
+                lcd.resolution, DECODE_WORKERS, resample=self.resample
             )
 
     def run(self):
         debug("Overlay converter worker started")
+        if self.decoder is not None:
+            self.runParallel()
         while True:
-            if self.frameBuffer.full():
-                time.sleep(0.001)
-                continue
-
-            self.addOverlay(*self.rawBuffer.get())
-
-    @timing
-    def parseImage(self, data):
-        raw = base64.b64decode(data["raw"])
-        return (
-            Image.open(BytesIO(raw))
-            .convert("RGBA")
-            .resize(lcd.resolution, Image.Resampling.LANCZOS)
-        )
-
-    @timing
-    def renderOverlay(self, data):
-        alpha = 255
-        if data["composition"] == "OVERLAY":
-            alpha = round((100 - data["overlayTransparency"]) * 255 / 100)
-        overlay = Image.new("RGBA", data["size"], (0, 0, 0, 0))
-        overlayCanvas = ImageDraw.Draw(overlay)
-
-        if data["spinner"] == "CPU" or data["spinner"] == "PUMP":
-            bands = list(self.circleImg.split())
-            bands[3] = bands[3].point(lambda x: round(x / 1.1) if x > 10 else 0)
-            self.circleImg = Image.merge(self.circleImg.mode, bands)
-            circleCanvas = ImageDraw.Draw(self.circleImg)
-
-            angle = MIN_SPEED + BASE_SPEED * stats[data["spinner"].lower()] / 100
-            newAngle = self.lastAngle + angle
-            circleCanvas.arc(
-                [(0, 0), lcd.resolution],
-                fill=(255, 255, 255, round(alpha / 1.05)),
-                width=lcd.resolution.width // 20,
-                start=self.lastAngle,
-                end=self.lastAngle + angle / 2,
-            )
-            circleCanvas.arc(
-                [(0, 0), lcd.resolution],
-                fill=(255, 255, 255, alpha),
-                width=lcd.resolution.width // 20,
-                start=self.lastAngle + angle / 2,
-                end=newAngle,
-            )
-            self.lastAngle = newAngle
-            overlay.paste(self.circleImg)
-
-        if data["spinner"] == "STATIC":
-            overlayCanvas.ellipse(
-                [(0, 0), lcd.resolution],
-                outline=(255, 255, 255, alpha),
-                width=lcd.resolution.width // 20,
-            )
-        if data["textOverlay"]:
-            self.updateFonts(data)
-
-            source = data.get("sensorSource", "Liquid")
-            sensor_key, sensor_label = SENSOR_MAP.get(source, ("liquid", "Liquid"))
-            sensor_val = stats.get(sensor_key)
-            if sensor_val is not None:
-                value_text = "{:.0f}".format(sensor_val)
-            else:
-                value_text = "--"
-
-            overlayCanvas.text(
-                (lcd.resolution.width // 2, lcd.resolution.height // 5),
-                text=data["titleText"],
-                anchor="mm",
-                align="center",
-                font=self.fonts["fontTitle"],
-                fill=(255, 255, 255, alpha),
-            )
-            overlayCanvas.text(
-                (lcd.resolution.width // 2, lcd.resolution.height // 2),
-                text=value_text,
-                anchor="mm",
-                align="center",
-                font=self.fonts["fontSensor"],
-                fill=(255, 255, 255, alpha),
-            )
-            textBbox = overlayCanvas.textbbox(
-                (lcd.resolution.width // 2, lcd.resolution.height // 2),
-                text=value_text,
-                anchor="mm",
-                align="center",
-                font=self.fonts["fontSensor"],
-            )
-            overlayCanvas.text(
-                ((textBbox[2], textBbox[1])),
-                text="°",
-                anchor="lt",
-                align="center",
-                font=self.fonts["fontDegree"],
-                fill=(255, 255, 255, alpha),
-            )
-            overlayCanvas.text(
-                (lcd.resolution.width // 2, 4 * lcd.resolution.height // 5),
-                text=sensor_label,
-                anchor="mm",
-                align="center",
-                font=self.fonts["fontSensorLabel"],
-                fill=(255, 255, 255, alpha),
-            )
-
-        return overlay.rotate(data["rotation"])
+            # wait for the writer first so newer posts replace the pending one
+            # instead of being composed and then dropped
+            self.frameBuffer.waitEmpty()
+            try:
+                self.addOverlay(*self.rawBuffer.get())
+            except Exception as e:
+                # a frame that cannot be decoded must not stop the thread
+                print(f"[Overlay] Dropped frame: {e}")
 
-    @timing
-    def compose(self, data, img, overlay):
-        if data["composition"] == "MIX":
-            return Image.composite(
-                img, Image.new("RGBA", img.size, (0, 0, 0, 0)), overlay
-            )
-        if data["composition"] == "OVERLAY":
-            return Image.alpha_composite(img, overlay)
+    def runParallel(self):
+        # frames come back in order; one is skipped once a newer one is
+        # decoded while it waited, so latest-frame-wins holds here too
+        while True:
+            while not self.decoder.busy():
+                item = self.rawBuffer.get(timeout=None if self.decoder.idle() else 0)
+                if item is None:
+                    break
+                (postData, rawTime) = item
+                self.decoder.submit(postData, rawTime, time.time())
+            try:
+                _, settings, img, (rawTime, startTime) = self.decoder.next()
+            except Exception as e:
+                print(f"[Overlay] Dropped frame: {e}")
+                continue
+            self.frameBuffer.waitEmpty()
+            if self.decoder.superseded():
+                self.rawBuffer.discard()
+                continue
+            self.overlayFrame(settings, img, rawTime, startTime)
 
     @timing
     def addOverlay(self, postData, rawTime):
         startTime = time.time()
-        data = json.loads(postData.decode("utf-8"))
-        data["size"] = lcd.resolution
-        img = self.parseImage(data)
+        settings, img = self.parseFrame(postData)
+        self.overlayFrame(settings, img, rawTime, startTime)
 
-        if data["composition"] != "OFF":
-            overlay = self.renderOverlay(data)
-            img = self.compose(data, img, overlay)
+    @timing
+    def overlayFrame(self, settings, img, rawTime, startTime):
+        # JSON /frame bodies carry every setting, raw frames only the rotation
+        data = {**overlayConfig, **settings}
+        img = self.composeFrame(data, img)
+        frame = self.encodeFrame(img, adaptive=data["colorPalette"] == "ADAPTIVE")
 
         overlayTime = time.time() - startTime
-        self.frameBuffer.put(
-            (
-                lcd.imageToFrame(img, adaptive=data["colorPalette"] == "ADAPTIVE"),
-                rawTime,
-                overlayTime,
-            )
-        )
+        self.frameBuffer.put((frame, rawTime, overlayTime))
 
 
 class StatsProducer(Thread):
@@ -754,7 +766,7 @@ class Systray(Thread):
 
 
 class FrameWriterWithStats(FrameWriter):
-    def __init__(self, frameBuffer: queue.Queue, lcd: driver.KrakenLCD):
+    def __init__(self, frameBuffer: FrameMailbox, lcd: driver.KrakenLCD):
         super().__init__(frameBuffer, lcd)
         self.updateAIOStats()
 
@@ -770,47 +782,35 @@ class FrameWriterWithStats(FrameWriter):
             except Exception as e:
                 print(f"[Stats] AIO read failed (will retry): {e}")
 
-    def onFrame(self):
-        (frame, rawTime, gifTime) = self.frameBuffer.get()
-        startTime = time.time()
+    def writeFrame(self, frame) -> bool:
         try:
             with lcd_lock:
-                self.lcd.writeFrame(frame)
+                return self.lcd.writeFrame(frame)
         except Exception as e:
             print(f"[FrameWriter] Write failed (will retry): {e}")
-            return
-        writeTime = time.time() - startTime
-        freeTime = rawTime - writeTime
-        from utils import debug
-        debug(
-            "FPS: {:4.1f} - Frame {:5} (size: {:7}) - raw {:6.2f}ms, gif {:6.2f}ms, write {:6.2f}ms, free time {: 7.2f}ms ".format(
-                self.fps(),
-                self.frameCount,
-                len(frame),
-                rawTime * 1000,
-                gifTime * 1000,
-                writeTime * 1000,
-                freeTime * 1000,
-            )
-        )
-        self.frameCount += 1
+            return False
+
+    def onFrame(self, frame, rawTime, gifTime):
+        super().onFrame(frame, rawTime, gifTime)
         self.updateAIOStats()
 
 
-dataBuffer = queue.Queue(maxsize=2)
-frameBuffer = queue.Queue(maxsize=2)
+dataBuffer = FrameMailbox()
+frameBuffer = FrameMailbox()
 
 rawProducer = RawProducer(dataBuffer)
 overlayProducer = OverlayProducer(dataBuffer, frameBuffer)
 frameWriterWithStats = FrameWriterWithStats(frameBuffer, lcd)
 statsProducer = StatsProducer()
-systray = Systray()
+# the tray icon relies on win32 internals, simulated runs are headless
+systray = None if lcd.simulated else Systray()
 
 rawProducer.start()
 overlayProducer.start()
 frameWriterWithStats.start()
 statsProducer.start()
-systray.start()
+if systray:
+    systray.start()
 
 print("SignalRGB Kraken bridge started")
 print(f"GIF endpoint: POST http://127.0.0.1:{PORT}/gif  body: {{\"path\": \"C:/path/to/file.gif\", \"rotation\": 0}}")
@@ -819,17 +819,19 @@ print(f"Stop GIF:     POST http://127.0.0.1:{PORT}/gif/stop")
 try:
     while True:
         time.sleep(1)
-        systray.icon.update_menu()
+        if systray:
+            systray.icon.update_menu()
         if not (
             statsProducer.is_alive()
             and rawProducer.is_alive()
             and overlayProducer.is_alive()
             and frameWriterWithStats.is_alive()
-            and systray.is_alive()
+            and (systray is None or systray.is_alive())
         ):
             raise KeyboardInterrupt("Some thread is dead")
 except KeyboardInterrupt:
     _stop_gif()
     frameWriterWithStats.shouldStop = True
     frameWriterWithStats.join()
-    systray.stop()
+    if systray:
+        systray.stop()
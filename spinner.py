@@ -0,0 +1,64 @@
+"""
+CPU/PUMP spinner trail for the SignalRGB overlay.
+
+The ring is precomputed once as a polar sprite: every pixel under the ring
+stores which of ANGLE_BINS angular bins it falls into (0 elsewhere). The trail
+itself is a 256-entry alpha table indexed by bin, so fading it and drawing the
+new arc only touch that table, and producing a frame is a single point()
+lookup over the sprite plus the merge into RGBA.
+"""
+
+import math
+from PIL import Image, ImageDraw
+
+ANGLE_BINS = 255
+BIN_ANGLE = 360 / ANGLE_BINS
+# trail fade applied once per frame, the same curve the spinner always used
+FADE = [round(alpha / 1.1) if alpha > 10 else 0 for alpha in range(256)]
+
+
+def polarSprite(resolution) -> Image.Image:
+    width, height = resolution
+    ring = Image.new("L", resolution, 0)
+    ImageDraw.Draw(ring).ellipse(
+        [(0, 0), resolution], outline=255, width=width // 20
+    )
+
+    # angles follow PIL's arc convention: degrees clockwise from 3 o'clock
+    centerX, centerY = width / 2, height / 2
+    sprite = bytearray(ring.tobytes())
+    for offset, covered in enumerate(sprite):
+        if covered:
+            y, x = divmod(offset, width)
+            angle = math.degrees(math.atan2(y - centerY, x - centerX)) % 360
+            sprite[offset] = min(int(angle / BIN_ANGLE), ANGLE_BINS - 1) + 1
+    return Image.frombytes("L", resolution, bytes(sprite))
+
+
+class SpinnerRenderer:
+    def __init__(self, resolution):
+        self.resolution = tuple(resolution)
+        self.angle = 0.0
+        self.levels = [0] * 256
+        self.sprite = polarSprite(self.resolution)
+        self.white = Image.new("L", self.resolution, 255)
+
+    def fill(self, start: float, end: float, level: int):
+        first = math.floor(start / BIN_ANGLE)
+        last = max(math.ceil(end / BIN_ANGLE), first + 1)
+        for index in range(first, last):
+            self.levels[index % ANGLE_BINS + 1] = level
+
+    def render(self, angle: float, alpha: int, rotation=0) -> Image.Image:
+        """
+        Advance the spinner by angle degrees and return the RGBA trail.
+        Rotation is folded into the arc angles instead of rotating the image.
+        """
+        self.levels = [FADE[level] for level in self.levels]
+        start = self.angle - rotation
+        self.fill(start, start + angle / 2, round(alpha / 1.05))
+        self.fill(start + angle / 2, start + angle, alpha)
+        self.angle = (self.angle + angle) % 360
+
+        trail = self.sprite.point(self.levels)
+        return Image.merge("RGBA", (self.white, self.white, self.white, trail))
@@ -0,0 +1,118 @@
+import asyncio
+
+import bridgeserver
+from bridgeserver import BridgeServer, HttpError, Request
+
+
+def test_http_error_from_handler_sets_status():
+    def reject(request):
+        raise HttpError(400)
+
+    server = BridgeServer(0)
+    server.route("POST", "/frame/raw", reject)
+    request = Request("POST", "/frame/raw", "", {}, b"", True)
+    response = asyncio.run(server.dispatch(request))
+    assert response.status == 400
+
+
+class Writer:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def clientFrame(fin, opcode, payload, rsv=0, masked=True):
+    length = len(payload)
+    if length < 126:
+        header = bytes((fin << 7 | rsv << 4 | opcode, masked << 7 | length))
+    else:
+        header = bytes((fin << 7 | rsv << 4 | opcode, masked << 7 | 126))
+        header += length.to_bytes(2, "big")
+    if not masked:
+        return header + payload
+    mask = b"\x01\x02\x03\x04"
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+def serveFrames(frames, monkeypatch, limit):
+    monkeypatch.setattr(bridgeserver, "MAX_BODY_SIZE", limit)
+    messages = []
+    server = BridgeServer(0)
+    server.websocket("/stream", lambda message, binary: messages.append(message))
+    request = Request("GET", "/stream", "", {"sec-websocket-key": "a2V5"}, b"", True)
+
+    async def serve():
+        reader = asyncio.StreamReader()
+        for frame in frames:
+            reader.feed_data(frame if isinstance(frame, bytes) else clientFrame(*frame))
+        reader.feed_eof()
+        writer = Writer()
+        try:
+            await server.serveWebSocket(request, reader, writer)
+        except asyncio.IncompleteReadError:
+            pass
+        return writer.data
+
+    return messages, asyncio.run(serve())
+
+
+def test_fragmented_message_is_reassembled(monkeypatch):
+    frames = [(0, 2, b"a" * 60), (0, 0, b"b" * 30), (1, 0, b"c" * 10)]
+    messages, written = serveFrames(frames, monkeypatch, 100)
+    assert messages == [b"a" * 60 + b"b" * 30 + b"c" * 10]
+
+
+def test_oversized_fragmented_message_closes_with_1009(monkeypatch):
+    frames = [(0, 2, b"a" * 60), (0, 0, b"b" * 60), (1, 0, b"c")]
+    messages, written = serveFrames(frames, monkeypatch, 100)
+    assert messages == []
+    assert written.endswith(bytes((0x88, 2)) + (1009).to_bytes(2, "big"))
+
+
+def closeFrame(status):
+    return bytes((0x88, 2)) + status.to_bytes(2, "big")
+
+
+def test_ping_gets_pong_with_same_payload(monkeypatch):
+    messages, written = serveFrames([(1, 9, b"p" * 125)], monkeypatch, 1000)
+    assert written.endswith(bytes((0x8A, 125)) + b"p" * 125)
+
+
+def test_oversized_ping_closes_with_1002(monkeypatch):
+    messages, written = serveFrames([(1, 9, b"p" * 200), (1, 2, b"a")], monkeypatch, 1000)
+    assert messages == []
+    assert written.endswith(closeFrame(1002))
+
+
+def test_fragmented_ping_closes_with_1002(monkeypatch):
+    messages, written = serveFrames([(0, 9, b"p"), (1, 2, b"a")], monkeypatch, 100)
+    assert messages == []
+    assert written.endswith(closeFrame(1002))
+
+
+def test_unmasked_frame_closes_with_1002(monkeypatch):
+    frame = clientFrame(1, 2, b"a", masked=False)
+    messages, written = serveFrames([frame], monkeypatch, 100)
+    assert messages == []
+    assert written.endswith(closeFrame(1002))
+
+
+def test_reserved_bits_close_with_1002(monkeypatch):
+    frame = clientFrame(1, 2, b"a", rsv=4)
+    messages, written = serveFrames([frame], monkeypatch, 100)
+    assert messages == []
+    assert written.endswith(closeFrame(1002))
+
+
+def test_server_frames_use_extended_lengths():
+    server = BridgeServer(0)
+    assert server.encodeWebSocketFrame(2, b"a" * 125)[:2] == bytes((0x82, 125))
+    assert server.encodeWebSocketFrame(2, b"a" * 300)[:4] == bytes((0x82, 126, 1, 44))
+    frame = server.encodeWebSocketFrame(2, b"a" * 70000)
+    assert frame[:10] == bytes((0x82, 127)) + (70000).to_bytes(8, "big")
+    assert len(frame) == 10 + 70000
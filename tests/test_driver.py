@@ -0,0 +1,46 @@
+import importlib
+import sys
+import types
+
+import driver
+import q565
+
+
+class OldEncoder:
+    # Q565Encoder of a wheel built before diff_indexed existed
+    def __init__(self, width, height, pixel_format="RGB", parallel=False):
+        pass
+
+
+def test_outdated_extension_falls_back_to_python_encoder(monkeypatch):
+    monkeypatch.setitem(sys.modules, "q565_rust", types.SimpleNamespace(Q565Encoder=OldEncoder))
+    try:
+        assert importlib.reload(driver).Q565Encoder is q565.Q565Encoder
+    finally:
+        monkeypatch.undo()
+        importlib.reload(driver)
+
+
+def simulatedLcd(name):
+    from transport import SimulatedTransport
+
+    dev = next(dev for dev in driver.SUPPORTED_DEVICES if dev["name"] == name)
+    return driver.KrakenLCD(
+        SimulatedTransport(dev["pid"], dev["resolution"], dev["totalBuckets"], latency=0)
+    )
+
+
+def test_frame_buffers_follow_a_switched_rendering_mode():
+    from PIL import Image
+
+    z3 = simulatedLcd("Kraken Z3")
+    elite = simulatedLcd("Kraken Elite")
+    assert z3.q565Buffers is not elite.q565Buffers
+
+    z3.renderingMode = driver.RENDERING_MODE.Q565
+    raw = bytes(z3.resolution.width * z3.resolution.height * 3)
+    assert len(z3.rawToFrame(raw)) > 0
+
+    elite.renderingMode = driver.RENDERING_MODE.RGBA
+    img = Image.new("RGB", elite.resolution)
+    assert len(elite.imageToFrame(img)) == elite.resolution.width * elite.resolution.height * 4
@@ -0,0 +1,23 @@
+from PIL import Image
+
+from framebuffer import packRGBX
+
+
+def expectedRGBX(img):
+    rgb = img.convert("RGB").tobytes()
+    return b"".join(rgb[i : i + 3] + b"\0" for i in range(0, len(rgb), 3))
+
+
+def test_pack_rgbx_zero_pads_every_mode():
+    for mode in ("RGB", "RGBA", "L", "P"):
+        img = Image.effect_noise((7, 5), 64).convert(mode)
+        assert packRGBX(img) == expectedRGBX(img), mode
+
+
+def test_pack_rgbx_reuses_buffer():
+    img = Image.effect_noise((7, 5), 64).convert("RGBA")
+    buffer = bytearray(b"\xff" * 7 * 5 * 4)
+    assert packRGBX(img, buffer) is buffer
+    assert buffer == expectedRGBX(img)
+    # a buffer sized for another resolution is replaced, not overrun
+    assert len(packRGBX(img, bytearray(3))) == 7 * 5 * 4
@@ -0,0 +1,75 @@
+import os
+
+import gifcache
+from gifcache import GifCache
+
+
+def writeSource(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_hit_and_miss(tmp_path):
+    cache = GifCache(str(tmp_path / "cache"), 1024)
+    source = writeSource(tmp_path, "a.gif", b"GIF89a source")
+    key = cache.key(source, 0, 100)
+
+    assert cache.get(key) is None
+    cache.put(key, b"prepared")
+    assert cache.get(key) == b"prepared"
+    assert (cache.hits, cache.misses, cache.bytesSaved) == (1, 1, len(b"prepared"))
+
+
+def test_key_covers_settings_content_and_version(tmp_path, monkeypatch):
+    cache = GifCache(str(tmp_path / "cache"), 1024)
+    source = writeSource(tmp_path, "a.gif", b"GIF89a source")
+    key = cache.key(source, 0, 100)
+
+    assert cache.key(source, 0, 100) == key
+    assert cache.key(source, 90, 100) != key
+    monkeypatch.setattr(gifcache, "KEY_VERSION", gifcache.KEY_VERSION + 1)
+    assert cache.key(source, 0, 100) != key
+    monkeypatch.undo()
+
+    writeSource(tmp_path, "a.gif", b"GIF89a edited source")
+    assert cache.key(source, 0, 100) != key
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = GifCache(str(tmp_path / "cache"), 250)
+    for index, key in enumerate("abc"):
+        cache.put(key, bytes(100))
+        # mtimes order the entries, keep them apart on coarse filesystems
+        os.utime(cache.entryPath(key), ns=(index * 10**9, index * 10**9))
+
+    # a was least recently used when c pushed the cache over its limit
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    assert cache.stats()["bytes"] <= 250
+
+    # oversized blobs are never stored
+    cache.put("d", bytes(300))
+    assert cache.get("d") is None
+
+
+def test_get_survives_eviction_after_read(tmp_path, monkeypatch):
+    cache = GifCache(str(tmp_path / "cache"), 1024)
+    cache.put("a", b"prepared")
+
+    def evicted(path, *args, **kwargs):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(gifcache.os, "utime", evicted)
+    assert cache.get("a") == b"prepared"
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_file_hashes_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(gifcache, "FILE_HASHES", 4)
+    cache = GifCache(str(tmp_path / "cache"), 1024)
+    for index in range(10):
+        cache.key(writeSource(tmp_path, f"{index}.gif", bytes([index])))
+    assert cache.fileHashes.stats()["size"] == 4
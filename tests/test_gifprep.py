@@ -0,0 +1,122 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw, ImageSequence
+
+import gifprep
+from gifprep import GifPreparer, GifWriter, loadFrames, quantizeFrame
+
+SIZE = (96, 80)
+
+
+def animation(count=8, repeat=3):
+    frames = []
+    for index in range(count):
+        frame = Image.linear_gradient("L").resize(SIZE).convert("RGB")
+        draw = ImageDraw.Draw(frame)
+        draw.rectangle((index * 8, 10, index * 8 + 20, 40), fill=(200, 30, 90))
+        draw.ellipse((40, 40 + index, 70, 70 + index), fill=(20, 180, 60))
+        frames.append(frame)
+    if repeat:
+        # a repeated frame lengthens the one before instead of being stored
+        frames.insert(repeat, frames[repeat - 1].copy())
+    return frames
+
+
+def quantizedFrames(frames, colors, shared):
+    palette = None
+    if shared:
+        palette = Image.new("P", (1, 1))
+        palette.putpalette(frames[0].quantize(colors - 1).getpalette())
+    return [quantizeFrame(frame, colors, palette) for frame in frames]
+
+
+def decoded(data):
+    with Image.open(BytesIO(data)) as img:
+        return [
+            (frame.convert("RGB").tobytes(), frame.info.get("duration"))
+            for frame in ImageSequence.Iterator(img)
+        ]
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_writer_output_decodes_to_the_quantized_frames(shared):
+    quantized = quantizedFrames(animation(), 64, shared)
+    expected = [frame.convert("RGB").tobytes() for frame in quantized]
+    del expected[3]
+    frames = decoded(written(quantized, shared))
+    assert [pixels for pixels, _ in frames] == expected
+    assert [duration for _, duration in frames] == [40, 40, 80] + [40] * 5
+
+
+def written(frames, shared):
+    output = BytesIO()
+    writer = GifWriter(output, {"loop": 0}, 40, shared)
+    for frame in frames:
+        writer.append(frame)
+    writer.close()
+    return output.getvalue()
+
+
+def test_only_changed_rectangle_is_stored():
+    quantized = quantizedFrames(animation(repeat=0), 64, True)
+    whole = len(written(quantized[:1], True))
+    pair = len(written(quantized[:2], True))
+    assert pair - whole < whole / 2
+
+
+def test_single_frame():
+    frame = quantizeFrame(animation(1, repeat=0)[0], 32)
+    output = BytesIO()
+    writer = GifWriter(output, {}, None)
+    writer.append(frame)
+    writer.close()
+    assert [pixels for pixels, _ in decoded(output.getvalue())] == [
+        frame.convert("RGB").tobytes()
+    ]
+
+
+@pytest.mark.parametrize("globalPalette", [False, True])
+def test_encode_within_limit(globalPalette):
+    frames = animation(24)
+    preparer = GifPreparer(frames, {"duration": 50, "loop": 0}, workers=1, globalPalette=globalPalette)
+    try:
+        data, size = preparer.encodeWithin(64, None)
+        assert size == len(data)
+        assert len(decoded(data)) == len(frames) - 1
+        data, projected = preparer.encodeWithin(64, size // 2)
+        assert data is None and projected > size // 2
+    finally:
+        preparer.close()
+
+
+
+def test_load_frames_closes_the_source(tmp_path, monkeypatch):
+    path = tmp_path / "source.gif"
+    frames = animation(repeat=0)
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=40, loop=0)
+
+    opened = []
+    imageOpen = Image.open
+
+    def openImage(*args, **kwargs):
+        img = imageOpen(*args, **kwargs)
+        opened.append(img)
+        return img
+
+    monkeypatch.setattr(gifprep.Image, "open", openImage)
+    loaded, info = loadFrames(str(path), SIZE)
+    monkeypatch.undo()
+    assert len(loaded) == len(frames) and info["loop"] == 0
+    # a GIF left open stays locked on Windows
+    assert opened and all(img.fp is None for img in opened)
+
+
+def test_cancel_stops_a_running_fit():
+    preparer = GifPreparer(animation(), {"duration": 40})
+    preparer.cancel()
+    try:
+        with pytest.raises(Exception):
+            preparer.fit(1, log=lambda *args: None)
+    finally:
+        preparer.close()
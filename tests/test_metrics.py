@@ -0,0 +1,38 @@
+import threading
+
+from metrics import SpanRecorder
+
+
+class Codec:
+    def encode(self):
+        pass
+
+
+class Other:
+    def encode(self):
+        pass
+
+
+def test_spans_are_named_by_qualname():
+    recorder = SpanRecorder(ringSize=8)
+    recorder.span(Codec.encode.__qualname__, Codec().encode)()
+    recorder.span(Other.encode.__qualname__, Other().encode)()
+    assert set(recorder.histograms()) == {"Codec.encode", "Other.encode"}
+
+
+def test_exited_threads_are_retired():
+    recorder = SpanRecorder(ringSize=8)
+    work = recorder.span("work", lambda: None)
+    for _ in range(5):
+        thread = threading.Thread(target=lambda: [work() for _ in range(3)])
+        thread.start()
+        thread.join()
+    work()
+
+    counts, _ = recorder.histograms()["work"]
+    assert sum(counts) == 5 * 3 + 1
+    # only this thread keeps a ring buffer
+    assert [spans.threadName for spans in recorder.threads] == [
+        threading.current_thread().name
+    ]
+    assert len(recorder.recent()["work"]) == 1
@@ -0,0 +1,73 @@
+import pytest
+
+from pipeline import (
+    MAX_RAW_SIDE,
+    ParallelDecoder,
+    RawFrame,
+    ResamplePolicy,
+    checkRawFrame,
+    decodeFrame,
+)
+
+
+def rawFrame(width, height, size=None, rotation=0):
+    body = bytes(width * height * 3 if size is None else size)
+    return RawFrame(body, width, height, rotation)
+
+
+def test_raw_frame_of_stated_size_is_accepted():
+    frame = rawFrame(41, 40)
+    assert checkRawFrame(frame) is frame
+    settings, img = decodeFrame(frame, (64, 64))
+    assert settings == {"rotation": 0}
+    assert img.size == (64, 64)
+
+
+def test_encoded_frame_skips_size_check():
+    frame = RawFrame(b"not checked here", 0, 0, 0)
+    assert checkRawFrame(frame) is frame
+
+
+@pytest.mark.parametrize(
+    "frame",
+    [
+        rawFrame(41, 40, size=40 * 40 * 3),
+        rawFrame(41, 40, size=41 * 40 * 3 + 1),
+        rawFrame(40, 0, size=0),
+        rawFrame(-1, 40, size=0),
+        rawFrame(MAX_RAW_SIDE + 1, 1),
+    ],
+)
+def test_mismatched_raw_frame_is_rejected(frame):
+    with pytest.raises(ValueError):
+        checkRawFrame(frame)
+
+
+def test_native_frame_larger_than_slot_comes_back_whole():
+    decoder = ParallelDecoder((32, 32), 1, processes=True, resample=ResamplePolicy(native=True))
+    try:
+        frame = RawFrame(bytes(range(256)) * 96, 128, 64, 0)
+        decoder.submit(frame)
+        decoder.submit(rawFrame(16, 16))
+        _, settings, img, _ = decoder.next()
+        assert img.size == (128, 64)
+        assert img.tobytes() == frame.body
+        assert decoder.next()[2].size == (16, 16)
+    finally:
+        decoder.close()
+
+
+def test_superseded_once_a_newer_frame_is_decoded():
+    decoder = ParallelDecoder((32, 32), 2)
+    try:
+        decoder.submit(rawFrame(8, 8))
+        assert decoder.next()[0] == 0
+        assert not decoder.superseded()
+        decoder.submit(rawFrame(8, 8))
+        decoder.submit(rawFrame(8, 8))
+        assert decoder.next()[0] == 1
+        decoder.pending[0][1].result()
+        assert decoder.superseded()
+    finally:
+        decoder.close()
+
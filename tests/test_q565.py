@@ -0,0 +1,178 @@
+import random
+
+import pytest
+from PIL import Image
+
+import q565
+
+
+def pack(r, g, b):
+    return r << 11 | g << 5 | b
+
+
+def pixels(values, pixel_format="RGB"):
+    rgb = [q565.rgb565ToRGB888(value) for value in values]
+    if pixel_format == "RGB":
+        return b"".join(bytes(px) for px in rgb)
+    if pixel_format == "BGRA":
+        return b"".join(bytes((b, g, r, 255)) for r, g, b in rgb)
+    return b"".join(bytes((r, g, b, 0)) for r, g, b in rgb)
+
+
+# 0xF81F and 0x0413 share a hash slot, so each evicts the other
+SHAPES = (
+    [0] * 3
+    + [pack(1, 1, 1), pack(0, 0, 0), pack(31, 63, 31)]
+    + [0xF81F, 0x0413, 0xF81F, 0x0413]
+    + [pack(10, 20, 10), pack(11, 19, 9), pack(9, 21, 11)]
+    + [pack(12, 30, 8)] * 72
+    + [pack(20, 40, 20), pack(5, 5, 5), pack(21, 42, 19), pack(10, 20, 10)]
+    + [pack(3, 3, 3)] * 7
+)
+
+# streams for SHAPES as 8x12: q565.encode with diff_indexed off and on,
+# and the baseline encoder, which never emitted negative deltas
+GOLDEN = bytes.fromhex(
+    "7135363508000c00c27f00556efe1304fe1ff8fe1304fe8a52759248fec863fdc89a6a"
+    "fea528fe53ad1cfe6318c5ff"
+)
+GOLDEN_DIFF_INDEXED = bytes.fromhex(
+    "7135363508000c00c27f00556efe1304b140fe1304fe8a52759248fec863fdc89a6a"
+    "fea528bb791ca80dc5ff"
+)
+BASELINE = bytes.fromhex(
+    "7135363508000c00c27f00feffff6efe1304fe1ff8fe1304fe8a52fe695afeab4afec8"
+    "63fdc89a6afea528fe53ad1cfe6318c5ff"
+)
+
+
+@pytest.fixture(params=["numpy", "lut"])
+def codec(request, monkeypatch):
+    if request.param == "lut":
+        monkeypatch.setattr(q565, "numpy", None)
+    elif q565.numpy is None:
+        pytest.skip("numpy not installed")
+    return q565
+
+
+def images():
+    random.seed(7)
+    noise = [random.randrange(0x10000) for _ in range(61 * 23)]
+    # small steps exercise DIFF and LUMA, jumps to a perturbed earlier
+    # colour RGB565 and DIFF_INDEXED
+    bases = [random.randrange(0x10000) for _ in range(12)]
+    walk = []
+    for _ in range(64 * 40):
+        if random.random() < 0.3:
+            base = random.choice(bases)
+            r, g, b = base >> 11, (base >> 5) & 0x3F, base & 0x1F
+            walk.append(
+                pack(
+                    (r + random.randint(-2, 1)) & 0x1F,
+                    (g + random.randint(-4, 3)) & 0x3F,
+                    (b + random.randint(-2, 1)) & 0x1F,
+                )
+            )
+        else:
+            step = random.choice((1, -1, 32, -32, 2048, -2048, 33, 0))
+            walk.append(((walk[-1] if walk else 0) + step) & 0xFFFF)
+    return {
+        "shapes": (SHAPES, 8, 12),
+        "noise": (noise, 61, 23),
+        "walk": (walk, 64, 40),
+        "flat": ([pack(4, 8, 4)] * 300, 300, 1),
+    }
+
+
+@pytest.mark.parametrize("name", sorted(images()))
+@pytest.mark.parametrize("diff_indexed", [False, True])
+def test_round_trip(codec, name, diff_indexed):
+    values, width, height = images()[name]
+    raw = pixels(values)
+    encoded = codec.encode(raw, width, height, diff_indexed=diff_indexed)
+    assert codec.decode(encoded)["bytes"] == raw
+
+    out = bytearray(width * height * 2)
+    assert codec.decode_into(encoded, out, "RGB565") == (width, height)
+    assert list(memoryview(out).cast("H")) == values
+
+
+@pytest.mark.parametrize("pixel_format", ["RGBA", "RGBX", "BGRA"])
+def test_pixel_formats_encode_like_rgb(codec, pixel_format):
+    values, width, height = images()["walk"]
+    expected = codec.encode(pixels(values), width, height, diff_indexed=True)
+    raw = pixels(values, pixel_format)
+    assert codec.encode(raw, width, height, pixel_format, True) == expected
+
+
+def test_golden_bytes(codec):
+    raw = pixels(SHAPES)
+    assert codec.encode(raw, 8, 12) == GOLDEN
+    assert codec.encode(raw, 8, 12, diff_indexed=True) == GOLDEN_DIFF_INDEXED
+    # baseline streams still decode to the same pixels
+    assert codec.decode(BASELINE)["bytes"] == raw
+
+
+def test_runs_longer_than_62_are_split(codec):
+    encoded = codec.encode(pixels([pack(4, 8, 4)] * 200), 200, 1)
+    # a LUMA op from black, then 199 repeats as 62 + 62 + 62 + 13
+    assert encoded[8:10] == bytes((q565.Q565_OP_LUMA | 24, 0x44))
+    assert encoded[10:] == bytes((0xFD, 0xFD, 0xFD, 0xCC, q565.Q565_OP_END))
+
+
+def test_hash_collision_evicts_index(codec):
+    encoded = codec.encode(pixels(SHAPES), 8, 12)
+    ops = encoded[8:]
+    # 0x0413 is sent whole both times, the 0xF81F between took its slot
+    assert ops.count(bytes((q565.Q565_OP_RGB565, 0x13, 0x04))) == 2
+    assert ops.count(bytes((q565.Q565_OP_RGB565, 0x1F, 0xF8))) == 1
+
+
+def test_diff_indexed_only_when_enabled(codec):
+    values, width, height = images()["walk"]
+    raw = pixels(values)
+    assert q565.Q565_OP_DIFF_INDEXED >> 5 not in opcodes(codec.encode(raw, width, height))
+    assert q565.Q565_OP_DIFF_INDEXED >> 5 in opcodes(
+        codec.encode(raw, width, height, diff_indexed=True)
+    )
+
+
+def opcodes(encoded):
+    """Top three bits of every op in a stream."""
+    ops = []
+    pos = 8
+    while encoded[pos] != q565.Q565_OP_END:
+        op = encoded[pos]
+        ops.append(op >> 5)
+        if op == q565.Q565_OP_RGB565:
+            pos += 3
+        elif op & q565.Q565_MASK_2 == q565.Q565_OP_LUMA:
+            pos += 2
+        else:
+            pos += 1
+    return ops
+
+
+def test_decoder_rejects_bad_streams(codec):
+    encoded = codec.encode(pixels(SHAPES), 8, 12)
+    with pytest.raises(ValueError):
+        codec.decode(b"qoif" + encoded[4:])
+    with pytest.raises(ValueError):
+        codec.decode(encoded[:-4])
+    with pytest.raises(ValueError):
+        codec.decode(encoded[:4] + (4).to_bytes(2, "little") + encoded[6:])
+
+
+def test_encode_rejects_wrong_size(codec):
+    with pytest.raises(ValueError):
+        codec.encode(pixels(SHAPES), 8, 11)
+
+
+def test_encoder_class_matches_encode():
+    values, width, height = images()["noise"]
+    raw = pixels(values)
+    encoder = q565.Q565Encoder(width, height, diff_indexed=True)
+    out = bytearray(encoder.capacity)
+    size = encoder.encode_into(raw, out)
+    assert out[:size] == q565.encode(raw, width, height, diff_indexed=True)
+    assert encoder.last_bytes_written == size
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+from PIL import Image
+
+import q565
+
+q565_rust = pytest.importorskip("q565_rust")
+
+
+def images():
+    random.seed(3)
+    noise = bytes(random.randrange(256) for _ in range(97 * 61 * 3))
+    return [
+        Image.frombytes("RGB", (97, 61), noise),
+        Image.radial_gradient("L").convert("RGB"),
+        Image.new("RGB", (300, 7), (5, 6, 7)),
+    ]
+
+
+@pytest.mark.parametrize("img", images(), ids=["noise", "gradient", "flat"])
+@pytest.mark.parametrize("diff_indexed", [False, True])
+def test_round_trip_matches_python_codec(img, diff_indexed):
+    raw = img.tobytes()
+    width, height = img.size
+    encoder = q565_rust.Q565Encoder(width, height, diff_indexed=diff_indexed)
+    encoded = encoder.encode(raw)
+    assert encoded == q565.encode(raw, width, height, diff_indexed=diff_indexed)
+
+    decoded = bytearray(len(raw))
+    assert q565_rust.py_decode(encoded, decoded) == (width, height)
+    assert decoded == q565.decode(encoded)["bytes"]
+
+
+def test_py_encode_matches_python_codec():
+    for img in images():
+        raw = img.tobytes()
+        assert q565_rust.py_encode(*img.size, raw) == q565.encode(raw, *img.size)
+
+
+def test_decode_rejects_unsafe_buffers():
+    img = images()[1]
+    encoded = q565.encode(img.tobytes(), *img.size)
+    size = img.width * img.height * 3
+    buffer = bytearray(encoded) + bytearray(size)
+
+    with pytest.raises(ValueError):
+        q565_rust.py_decode(buffer, buffer)
+    view = memoryview(buffer)
+    with pytest.raises(ValueError):
+        q565_rust.py_decode(view[: len(encoded)], view[len(encoded) - 1 :])
+    with pytest.raises(ValueError):
+        q565_rust.py_decode(encoded, bytes(size))
+    with pytest.raises(ValueError):
+        q565_rust.py_decode(encoded, memoryview(bytearray(size * 2))[::2])
+
+    assert q565_rust.py_decode(view[: len(encoded)], view[len(encoded) :]) == img.size
+    assert view[len(encoded) :] == q565.decode(encoded)["bytes"]
@@ -0,0 +1,21 @@
+import math
+
+import pytest
+from PIL import Image
+
+from q565cli import psnr, verify
+
+
+def test_psnr_of_a_whole_frame_does_not_overflow():
+    size = 640 * 640 * 3
+    expected = 10 * math.log10(255 * 255 / (200 * 200))
+    assert psnr(bytes(size), bytes([200]) * size) == pytest.approx(expected)
+    assert psnr(bytes(size), bytes(size)) == math.inf
+
+
+def test_verify_round_trips_the_driver_stream(tmp_path, capsys):
+    Image.radial_gradient("L").convert("RGB").save(tmp_path / "gradient.png")
+    Image.linear_gradient("L").convert("RGB").rotate(30).save(tmp_path / "rotated.png")
+    (tmp_path / "notes.txt").write_text("not an image")
+    assert verify(str(tmp_path))
+    assert "0 failed" in capsys.readouterr().out
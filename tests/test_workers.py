@@ -0,0 +1,85 @@
+import time
+
+from workers import FrameMailbox, FrameWriter
+
+
+class FakeLcd:
+    def __init__(self):
+        self.streamEpoch = 1
+        self.written = []
+
+    def writeFrame(self, frame):
+        self.written.append(bytes(frame))
+        return True
+
+
+def test_mailbox_keeps_only_the_latest_item():
+    mailbox = FrameMailbox()
+    assert mailbox.get(timeout=0) is None
+    mailbox.put("a")
+    mailbox.put("b")
+    assert mailbox.get(timeout=0) == "b"
+    assert mailbox.dropped == 1
+    assert mailbox.waitEmpty(timeout=0)
+
+
+def test_identical_frames_are_skipped():
+    lcd = FakeLcd()
+    writer = FrameWriter(FrameMailbox(), lcd, keepAliveInterval=60)
+    for frame in (b"a", b"a", b"b", b"b", b"a"):
+        writer.onFrame(frame, 0, 0)
+    assert lcd.written == [b"a", b"b", b"a"]
+    assert writer.skippedFrames == 2
+
+
+def test_new_stream_gets_its_first_frame():
+    lcd = FakeLcd()
+    writer = FrameWriter(FrameMailbox(), lcd, keepAliveInterval=60)
+    writer.onFrame(b"a", 0, 0)
+    lcd.streamEpoch += 1
+    writer.onFrame(b"a", 0, 0)
+    assert lcd.written == [b"a", b"a"]
+
+
+def test_keepalive_resends_last_frame_once_idle():
+    lcd = FakeLcd()
+    writer = FrameWriter(FrameMailbox(), lcd, keepAliveInterval=60)
+    writer.onFrame(b"a", 0, 0)
+    writer.keepAlive()
+    assert lcd.written == [b"a"]
+
+    writer.lastWriteTime -= 61
+    writer.keepAlive()
+    assert lcd.written == [b"a", b"a"]
+    assert writer.keepAlives == 1
+
+    # a duplicate past the interval is written too
+    writer.lastWriteTime -= 61
+    writer.onFrame(b"a", 0, 0)
+    assert lcd.written == [b"a", b"a", b"a"]
+
+
+def test_keepalive_skips_frames_of_an_old_stream():
+    lcd = FakeLcd()
+    writer = FrameWriter(FrameMailbox(), lcd, keepAliveInterval=60)
+    writer.onFrame(b"a", 0, 0)
+    lcd.streamEpoch += 1
+    writer.lastWriteTime -= 61
+    writer.keepAlive()
+    assert lcd.written == [b"a"]
+
+
+def test_keepalive_runs_without_new_frames():
+    lcd = FakeLcd()
+    mailbox = FrameMailbox()
+    writer = FrameWriter(mailbox, lcd, keepAliveInterval=0.01)
+    writer.start()
+    try:
+        mailbox.put((b"a", 0, 0))
+        deadline = time.time() + 5
+        while len(lcd.written) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        writer.shouldStop = True
+        writer.join()
+    assert lcd.written[:2] == [b"a", b"a"]
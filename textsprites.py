@@ -0,0 +1,51 @@
+"""
+Cached text rendering for the SignalRGB overlay.
+
+Fonts are loaded once per size, and every (text, size, anchor) string is
+rasterised once into an "L" coverage mask. Drawing is then a single paste of
+the fill colour through that mask, which writes the same pixels ImageDraw.text
+does for integer coordinates.
+"""
+
+from PIL import Image, ImageDraw, ImageFont
+from utils import LRUCache
+
+
+class TextSprites:
+    def __init__(self, fontFile: str, maxFonts=8, maxSprites=256):
+        self.fontFile = fontFile
+        self.fonts = LRUCache(maxFonts)
+        self.sprites = LRUCache(maxSprites)
+        self.measure = ImageDraw.Draw(Image.new("L", (1, 1)))
+
+    def font(self, size: int) -> ImageFont.FreeTypeFont:
+        font = self.fonts.get(size)
+        if font is None:
+            font = self.fonts.put(size, ImageFont.truetype(self.fontFile, size))
+        return font
+
+    def sprite(self, text: str, size: int, anchor="mm"):
+        """Coverage mask for text and its (left, top) offset from the anchor point."""
+        key = (text, size, anchor)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            font = self.font(size)
+            left, top, right, bottom = self.measure.textbbox(
+                (0, 0), text, font=font, anchor=anchor
+            )
+            mask = Image.new("L", (max(right - left, 1), max(bottom - top, 1)), 0)
+            ImageDraw.Draw(mask).text(
+                (-left, -top), text, fill=255, font=font, anchor=anchor
+            )
+            sprite = self.sprites.put(key, (mask, left, top))
+        return sprite
+
+    def draw(self, image: Image.Image, xy, text: str, size: int, fill, anchor="mm"):
+        """Draw text at integer xy like ImageDraw.text and return its bounding box."""
+        mask, left, top = self.sprite(text, size, anchor)
+        x, y = xy[0] + left, xy[1] + top
+        image.paste(fill, (x, y), mask)
+        return (x, y, x + mask.width, y + mask.height)
+
+    def stats(self):
+        return {"fonts": self.fonts.stats(), "sprites": self.sprites.stats()}
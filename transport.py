@@ -0,0 +1,378 @@
+"""
+Transports carrying the Kraken LCD protocol.
+
+KrakenLCD only needs four primitives: write a 64 byte HID report, read one
+back, push a payload over the bulk endpoint and drain pending reports.
+UsbTransport talks to the real device through hidapi and WinUSB, and imports
+them lazily so the rest of the pipeline loads on any platform.
+SimulatedTransport implements the same command protocol in memory, with a
+configurable USB bandwidth and latency, so the bridge can run and be
+benchmarked without hardware (--simulate).
+"""
+
+import sys
+import threading
+import time
+from collections import deque
+from io import BytesIO
+from PIL import Image
+import q565
+from utils import argValue, debugUsb
+
+_NZXT_VID = 0x1E71
+_NZXT_GUID = "{30123011-7ee7-1125-0724-101503010819}"
+
+COMMON_WRITE_HEADER = bytes(
+    [0x12, 0xFA, 0x01, 0xE8, 0xAB, 0xCD, 0xEF, 0x98, 0x76, 0x54, 0x32, 0x10]
+)
+# payload type byte following the common header of a bulk transfer
+PAYLOAD_GIF = 0x01
+PAYLOAD_RGBA = 0x02
+PAYLOAD_Q565 = 0x08
+_BULK_HEADER_LENGTH = len(COMMON_WRITE_HEADER) + 8
+
+# --simulate[=name] picks the simulated device by name ("elite" by default),
+# --simulate-bandwidth is in MB/s and --simulate-latency in ms per HID report
+SIMULATE = argValue("simulate") or ("--simulate" in sys.argv and "elite") or None
+SIMULATE_BANDWIDTH = float(argValue("simulate-bandwidth", 40)) * 1024 * 1024
+SIMULATE_LATENCY = float(argValue("simulate-latency", 1)) / 1000
+
+
+def _find_bulk_path_from_registry(vid: int, pid: int) -> str:
+    """
+    Find the WinUSB bulk device interface path from the Windows registry.
+    Reads HKLM\\SYSTEM\\CurrentControlSet\\Control\\DeviceClasses\\{NZXT_GUID}
+    which contains the exact registered device interface paths — no enumeration,
+    no touching other HID devices, no mouse freezes.
+    """
+    import winreg
+
+    guid_upper = _NZXT_GUID.upper()
+    vid_pid = "VID_{:04X}&PID_{:04X}".format(vid, pid)
+
+    # DeviceClasses stores registered interface paths as subkey names.
+    # Format: ##?#USB#VID_1E71&PID_3012&MI_00#instance#{GUID}
+    # We convert ## -> \\? to get the actual device path.
+    try:
+        base = r"SYSTEM\CurrentControlSet\Control\DeviceClasses\\" + guid_upper
+        key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, base)
+        i = 0
+        best = None
+        while True:
+            try:
+                name = winreg.EnumKey(key, i)
+                i += 1
+                if vid_pid in name.upper():
+                    # Prefer MI_00 (bulk), accept MI_01 as fallback
+                    if "MI_00" in name.upper():
+                        best = name
+                        break
+                    elif best is None:
+                        best = name
+            except OSError:
+                break
+        winreg.CloseKey(key)
+
+        if best is not None:
+            # Convert registry key name to device path:
+            # ##?#USB#VID_...  ->  \\?\USB#VID_...
+            path = best.replace("##?#", "\\\\?\\")
+            # The registry key name uses # as separator throughout - that's correct
+            return path
+    except Exception:
+        pass
+
+    # Fallback: enumerate USB instances directly
+    try:
+        for mi_suffix in ["&MI_00", "&MI_01"]:
+            subkey = "VID_{:04X}&PID_{:04X}{}".format(vid, pid, mi_suffix)
+            try:
+                key = winreg.OpenKey(
+                    winreg.HKEY_LOCAL_MACHINE,
+                    r"SYSTEM\CurrentControlSet\Enum\USB\\" + subkey
+                )
+                try:
+                    instance = winreg.EnumKey(key, 0)
+                    path = "\\\\?\\usb#{}#{}#{}".format(
+                        subkey.lower(), instance.lower(), _NZXT_GUID
+                    )
+                    return path
+                finally:
+                    winreg.CloseKey(key)
+            except Exception:
+                continue
+    except Exception:
+        pass
+
+    return None
+
+
+def openTransport(devices):
+    """Transport for the first connected device, or the simulated one with --simulate."""
+    if SIMULATE:
+        for dev in devices:
+            if SIMULATE.lower() in dev["name"].lower().replace(" ", ""):
+                return SimulatedTransport(
+                    dev["pid"], dev["resolution"], dev["totalBuckets"]
+                )
+        raise Exception("No supported device named {!r} to simulate".format(SIMULATE))
+    return UsbTransport(devices)
+
+
+class UsbTransport:
+    simulated = False
+
+    def __init__(self, devices):
+        import hid
+        from winusbcdc import WinUsbPy
+
+        for dev in devices:
+            info = hid.enumerate(_NZXT_VID, dev["pid"])
+            if len(info) > 0:
+                self.hidInfo = info[0]
+                self.pid = dev["pid"]
+                print()
+                break
+        else:
+            raise Exception("No supported device found")
+
+        try:
+            self.serial = self.hidInfo["serial_number"]
+            self.hidDev = hid.device()
+            self.hidDev.open_path(self.hidInfo["path"])
+            self.bulkDev = WinUsbPy()
+
+            # Look up the WinUSB bulk interface path from the Windows registry.
+            # This avoids list_usb_devices() which enumerates ALL HID devices
+            # (including Razer ghost entries) causing mouse freezes.
+            bulk_path = _find_bulk_path_from_registry(_NZXT_VID, self.pid)
+            if bulk_path is None:
+                raise Exception("Could not find NZXT device in registry")
+            self.bulkDev.init_winusb_device_with_path(bulk_path)
+
+        except Exception:
+            raise Exception("Could not connect to kraken device. Is NZXT CAM closed ?")
+
+    def read(self, length: int, timeout: int):
+        self.hidDev.set_nonblocking(False)
+        return self.hidDev.read(max_length=length, timeout_ms=timeout)
+
+    def write(self, report) -> int:
+        self.hidDev.set_nonblocking(False)
+        return self.hidDev.write(report)
+
+    def bulkWrite(self, data) -> None:
+        # WinUsbPy copies through ctypes.create_string_buffer, which only takes bytes
+        self.bulkDev.write(0x2, bytes(data))
+
+    def clear(self) -> int:
+        if self.hidDev.set_nonblocking(True) == 0:
+            timeout_ms = 0
+        else:
+            timeout_ms = 1
+        discarded = 0
+        while self.hidDev.read(max_length=64, timeout_ms=timeout_ms):
+            discarded += 1
+        return discarded
+
+
+class SimulatedTransport:
+    """
+    In-memory Kraken speaking the NZXT command protocol: bucket create and
+    delete (0x32), bulk write start/end (0x36), display mode (0x38),
+    brightness (0x30) and stats (0x74). Every HID report costs `latency`
+    seconds and bulk payloads are throttled to `bandwidth` bytes per second.
+
+    Completed payloads are checked against their declared length and type,
+    and fully decoded only when decode is set since the python Q565 decoder
+    is far slower than the device; screen() decodes whatever is displayed.
+    Reads never block: an empty queue is reported as a timeout straight away.
+    """
+
+    simulated = True
+
+    def __init__(
+        self,
+        pid: int,
+        resolution,
+        totalBuckets=16,
+        bandwidth=SIMULATE_BANDWIDTH,
+        latency=SIMULATE_LATENCY,
+        decode=False,
+    ):
+        self.pid = pid
+        self.serial = "SIMULATED-{:04X}".format(pid)
+        self.resolution = tuple(resolution)
+        self.totalBuckets = totalBuckets
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.decode = decode
+        self.lock = threading.Lock()
+        self.replies = deque()
+
+        self.brightness = 100
+        self.mode = None
+        self.buckets = {}  # bucket -> [address, size in bytes, payload type, payload]
+        self.fastMemory = None  # (payload type, payload) of the last Q565 write
+        self.displayed = None
+        self.transfer = None
+        self.liquid = 31.4
+        self.pump = 60
+        self.counters = {"reports": 0, "bulkBytes": 0, "frames": 0, "failures": 0}
+        self.commands = {
+            (0x30, 0x02): self.onBrightness,
+            (0x32, 0x01): self.onCreateBucket,
+            (0x32, 0x02): self.onDeleteBucket,
+            (0x36, 0x01): self.onWriteStart,
+            (0x36, 0x02): self.onWriteEnd,
+            (0x38, 0x01): self.onLcdMode,
+            (0x74, 0x01): self.onStats,
+        }
+
+    def delay(self, seconds: float):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def reply(self, command, status=True, fields=None):
+        report = [0] * 64
+        report[0] = command[0] + 1
+        report[1] = command[1]
+        report[14] = 1 if status else 0
+        for offset, value in (fields or {}).items():
+            report[offset] = value
+        if not status:
+            self.counters["failures"] += 1
+        self.replies.append(report)
+
+    def read(self, length: int, timeout: int):
+        with self.lock:
+            return self.replies.popleft()[:length] if self.replies else []
+
+    def write(self, report) -> int:
+        self.delay(self.latency)
+        with self.lock:
+            self.counters["reports"] += 1
+            command = (report[0], report[1])
+            handler = self.commands.get(command)
+            if handler is None:
+                debugUsb("simulated kraken: ignoring command {:02x}{:02x}".format(*command))
+            else:
+                handler(command, report)
+        return len(report)
+
+    def bulkWrite(self, data) -> None:
+        self.delay(len(data) / self.bandwidth)
+        with self.lock:
+            self.counters["bulkBytes"] += len(data)
+            if self.transfer is not None:
+                self.transfer["received"] += data
+
+    def clear(self) -> int:
+        with self.lock:
+            discarded = len(self.replies)
+            self.replies.clear()
+        return discarded
+
+    def onBrightness(self, command, report):
+        self.brightness = report[3]
+
+    def onCreateBucket(self, command, report):
+        bucket = report[2]
+        ok = bucket < self.totalBuckets and bucket not in self.buckets
+        if ok:
+            address = int.from_bytes(bytes(report[4:6]), "little")
+            size = int.from_bytes(bytes(report[6:8]), "little") * 1024
+            self.buckets[bucket] = [address, size, None, None]
+        self.reply(command, ok)
+
+    def onDeleteBucket(self, command, report):
+        self.buckets.pop(report[2], None)
+        self.reply(command)
+
+    def onWriteStart(self, command, report):
+        # a 4th byte of 1 targets the fast memory the Elite streams Q565 frames to
+        self.transfer = {"fast": report[3] == 1, "received": bytearray()}
+        self.reply(command)
+
+    def onWriteEnd(self, command, report):
+        transfer, self.transfer = self.transfer, None
+        bucket = report[2]
+        ok = transfer is not None and (transfer["fast"] or bucket in self.buckets)
+        if ok:
+            payload = self.parseTransfer(transfer["received"])
+            ok = payload is not None
+        if ok and not transfer["fast"]:
+            ok = len(payload[1]) <= self.buckets[bucket][1]
+        if ok:
+            self.counters["frames"] += 1
+            if transfer["fast"]:
+                self.fastMemory = payload
+                self.displayed = payload
+            else:
+                self.buckets[bucket][2:] = payload
+        self.reply(command, ok)
+
+    def parseTransfer(self, received: bytearray):
+        """(payload type, payload) of a complete bulk transfer, or None if malformed."""
+        if len(received) < _BULK_HEADER_LENGTH:
+            return None
+        if bytes(received[: len(COMMON_WRITE_HEADER)]) != COMMON_WRITE_HEADER:
+            return None
+        payloadType = received[len(COMMON_WRITE_HEADER)]
+        length = int.from_bytes(received[_BULK_HEADER_LENGTH - 4 : _BULK_HEADER_LENGTH], "little")
+        payload = bytes(received[_BULK_HEADER_LENGTH:])
+        if len(payload) != length:
+            return None
+        try:
+            if payloadType == PAYLOAD_Q565:
+                if q565.decodeHeader(payload) != self.resolution:
+                    return None
+            elif payloadType == PAYLOAD_RGBA:
+                if length != self.resolution[0] * self.resolution[1] * 4:
+                    return None
+            elif payloadType != PAYLOAD_GIF:
+                return None
+            if self.decode:
+                self.decodePayload(payloadType, payload)
+        except Exception as e:
+            debugUsb("simulated kraken: rejecting payload: {}".format(e))
+            return None
+        return payloadType, payload
+
+    def decodePayload(self, payloadType: int, payload: bytes) -> Image.Image:
+        if payloadType == PAYLOAD_Q565:
+            return q565.decode_to_img(payload)
+        if payloadType == PAYLOAD_RGBA:
+            return Image.frombytes("RGB", self.resolution, payload, "raw", "RGBX")
+        img = Image.open(BytesIO(payload))
+        img.load()
+        return img
+
+    def onLcdMode(self, command, report):
+        mode, bucket = report[2], report[3]
+        # 4 and 5 are the bucket modes, 2 the liquid temperature screen
+        ok = mode in (2, 4, 5) and bucket < self.totalBuckets
+        if ok:
+            self.mode = mode
+            if mode == 2:
+                self.displayed = None
+            elif bucket in self.buckets and self.buckets[bucket][3] is not None:
+                self.displayed = tuple(self.buckets[bucket][2:])
+            else:
+                self.displayed = self.fastMemory
+        self.reply(command, ok)
+
+    def onStats(self, command, report):
+        liquid = round(self.liquid * 10)
+        self.reply(
+            command,
+            fields={15: liquid // 10, 16: liquid % 10, 19: self.pump},
+        )
+
+    def screen(self) -> Image.Image:
+        """Decoded image currently on the simulated display, or None."""
+        with self.lock:
+            displayed = self.displayed
+        if displayed is None:
+            return None
+        return self.decodePayload(*displayed)
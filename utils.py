@@ -1,8 +1,8 @@
-import threading
 import time
 import sys
 import collections
-from threading import Lock, Timer
+from threading import Timer
+from metrics import recorder
 
 DEBUG = "--debug" in sys.argv
 DEBUG_USB = "--debug-usb" in sys.argv
@@ -10,6 +10,15 @@ DEBUG_TIMINGS = "--debug-timings" in sys.argv
 DEBUG_Q565 = "--debug-q565" in sys.argv
 
 
+def argValue(name, default=None):
+    """Value of a --name=value command line option, or default."""
+    prefix = "--{}=".format(name)
+    for arg in sys.argv[1:]:
+        if arg.startswith(prefix):
+            return arg[len(prefix) :]
+    return default
+
+
 def debug(*args, **kwargs):
     if DEBUG:
         print(*args, **kwargs)
@@ -25,59 +34,19 @@ def debugQ565(*args, **kwargs):
         print(*args, **kwargs)
 
 
-timingStack = {}
-lock = Lock()
-
-
-def printTiming(entry):
-    def inner(entry, connection, indent="", isLastChild=True):
-        header = "┬" if len(entry["childs"]) > 0 else "─"
-        tree = indent + connection + header + "─"
-        print(
-            "{} {} took {:.2f}ms".format(
-                tree,
-                entry["name"],
-                (entry["end"] - entry["start"]) * 1000,
-                entry["threadName"],
-            )
-        )
-        for index, child in enumerate(entry["childs"]):
-            isChildLastChild = index == (len(entry["childs"]) - 1)
-            connection = "└─" if isChildLastChild else "├─"
-            nextIndent = "  " if isLastChild else "│ "
-            inner(child, connection, indent + nextIndent, isChildLastChild)
-
-    try:
-        lock.acquire()
-        inner(entry, entry["threadName"][0] + "─")
-    finally:
-        lock.release()
+# --debug-timings prints a summary of the recorded spans every
+# --timings-interval seconds (10 by default), /metrics serves them always
+if DEBUG_TIMINGS:
+    recorder.startSummary(float(argValue("timings-interval", 10)))
 
 
 def timing(func):
-    def inner(*args, **kwargs):
-        start = time.time()
-        threadId = threading.get_ident()
-        entry = {
-            "threadName": threading.current_thread().name,
-            "name": func.__name__,
-            "childs": [],
-            "start": start,
-        }
-
-        if not threadId in timingStack:
-            timingStack[threadId] = []
-        timingStack[threadId].append(entry)
-        res = func(*args, **kwargs)
-        entry["end"] = time.time()
-        timingStack[threadId].pop()
-        if len(timingStack[threadId]) > 0:
-            timingStack[threadId][-1]["childs"].append(entry)
-        else:
-            printTiming(entry)
-        return res
+    return recorder.span(func.__qualname__, func)
+
 
-    return inner if DEBUG_TIMINGS else func
+def timingNote(note):
+    """Append note to the name of the innermost @timing call on this thread."""
+    recorder.note(note)
 
 
 def debounce(wait, lock=None):
@@ -137,3 +106,32 @@ class FPS:
             self.value = 0.0
 
         return self.value
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, maxSize=16):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
@@ -1,41 +1,136 @@
+import hashlib
 import time
 import driver
 import time
-import queue
-from threading import Thread
-from utils import FPS, debug
+from threading import Condition, Thread
+from utils import FPS, argValue, debug
+
+# Identical frames are not re-sent, and the last frame is re-sent once every
+# KEEPALIVE_INTERVAL seconds without a write so the device keeps getting
+# traffic. 0 disables both.
+KEEPALIVE_INTERVAL = float(argValue("keepalive", 5))
+
+
+class FrameMailbox:
+    """Single-slot buffer where a new frame replaces any frame not yet taken.
+
+    Consumers block in get() until something arrives instead of polling, and
+    producers that can pace themselves wait in waitEmpty() before doing work
+    that would only be dropped.
+    """
+
+    def __init__(self):
+        self.condition = Condition()
+        self.item = None
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """Take the latest item, or None if nothing arrived within timeout."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.item is not None, timeout):
+                return None
+            item, self.item = self.item, None
+            self.condition.notify_all()
+            return item
+
+    def discard(self):
+        """Count an item the consumer took but dropped as stale."""
+        with self.condition:
+            self.dropped += 1
+
+    def waitEmpty(self, timeout=None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: self.item is None, timeout)
 
 
 class FrameWriter(Thread):
-    def __init__(self, frameBuffer: queue.Queue, lcd: driver.KrakenLCD):
+    def __init__(
+        self,
+        frameBuffer: FrameMailbox,
+        lcd: driver.KrakenLCD,
+        keepAliveInterval: float = KEEPALIVE_INTERVAL,
+    ):
         Thread.__init__(self, name="FrameWriter")
         self.daemon = True
         self.shouldStop = False
         self.frameBuffer = frameBuffer
         self.frameCount = 0
+        self.skippedFrames = 0
         self.lcd = lcd
         self.lastDataTime = 0
+        self.keepAliveInterval = keepAliveInterval
+        self.lastFrameKey = None
+        self.lastFrame = None
+        self.lastWriteTime = 0
+        self.keepAlives = 0
         self.fps = FPS()
 
     def run(self):
         debug("Frame writer started")
         while not self.shouldStop:
-            if self.frameBuffer.empty():
-                time.sleep(0.001)
-                continue
+            # the timeout only bounds how long shouldStop goes unnoticed
+            item = self.frameBuffer.get(timeout=0.5)
+            if item is not None:
+                self.onFrame(*item)
+            else:
+                self.keepAlive()
+
+    def frameKey(self, frame):
+        # a new stream (e.g. after GIF playback) must always get its first frame
+        return (self.lcd.streamEpoch, hashlib.blake2b(frame, digest_size=16).digest())
+
+    def isDuplicate(self, frameKey) -> bool:
+        return (
+            frameKey == self.lastFrameKey
+            and time.time() - self.lastWriteTime < self.keepAliveInterval
+        )
+
+    def writeFrame(self, frame) -> bool:
+        return self.lcd.writeFrame(frame)
 
-            self.onFrame()
+    def keepAlive(self):
+        """Re-send the last frame once the producer went quiet for keepAliveInterval."""
+        if (
+            self.keepAliveInterval <= 0
+            or self.lastFrameKey is None
+            or self.lastFrameKey[0] != self.lcd.streamEpoch
+            or time.time() - self.lastWriteTime < self.keepAliveInterval
+        ):
+            return
+        if not self.writeFrame(self.lastFrame):
+            self.lastFrameKey = self.lastFrame = None
+            return
+        self.lastWriteTime = time.time()
+        self.keepAlives += 1
 
-    def onFrame(self):
-        (frame, rawTime, gifTime) = self.frameBuffer.get()
+    def onFrame(self, frame, rawTime, gifTime):
+        frameKey = self.frameKey(frame)
+        if self.isDuplicate(frameKey):
+            # same bytes, but the newest frame is the one its encoder keeps
+            # valid the longest
+            self.lastFrame = frame
+            self.skippedFrames += 1
+            return
 
         startTime = time.time()
-        self.lcd.writeFrame(frame)
-        writeTime = time.time() - startTime
+        if not self.writeFrame(frame):
+            self.lastFrameKey = self.lastFrame = None
+            return
+        self.lastFrameKey = frameKey
+        self.lastFrame = frame
+        self.lastWriteTime = time.time()
+        writeTime = self.lastWriteTime - startTime
         freeTime = rawTime - writeTime
 
         debug(
-            "FPS: {:4.1f} - Frame {:5} (size: {:7}) - raw {:6.2f}ms, gif {:6.2f}ms, write {:6.2f}ms, free time {: 7.2f}ms ".format(
+            "FPS: {:4.1f} - Frame {:5} (size: {:7}) - raw {:6.2f}ms, gif {:6.2f}ms, write {:6.2f}ms, free time {: 7.2f}ms, skipped {:5}, dropped {:5}".format(
                 self.fps(),
                 self.frameCount,
                 len(frame),
@@ -43,6 +138,8 @@ class FrameWriter(Thread):
                 gifTime * 1000,
                 writeTime * 1000,
                 freeTime * 1000,
+                self.skippedFrames,
+                self.frameBuffer.dropped,
             )
         )
         self.frameCount += 1